@@ -6,31 +6,145 @@ This class is used as a common interface for message adapters.
 """
 
 import asyncio
-from typing import Callable, Coroutine
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from ..logger import Logger
+from ..serializers import adapter_message_serializer as ams
+from ..serializers.codecs import JSON_CODEC, RAW, Codec, get_codec
+from ..serializers.errors import UnknownCodecError
+from . import chunking
+from .dispatcher import Dispatcher
+from .errors import ChunkingError, InvalidTopicPatternError
+from .peer import (
+    DEFAULT_BLOCK_TIMEOUT,
+    DEFAULT_MAX_QUEUE_SIZE,
+    FRAME,
+    OverflowPolicy,
+    Peer,
+)
+from .priority import PriorityClass, TopicPriorities
+from .topic_trie import TopicTrie, is_pattern, matches, validate_pattern
 
 logger = Logger("Adapter")
 
+# Control topics exchanged between adapters, never delivered to subscribers
+SUBSCRIBE_TOPIC = "control/subscribe"
+UNSUBSCRIBE_TOPIC = "control/unsubscribe"
+HELLO_TOPIC = "control/hello"
+# Several messages in one frame, as a list of [topic, message] pairs
+BATCH_TOPIC = "control/batch"
+# Part of a large message, as a raw header and chunk, or as
+# [transfer id, offset, total size, chunk] on transports without raw frames
+CHUNK_TOPIC = "control/chunk"
+CONTROL_TOPICS = (
+    SUBSCRIBE_TOPIC,
+    UNSUBSCRIBE_TOPIC,
+    HELLO_TOPIC,
+    BATCH_TOPIC,
+    CHUNK_TOPIC,
+)
+
+CALLBACK = Callable[..., Coroutine[None, None, None]]
+
+# Peer the message handled by the running subscriber callback came from
+_sender: ContextVar[Optional[Peer]] = ContextVar("sender", default=None)
+
+
+class _Transfer:
+    # Encoded message too large for a single frame, split for every peer
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
 
 class Adapter:
-    def __init__(self, logger: Logger = logger) -> None:
+    def __init__(
+        self,
+        logger: Logger = logger,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+        dispatcher: Optional[Dispatcher] = None,
+        codec: str = JSON_CODEC,
+        chunk_size: Optional[int] = chunking.DEFAULT_CHUNK_SIZE,
+        max_reassembly_size: int = chunking.DEFAULT_MAX_REASSEMBLY_SIZE,
+        priority_classes: Optional[Sequence[PriorityClass]] = None,
+    ) -> None:
         # Protected members
         """
         Initialize the adapter.
 
         :param logger: The logger to use for logging.
+        :param max_queue_size: The maximum number of frames queued per connection
+        :param overflow_policy: What to do with a frame when the queue of a
+            connection is full
+        :param block_timeout: How long publishing may wait for room, in seconds,
+            when the overflow policy is BLOCK
+        :param dispatcher: The dispatcher running the subscriber callbacks. A
+            dispatcher with default limits is created if None.
+        :param codec: The name of the codec clients propose to the server when
+            connecting, falling back to JSON if it is refused. Servers use the
+            codec proposed by each client if they can.
+        :param chunk_size: The size above which encoded messages are split into
+            chunks interleaved with other frames, None to never split them
+        :param max_reassembly_size: The maximum number of bytes held by the
+            incomplete chunked messages received on a connection
+        :param priority_classes: The priority classes of the frames sent to
+            every connection, highest priority first, see `priority`. None to
+            send frames in the order they are published.
+        :raises UnknownCodecError: If the codec is not registered
+        :raises ValueError: If the priority classes are invalid
         """
         # Private members
-        self.__subscribtions: dict[
-            str, Callable[[str], Coroutine[None, None, None]]
-        ] = dict()
+        # Callbacks by topic pattern, each paired with whether it expects the topic
+        self.__subscribtions: TopicTrie[tuple[CALLBACK, bool]] = TopicTrie()
+        self.__dispatcher = dispatcher if dispatcher is not None else Dispatcher()
+        # Topics with a full dispatch queue, by the peer that filled them
+        self.__full_topics: dict[Peer, set[str]] = dict()
+        self.__codec = get_codec(codec)
 
         self.__is_server: bool = False
         self.__is_connected: bool = False
 
+        # Connected peers and, on servers, the peers subscribed to each topic
+        self.__peers: set[Peer] = set()
+        self.__routes: TopicTrie[Peer] = TopicTrie()
+        self.__peer_topics: dict[Peer, set[str]] = dict()
+        # Last message of retained topics, sent to peers when they subscribe
+        self.__retained: dict[str, Any] = dict()
+
+        # Chunked messages being sent and received
+        self.__chunk_size = chunk_size
+        self.__max_reassembly_size = max_reassembly_size
+        self.__transfer_id = 0
+        self.__assemblers: dict[Peer, chunking.ChunkAssembler] = dict()
+
+        self.__priorities = (
+            TopicPriorities(priority_classes) if priority_classes is not None else None
+        )
+
         # Protected methods
         self._logger = logger
+        self._peer_options = {
+            "max_queue_size": max_queue_size,
+            "overflow_policy": overflow_policy,
+            "block_timeout": block_timeout,
+        }
+        if self.__priorities is not None:
+            self._peer_options["priority_weights"] = self.__priorities.weights()
 
     # protected methods
     def _update_connection_status(self, is_server: bool, is_connected: bool) -> None:
@@ -53,20 +167,200 @@ class Adapter:
         self.__is_server = is_server
         self.__is_connected = is_connected
 
-    def _notify_subscriber(self, topic: str, message: str) -> None:
+    def _notify_subscriber(
+        self, topic: str, message: Any, peer: Optional[Peer] = None
+    ) -> None:
         """
         Notify all subscribers of a message.
 
-        If the topic is not known, a warning is logged.
+        Callbacks subscribed with a wildcard pattern also receive the topic.
+        Callbacks of the same topic run in the order their messages arrived.
+        If no subscription matches the topic, a warning is logged.
+
+        :param topic: The topic of the message
+        :param message: The message to notify. A `Payload` is only decoded
+            when the first callback runs, and not at all if nobody subscribed.
+        :param peer: The peer the message was received from, see `sender`
+        """
+        callbacks = self.__subscribtions.match(topic)
+
+        if not callbacks:
+            self._logger.warning("Unknown topic [%s]", topic)
+            return
+
+        for callback, with_topic in callbacks:
+            if with_topic:
+                is_full = self.__dispatcher.dispatch(
+                    topic, self.__deliver, topic, peer, callback, message, topic
+                )
+            else:
+                is_full = self.__dispatcher.dispatch(
+                    topic, self.__deliver, topic, peer, callback, message
+                )
+
+            if is_full and peer is not None:
+                self.__full_topics.setdefault(peer, set()).add(topic)
+
+    async def _wait_for_dispatch(self, peer: Optional[Peer] = None) -> None:
+        """
+        Wait until the subscriber callbacks caught up with received messages.
+
+        Subclasses should call this method between reads so that a flood of
+        messages slows down reading from the connection instead of queueing
+        without bound.
+
+        :param peer: The peer read from, which only waits for the topics it
+            sent messages of. None to wait for all topics.
+        """
+        if peer is None:
+            await self.__dispatcher.wait_for_capacity()
+        else:
+            await self.__dispatcher.wait_for_capacity(self.__full_topics.pop(peer, ()))
+
+    def _frame(self, data: bytes, codec: Codec) -> FRAME:
+        """
+        Turn an encoded message into a frame ready to be queued on a peer.
+
+        Subclasses may override this method to add transport specific framing.
+
+        :param data: The message encoded by `ams.encode`
+        :param codec: The codec the message was encoded with
+        :return: The frame
+        :raises SerializationError: If the message cannot be framed
+        """
+        return data
+
+    def _encode_frame(self, topic: str, message: Any, codec: Codec) -> FRAME:
+        """
+        Encode a message into a frame ready to be queued on a peer.
+
+        :param topic: The topic of the message
+        :param message: The message to encode
+        :param codec: The codec negotiated with the peer
+        :return: The encoded frame
+        :raises SerializationError: If the message cannot be encoded
+        """
+        return self._frame(
+            ams.encode(topic, message, codec), ams.message_codec(message, codec)
+        )
+
+    def _accepts_codec(self, codec: Codec) -> bool:
+        """
+        Check if a codec can be used on the connections of the adapter.
+
+        Subclasses may override this method if their transport cannot carry
+        every codec.
+
+        :param codec: The codec to check
+        :return: True if the codec can be used, False otherwise
+        """
+        return True
+
+    def _add_peer(self, peer: Peer) -> None:
+        """
+        Register a new connection and start its writer.
+
+        Clients announce all of their subscriptions to the new connection.
+
+        :param peer: The peer of the new connection
+        """
+        self.__peers.add(peer)
+        self.__peer_topics[peer] = set()
+        self.__assemblers[peer] = chunking.ChunkAssembler(self.__max_reassembly_size)
+        peer.start()
+
+        if not self.is_server():
+            # Offered before anything else, JSON is what the server knows anyway
+            if self.__codec.name != JSON_CODEC:
+                self.__send_control(
+                    peer, HELLO_TOPIC, ",".join([self.__codec.name, JSON_CODEC])
+                )
+
+            # Sent together, so that the server answers with a single
+            # snapshot of the retained messages
+            subscriptions = [
+                [SUBSCRIBE_TOPIC, topic] for topic in self.__subscribtions.patterns()
+            ]
+            if len(subscriptions) == 1:
+                self.__send_control(peer, *subscriptions[0])
+            elif subscriptions:
+                self.__send_control(peer, BATCH_TOPIC, subscriptions)
+
+    def _remove_peer(self, peer: Peer) -> None:
+        """
+        Unregister a closed connection and forget its subscriptions.
+
+        :param peer: The peer of the closed connection
+        """
+        peer.close()
+        self.__peers.discard(peer)
+        self.__assemblers.pop(peer, None)
+        self.__full_topics.pop(peer, None)
+
+        for topic in self.__peer_topics.pop(peer, set()):
+            self.__routes.remove(topic, peer)
+
+    def _handle_message(self, peer: Peer, topic: str, message: Any) -> None:
+        """
+        Handle a message received from a peer.
 
+        Control messages update the routing table, all other messages are
+        passed on to the subscribers.
+
+        :param peer: The peer the message was received from
         :param topic: The topic of the message
-        :param message: The message to notify
+        :param message: The message, or its still encoded `Payload`
         """
-        if topic in self.__subscribtions:
-            asyncio.create_task(self.__subscribtions[topic](message))
+        if topic not in CONTROL_TOPICS:
+            self._notify_subscriber(topic, message, peer)
+            return
+
+        try:
+            if isinstance(message, ams.Payload):
+                message = message.value()
+        except ams.DeserializationError as e:
+            self._logger.error("Invalid control message from %s: %s", peer.name(), e)
+            return
+
+        if topic == BATCH_TOPIC:
+            self.__handle_batch(peer, message)
+            return
+
+        if topic == CHUNK_TOPIC:
+            self.__handle_chunk(peer, message)
+            return
+
+        if not isinstance(message, str):
+            self._logger.error("Invalid control message from %s", peer.name())
             return
 
-        self._logger.warning("Unknown topic [%s]", topic)
+        if topic == SUBSCRIBE_TOPIC:
+            if self.__add_route(peer, message):
+                self.__send_retained(peer, [message])
+            return
+
+        if topic == HELLO_TOPIC:
+            self.__negotiate_codec(peer, message)
+            return
+
+        if topic == UNSUBSCRIBE_TOPIC:
+            self._logger.debug("%s unsubscribed from [%s]", peer.name(), message)
+            self.__peer_topics[peer].discard(message)
+            self.__routes.remove(message, peer)
+
+    def _route(self, topic: str) -> Iterable[Peer]:
+        """
+        Get the peers a message on a topic has to be sent to.
+
+        Servers only send to peers that subscribed to the topic, clients send
+        everything to the server.
+
+        :param topic: The topic of the message
+        :return: The peers to send the message to
+        """
+        if self.is_server():
+            return self.__routes.match(topic)
+        return self.__peers
 
     def _log_already_connected(self) -> None:
         """
@@ -81,6 +375,280 @@ class Adapter:
             "server" if self.__is_server else "client",
         )
 
+    # Private methods
+    async def __deliver(
+        self,
+        topic: str,
+        peer: Optional[Peer],
+        callback: CALLBACK,
+        message: Any,
+        *args: Any,
+    ) -> None:
+        if isinstance(message, ams.Payload):
+            try:
+                message = message.value()
+            except ams.DeserializationError as e:
+                self._logger.error("Invalid message on topic [%s]: %s", topic, e)
+                return
+
+        token = _sender.set(peer)
+        try:
+            await callback(message, *args)
+        finally:
+            _sender.reset(token)
+
+    def __negotiate_codec(self, peer: Peer, message: str) -> None:
+        if not self.is_server():
+            # The server answered with the codec it chose
+            try:
+                codec = get_codec(message)
+            except UnknownCodecError as e:
+                self._logger.error("Server chose an unusable codec: %s", e)
+                return
+
+            self._logger.debug("Using codec [%s] with %s", codec.name, peer.name())
+            peer.set_codec(codec)
+            return
+
+        # The first proposed codec the server can use wins
+        for name in message.split(","):
+            try:
+                codec = get_codec(name)
+            except UnknownCodecError:
+                continue
+
+            if self._accepts_codec(codec):
+                break
+        else:
+            codec = get_codec(JSON_CODEC)
+
+        # The answer is still encoded with the codec the client expects
+        self.__send_control(peer, HELLO_TOPIC, codec.name)
+
+        self._logger.debug("Using codec [%s] with %s", codec.name, peer.name())
+        peer.set_codec(codec)
+
+    def __handle_batch(self, peer: Peer, batch: Any) -> None:
+        if not isinstance(batch, list):
+            self._logger.error("Invalid batch from %s", peer.name())
+            return
+
+        # Subscriptions in a row get a single snapshot of retained messages
+        subscriptions: list[str] = []
+        for entry in batch:
+            if (
+                not isinstance(entry, list)
+                or len(entry) != 2
+                or not isinstance(entry[0], str)
+                or entry[0] == BATCH_TOPIC
+            ):
+                self._logger.error("Invalid batch entry from %s", peer.name())
+                continue
+
+            if entry[0] == SUBSCRIBE_TOPIC:
+                if self.__add_route(peer, entry[1]):
+                    subscriptions.append(entry[1])
+                continue
+
+            if subscriptions:
+                self.__send_retained(peer, subscriptions)
+                subscriptions = []
+            self._handle_message(peer, entry[0], entry[1])
+
+        if subscriptions:
+            self.__send_retained(peer, subscriptions)
+
+    def __add_route(self, peer: Peer, pattern: Any) -> bool:
+        if not isinstance(pattern, str):
+            self._logger.error("Invalid subscription from %s", peer.name())
+            return False
+
+        self._logger.debug("%s subscribed to [%s]", peer.name(), pattern)
+        try:
+            self.__routes.add(pattern, peer)
+        except InvalidTopicPatternError as e:
+            self._logger.error("Invalid subscription from %s: %s", peer.name(), e)
+            return False
+
+        self.__peer_topics[peer].add(pattern)
+        return True
+
+    def __handle_chunk(self, peer: Peer, message: Any) -> None:
+        assembler = self.__assemblers.get(peer)
+
+        if assembler is None:
+            self._logger.error("Invalid chunk from %s", peer.name())
+            return
+
+        try:
+            if isinstance(message, memoryview):
+                transfer_id, offset, total_size, data = chunking.decode_chunk(message)
+            elif (
+                isinstance(message, list)
+                and len(message) == 4
+                and all(
+                    isinstance(value, int) and not isinstance(value, bool)
+                    for value in message[:3]
+                )
+                and isinstance(message[3], (bytes, str))
+            ):
+                transfer_id, offset, total_size, data = message
+                if isinstance(data, str):
+                    data = data.encode("utf-8")
+            else:
+                self._logger.error("Invalid chunk from %s", peer.name())
+                return
+
+            frame = assembler.feed(transfer_id, offset, total_size, data)
+        except ChunkingError as e:
+            self._logger.error("Dropped chunked message from %s: %s", peer.name(), e)
+            return
+
+        if frame is None:
+            return
+
+        try:
+            topic, payload = ams.decode_frame(frame)
+        except ams.DeserializationError as e:
+            self._logger.error("Invalid chunked message from %s: %s", peer.name(), e)
+            return
+
+        if topic == CHUNK_TOPIC:
+            self._logger.error("Nested chunked message from %s", peer.name())
+            return
+
+        self._handle_message(peer, topic, payload)
+
+    def __encode(
+        self, topic: str, message: Any, codec: Codec
+    ) -> Union[FRAME, _Transfer]:
+        message_codec = ams.message_codec(message, codec)
+        if not self._accepts_codec(message_codec):
+            raise ams.SerializationError(
+                "Codec [%s] not supported by the transport" % message_codec.name
+            )
+
+        data = ams.encode(topic, message, codec)
+
+        if self.__chunk_size is not None and len(data) > self.__chunk_size:
+            return _Transfer(data)
+        return self._frame(data, message_codec)
+
+    def __chunks(self, transfer_id: int, data: bytes, codec: Codec) -> Iterator[FRAME]:
+        if not self._accepts_codec(RAW):
+            for offset, chunk in chunking.split(data, self.__chunk_size, codec.is_text):
+                yield self._encode_frame(
+                    CHUNK_TOPIC, [transfer_id, offset, len(data), chunk], codec
+                )
+            return
+
+        for offset, chunk in chunking.split(data, self.__chunk_size, False):
+            header = chunking.encode_header(transfer_id, offset, len(data))
+            yield self._frame(ams.encode_parts(CHUNK_TOPIC, (header, chunk)), RAW)
+
+    def __put_nowait(
+        self,
+        peer: Peer,
+        frame: Union[FRAME, _Transfer],
+        key: Optional[str] = None,
+        priority: int = 0,
+        topics: Sequence[str] = (),
+    ) -> bool:
+        # Chunks are produced on demand, so all peers share the encoded message
+        if isinstance(frame, _Transfer):
+            return peer.put_chunks_nowait(self.__transfer(peer, frame), key, topics)
+        return peer.put_nowait(frame, key, priority, topics)
+
+    async def __put(
+        self,
+        peer: Peer,
+        frame: Union[FRAME, _Transfer],
+        key: Optional[str] = None,
+        priority: int = 0,
+        topics: Sequence[str] = (),
+    ) -> bool:
+        if isinstance(frame, _Transfer):
+            return await peer.put_chunks(self.__transfer(peer, frame), key, topics)
+        return await peer.put(frame, key, priority, topics)
+
+    def __transfer(self, peer: Peer, transfer: _Transfer) -> Iterator[FRAME]:
+        self.__transfer_id += 1
+        return self.__chunks(self.__transfer_id, transfer.data, peer.codec())
+
+    def __priority(self, topic: str) -> int:
+        if self.__priorities is None:
+            return 0
+        return self.__priorities.classify(topic)
+
+    def __send_retained(self, peer: Peer, patterns: Sequence[str]) -> None:
+        # A message matching several of the patterns is only sent once
+        wildcards = [pattern for pattern in patterns if is_pattern(pattern)]
+        if wildcards:
+            exact = set(patterns).difference(wildcards)
+            batch = [
+                [topic, message]
+                for topic, message in self.__retained.items()
+                if topic in exact
+                or any(matches(pattern, topic) for pattern in wildcards)
+            ]
+        else:
+            batch = [
+                [topic, self.__retained[topic]]
+                for topic in dict.fromkeys(patterns)
+                if topic in self.__retained
+            ]
+
+        if not batch:
+            return
+
+        self._logger.debug(
+            "Sending %d retained messages to %s", len(batch), peer.name()
+        )
+        codec = peer.codec()
+        for indexes in self.__batches(batch, range(len(batch)), codec):
+            messages = [batch[i] for i in indexes]
+            try:
+                frame = self.__encode_batch(messages, codec)
+            except ams.SerializationError as e:
+                self._logger.error("Error while serializing retained messages: %s", e)
+                continue
+            self.__put_nowait(peer, frame, topics=[topic for topic, _ in messages])
+
+    def __batches(
+        self, messages: Sequence[Sequence[Any]], indexes: Iterable[int], codec: Codec
+    ) -> List[List[int]]:
+        # Runs of messages encoded together by the codec, and bytes-like
+        # messages and arrays on their own, as they have their own frames
+        batches: list[list[int]] = []
+        run: list[int] = []
+        for i in indexes:
+            if ams.message_codec(messages[i][1], codec) is codec:
+                run.append(i)
+                continue
+
+            if run:
+                batches.append(run)
+                run = []
+            batches.append([i])
+
+        if run:
+            batches.append(run)
+        return batches
+
+    def __encode_batch(
+        self, messages: Sequence[Sequence[Any]], codec: Codec
+    ) -> Union[FRAME, _Transfer]:
+        if len(messages) == 1:
+            topic, message = messages[0]
+            return self.__encode(topic, message, codec)
+        return self.__encode(BATCH_TOPIC, [list(item) for item in messages], codec)
+
+    def __send_control(self, peer: Peer, topic: str, message: Any) -> None:
+        try:
+            self.__put_nowait(peer, self.__encode(topic, message, peer.codec()))
+        except ams.SerializationError as e:
+            self._logger.error("Error while serializing control message: %s", e)
+
     # public methods
     async def connect(self) -> bool:
         """
@@ -115,36 +683,244 @@ class Adapter:
             return False
         return True
 
-    def subscribe(
-        self, topic: str, callback: Callable[[str], Coroutine[None, None, None]]
-    ) -> bool:
+    def subscribe(self, topic: str, callback: CALLBACK) -> bool:
         """
         Subscribe to a topic.
 
-        :param topic: The topic to subscribe to
+        The topic may be a pattern using the ``+`` and ``#`` wildcards, in which
+        case the callback is called with the message and the concrete topic.
+        Several callbacks may be subscribed to the same topic.
+
+        :param topic: The topic or topic pattern to subscribe to
         :param callback: The callback to call when a message is received
         :return: True if the subscription was successfully created, False otherwise
         """
-        if topic in self.__subscribtions:
-            logger.warning("Already subscribed to topic [%s]", topic)
+        try:
+            validate_pattern(topic)
+        except InvalidTopicPatternError as e:
+            self._logger.error("Invalid topic: %s", e)
+            return False
+
+        is_new_topic = topic not in self.__subscribtions
+
+        if not self.__subscribtions.add(topic, (callback, is_pattern(topic))):
+            self._logger.warning("Already subscribed to topic [%s]", topic)
+            return False
+
+        if is_new_topic and not self.is_server():
+            for peer in self.__peers:
+                self.__send_control(peer, SUBSCRIBE_TOPIC, topic)
+
+        return True
+
+    def unsubscribe(self, topic: str, callback: Optional[CALLBACK] = None) -> bool:
+        """
+        Unsubscribe from a topic.
+
+        :param topic: The topic or topic pattern to unsubscribe from
+        :param callback: The callback to remove. All callbacks of the topic are
+            removed if None.
+        :return: True if a subscription was removed, False otherwise
+        """
+        value = None if callback is None else (callback, is_pattern(topic))
+
+        if not self.__subscribtions.remove(topic, value):
+            self._logger.warning("Not subscribed to topic [%s]", topic)
+            return False
+
+        if topic not in self.__subscribtions and not self.is_server():
+            for peer in self.__peers:
+                self.__send_control(peer, UNSUBSCRIBE_TOPIC, topic)
+
+        return True
+
+    def retain(self, topic: str, message: Any) -> None:
+        """
+        Set the message sent to peers subscribing to a topic.
+
+        Servers send the retained messages of all topics matching a new
+        subscription in a single batch, so that subscribers get the latest
+        value without waiting for the next update.
+
+        :param topic: The topic of the message
+        :param message: The message, or None to stop retaining the topic
+        """
+        if message is None:
+            self.__retained.pop(topic, None)
+        else:
+            self.__retained[topic] = message
+
+    def sender(self) -> Optional[Peer]:
+        """
+        Get the peer the message handled by the running subscriber callback
+        was received from.
+
+        Tasks started by the callback inherit it.
+
+        :return: The peer, None outside subscriber callbacks, for messages not
+            received from a peer or once the peer is disconnected
+        """
+        peer = _sender.get()
+        if peer in self.__peers:
+            return peer
+        return None
+
+    async def send_to(self, peer: Peer, topic: str, message: Any) -> bool:
+        """
+        Send a message to a single peer, whatever it subscribed to.
+
+        Used to answer a peer, see `sender`, without other peers subscribed
+        to the topic receiving the answer.
+
+        :param peer: The peer to send the message to
+        :param topic: The topic of the message
+        :param message: The message, any value `publish` accepts
+        :return: True if the message was successfully sent, False otherwise
+        """
+        if not self.is_connected():
+            self._logger.error("Not connected")
+            return False
+
+        if peer not in self.__peers:
+            self._logger.error("%s is not connected", peer.name())
             return False
 
-        self.__subscribtions[topic] = callback
+        try:
+            frame = self.__encode(topic, message, peer.codec())
+        except ams.SerializationError as e:
+            self._logger.error(
+                "Error while serializing message: %s, topic: %s, Error: %s",
+                message,
+                topic,
+                e,
+            )
+            return False
 
+        priority = self.__priority(topic)
+        topics = (topic,)
+        if not self.__put_nowait(peer, frame, None, priority, topics):
+            return await self.__put(peer, frame, None, priority, topics)
         return True
 
-    async def publish(self, topic: str, message: str) -> bool:
+    async def publish(
+        self, topic: str, message: Any, conflate: bool = False, retain: bool = False
+    ) -> bool:
         """
         Publish a message to a topic.
 
+        The message is encoded once per codec in use and queued on every peer
+        it is routed to.
+
         :param topic: The topic to publish the message to
-        :param message: The message to publish
+        :param message: The message to publish, any value the codecs can encode.
+            It is encoded once, together with the topic. Bytes-like messages
+            are sent as they are and delivered as memoryviews.
+        :param conflate: Whether the message replaces a message of the same
+            topic still queued for a peer, for topics where only the latest
+            value matters
+        :param retain: Whether the message is also retained for peers that
+            subscribe later, see `retain`
         :return: True if the message was successfully published, False otherwise
         """
 
         if not self.is_connected():
-            logger.error("Not connected")
+            self._logger.error("Not connected")
             return False
+
+        if retain:
+            self.retain(topic, message)
+
+        frames: dict[Codec, Union[FRAME, _Transfer]] = dict()
+        key = topic if conflate else None
+        priority = self.__priority(topic)
+        topics = (topic,)
+        waiting = []
+
+        for peer in self._route(topic):
+            codec = peer.codec()
+            frame = frames.get(codec)
+
+            if frame is None:
+                try:
+                    frame = frames[codec] = self.__encode(topic, message, codec)
+                except ams.SerializationError as e:
+                    self._logger.error(
+                        "Error while serializing message: %s, topic: %s, Error: %s",
+                        message,
+                        topic,
+                        e,
+                    )
+                    return False
+
+            if not self.__put_nowait(peer, frame, key, priority, topics):
+                waiting.append(self.__put(peer, frame, key, priority, topics))
+
+        if waiting:
+            await asyncio.gather(*waiting)
+
+        return True
+
+    async def publish_batch(
+        self, messages: List[Tuple[str, Any]], retain: bool = False
+    ) -> bool:
+        """
+        Publish several messages, in a single frame per peer.
+
+        Every peer gets the messages routed to it in one batch, which its
+        adapter unpacks into the individual subscriber callbacks. Peers
+        getting the same messages share the encoded frame. Bytes-like
+        messages and arrays are sent in frames of their own, between the
+        batches of the messages before and after them.
+
+        :param messages: The topics and messages to publish, in order
+        :param retain: Whether the messages are also retained for peers that
+            subscribe later, see `retain`
+        :return: True if the messages were successfully published, False otherwise
+        """
+        if not self.is_connected():
+            self._logger.error("Not connected")
+            return False
+
+        if retain:
+            for topic, message in messages:
+                self.retain(topic, message)
+
+        # Indexes of the messages routed to each peer
+        routed: dict[Peer, list[int]] = dict()
+        priorities = [self.__priority(topic) for topic, _ in messages]
+        for i, (topic, _) in enumerate(messages):
+            for peer in self._route(topic):
+                routed.setdefault(peer, []).append(i)
+
+        frames: dict[tuple[Codec, tuple[int, ...]], Union[FRAME, _Transfer]] = dict()
+        waiting = []
+
+        for peer, routed_indexes in routed.items():
+            codec = peer.codec()
+
+            for indexes in self.__batches(messages, routed_indexes, codec):
+                key = (codec, tuple(indexes))
+                frame = frames.get(key)
+
+                if frame is None:
+                    try:
+                        frame = self.__encode_batch(
+                            [messages[i] for i in indexes], codec
+                        )
+                    except ams.SerializationError as e:
+                        self._logger.error("Error while serializing batch: %s", e)
+                        return False
+                    frames[key] = frame
+
+                # A batch is as urgent as its most urgent message
+                priority = min(priorities[i] for i in indexes)
+                topics = [messages[i][0] for i in indexes]
+                if not self.__put_nowait(peer, frame, None, priority, topics):
+                    waiting.append(self.__put(peer, frame, None, priority, topics))
+
+        if waiting:
+            await asyncio.gather(*waiting)
+
         return True
 
     def is_connected(self) -> bool:
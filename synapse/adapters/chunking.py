@@ -0,0 +1,201 @@
+"""
+Chunked transfer of large messages.
+
+An encoded message larger than the chunk size of an adapter is not queued as
+a single frame. It is split into chunks which are sent as messages of their
+own on a control topic, each holding the id of the transfer, the offset of
+the chunk, the size of the whole message and the chunk itself. Peers send
+one chunk of every transfer between the other frames they write, so small
+messages do not wait for a large one to be written completely.
+
+The receiving side copies every chunk into a buffer allocated once with the
+size of the whole message, and decodes the message when the last chunk
+arrived. Chunks of a transfer are expected in order, as they are written by
+a single writer to an ordered connection. The memory held by incomplete
+transfers of a connection is limited; transfers exceeding the limit are
+dropped.
+
+Chunks are sent as raw frames, see `ams.encode_parts`, made of a fixed size
+header and the chunk, so that a chunk is copied once into its frame and
+received as a slice of it. Transports that cannot carry raw frames send
+chunks as lists instead, and chunks of text codecs are then strings, cut on
+UTF-8 character boundaries, so that they can be encoded by codecs that
+cannot hold bytes.
+
+"""
+
+import struct
+from typing import Iterator, Optional, Tuple, Union
+
+from .errors import ChunkingError
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+DEFAULT_MAX_REASSEMBLY_SIZE = 64 * 1024 * 1024
+
+CHUNK = Union[bytes, memoryview, str]
+
+# Transfer id, offset of the chunk and size of the whole message
+_HEADER = struct.Struct(">QQQ")
+
+
+def encode_header(transfer_id: int, offset: int, total_size: int) -> bytes:
+    """
+    Encode the header of a chunk sent as a raw frame.
+
+    :param transfer_id: The id of the transfer
+    :param offset: The offset of the chunk in the message
+    :param total_size: The size of the whole message
+    :return: The header, to be followed by the chunk
+    """
+    return _HEADER.pack(transfer_id, offset, total_size)
+
+
+def decode_chunk(data: memoryview) -> Tuple[int, int, int, memoryview]:
+    """
+    Decode a chunk received as a raw frame, without copying it.
+
+    :param data: The message of the frame
+    :return: The id of the transfer, the offset of the chunk, the size of the
+        whole message and the chunk
+    :raises ChunkingError: If the message is too short to hold a header
+    """
+    if len(data) < _HEADER.size:
+        raise ChunkingError("Truncated chunk header")
+
+    transfer_id, offset, total_size = _HEADER.unpack_from(data)
+    return transfer_id, offset, total_size, data[_HEADER.size :]
+
+
+def split(data: bytes, chunk_size: int, is_text: bool) -> Iterator[Tuple[int, CHUNK]]:
+    """
+    Split an encoded message into chunks, without copying binary chunks.
+
+    :param data: The encoded message
+    :param chunk_size: The maximum size of a chunk, in bytes
+    :param is_text: Whether the message is UTF-8 text, in which case the
+        chunks are strings
+    :return: The offsets of the chunks in the message, and the chunks
+    """
+    with memoryview(data) as view:
+        offset = 0
+        while offset < len(data):
+            end = min(offset + chunk_size, len(data))
+
+            if not is_text:
+                yield offset, view[offset:end]
+                offset = end
+                continue
+
+            # Continuation bytes of a character start with the bits 10
+            cut = end
+            while offset < cut < len(data) and data[cut] & 0xC0 == 0x80:
+                cut -= 1
+
+            # A single character longer than a chunk
+            if cut == offset:
+                cut = end
+                while cut < len(data) and data[cut] & 0xC0 == 0x80:
+                    cut += 1
+            end = cut
+
+            yield offset, str(view[offset:end], "utf-8")
+            offset = end
+
+
+class ChunkAssembler:
+    """
+    Reassembles the chunked messages received on a connection.
+    """
+
+    def __init__(self, max_pending_size: int = DEFAULT_MAX_REASSEMBLY_SIZE) -> None:
+        """
+        Initialize the assembler.
+
+        :param max_pending_size: The maximum number of bytes held by incomplete
+            transfers
+        """
+        self.__max_pending_size = max_pending_size
+
+        # Buffer and number of received bytes, by transfer id
+        self.__transfers: dict[int, list] = dict()
+        self.__pending_size = 0
+
+        # Transfers whose remaining chunks are ignored
+        self.__dropped: set[int] = set()
+
+    # Private methods
+    def __drop(self, transfer_id: int, is_last: bool) -> None:
+        transfer = self.__transfers.pop(transfer_id, None)
+        if transfer is not None:
+            self.__pending_size -= len(transfer[0])
+
+        if not is_last:
+            self.__dropped.add(transfer_id)
+
+    # Public methods
+    def feed(
+        self, transfer_id: int, offset: int, total_size: int, data: bytes
+    ) -> Optional[bytearray]:
+        """
+        Add a chunk to its transfer.
+
+        :param transfer_id: The id of the transfer
+        :param offset: The offset of the chunk in the message
+        :param total_size: The size of the whole message
+        :param data: The chunk
+        :return: The message if the chunk completed it, None otherwise
+        :raises ChunkingError: If the chunk does not continue its transfer or
+            the transfer exceeds the memory limit, in which case the transfer
+            is dropped, or if the offset or size is negative.
+        """
+        if offset < 0 or total_size < 0:
+            raise ChunkingError("Invalid chunk of transfer [%d]" % transfer_id)
+
+        is_last = offset + len(data) >= total_size
+
+        if transfer_id in self.__dropped:
+            if is_last:
+                self.__dropped.discard(transfer_id)
+            return None
+
+        transfer = self.__transfers.get(transfer_id)
+
+        if transfer is None:
+            if offset != 0:
+                self.__drop(transfer_id, is_last)
+                raise ChunkingError("Chunk of unknown transfer [%d]" % transfer_id)
+
+            if total_size > self.__max_pending_size - self.__pending_size:
+                self.__drop(transfer_id, is_last)
+                raise ChunkingError(
+                    "Transfer of %d bytes exceeds the limit of %d pending bytes"
+                    % (total_size, self.__max_pending_size)
+                )
+
+            transfer = self.__transfers[transfer_id] = [bytearray(total_size), 0]
+            self.__pending_size += total_size
+
+        buffer, received = transfer
+        end = offset + len(data)
+
+        if offset != received or end > len(buffer):
+            self.__drop(transfer_id, is_last)
+            raise ChunkingError("Unexpected chunk of transfer [%d]" % transfer_id)
+
+        buffer[offset:end] = data
+        transfer[1] = end
+
+        if end < len(buffer):
+            return None
+
+        del self.__transfers[transfer_id]
+        self.__pending_size -= len(buffer)
+        return buffer
+
+    def pending_size(self) -> int:
+        """
+        Get the number of bytes held by incomplete transfers.
+
+        :return: The number of bytes
+        """
+        return self.__pending_size
@@ -0,0 +1,199 @@
+"""
+Dispatch engine running subscriber callbacks of an adapter.
+
+Callbacks of the same topic run one at a time in the order their messages
+arrived, callbacks of different topics run concurrently up to a limit.
+Messages of a busy topic wait in a bounded per-topic queue, and all queued
+messages together are bounded as well. Readers call ``wait_for_capacity``
+to stop reading from the socket while the queue of a topic they dispatched
+to is full, or while too many messages are queued over all topics.
+
+Every callback runs in the worker task of its topic, never in the task of
+the reader that dispatched it, so cancellations and timeouts of a callback
+stay within its topic. On Python 3.12 and later, workers are started
+eagerly: a callback that finishes without suspending runs before
+``dispatch`` returns, without waiting for the event loop to schedule it.
+
+"""
+
+import asyncio
+import sys
+from collections import deque
+from typing import Any, Callable, Coroutine, Iterable, Optional
+
+from ..logger import Logger
+
+logger = Logger("Dispatcher")
+
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_MAX_QUEUE_SIZE = 1024
+DEFAULT_MAX_PENDING = 16384
+
+CALLBACK = Callable[..., Coroutine[None, None, None]]
+
+_EAGER_START = sys.version_info >= (3, 12)
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        logger: Logger = logger,
+    ) -> None:
+        """
+        Initialize the dispatcher.
+
+        :param max_concurrency: The maximum number of topics whose callbacks are
+            suspended at the same time
+        :param max_queue_size: The number of messages a topic may queue before
+            readers are asked to wait
+        :param max_pending: The number of messages all topics may queue
+            together before readers are asked to wait
+        :param logger: The logger to use for logging.
+        """
+        self.__max_concurrency = max_concurrency
+        self.__max_queue_size = max_queue_size
+        self.__max_pending = max_pending
+
+        # Queues of the topics currently handled by a worker or waiting for one
+        self.__queues: dict[str, deque[tuple[CALLBACK, tuple]]] = dict()
+        # Topics with queued messages waiting for a free worker
+        self.__waiting_topics: deque[str] = deque()
+        self.__workers = 0
+        # Queued messages over all topics
+        self.__pending = 0
+        # Referenced until they finish, as the event loop does not
+        self.__tasks: set[asyncio.Task] = set()
+
+        self.__full_topics: set[str] = set()
+        # Set and replaced whenever there is more capacity, created by the
+        # first waiting reader as the dispatcher may be created before the
+        # event loop runs
+        self.__has_capacity: Optional[asyncio.Event] = None
+
+        self._logger = logger
+
+    # Private methods
+    def __start_worker(self, topic: str) -> None:
+        self.__workers += 1
+        coro = self.__work(topic)
+
+        if _EAGER_START:
+            task = asyncio.Task(coro, loop=asyncio.get_running_loop(), eager_start=True)
+        else:
+            task = asyncio.ensure_future(coro)
+
+        if not task.done():
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+
+    async def __work(self, topic: str) -> None:
+        queue = self.__queues[topic]
+
+        try:
+            while queue:
+                callback, args = queue.popleft()
+                self.__dequeued(1)
+                self.__update_capacity(topic, len(queue))
+                await self.__run(topic, callback, args)
+        finally:
+            # Messages left behind by a cancelled worker are dropped
+            self.__dequeued(len(queue))
+            del self.__queues[topic]
+            self.__update_capacity(topic, 0)
+            self.__workers -= 1
+            self.__start_waiting_topic()
+
+    async def __run(self, topic: str, callback: CALLBACK, args: tuple) -> None:
+        try:
+            await callback(*args)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._logger.error("Error in subscriber of topic [%s]: %s", topic, e)
+
+    def __start_waiting_topic(self) -> None:
+        if self.__waiting_topics and self.__workers < self.__max_concurrency:
+            self.__start_worker(self.__waiting_topics.popleft())
+
+    def __update_capacity(self, topic: str, queue_size: int) -> bool:
+        if queue_size >= self.__max_queue_size:
+            self.__full_topics.add(topic)
+            return True
+
+        if topic in self.__full_topics:
+            self.__full_topics.discard(topic)
+            self.__wake_readers()
+        return False
+
+    def __dequeued(self, count: int) -> None:
+        is_full = self.__pending >= self.__max_pending
+        self.__pending -= count
+        if is_full and self.__pending < self.__max_pending:
+            self.__wake_readers()
+
+    def __wake_readers(self) -> None:
+        # Readers check again whether they may go on
+        if self.__has_capacity is not None:
+            self.__has_capacity.set()
+            self.__has_capacity = None
+
+    def __has_room(self, topics: Optional[Iterable[str]]) -> bool:
+        if self.__pending >= self.__max_pending:
+            return False
+        if topics is None:
+            return not self.__full_topics
+        return self.__full_topics.isdisjoint(topics)
+
+    # Public methods
+    def dispatch(self, topic: str, callback: CALLBACK, *args: Any) -> bool:
+        """
+        Run a callback for a message of a topic.
+
+        The callback runs after all previously dispatched callbacks of the same
+        topic have finished.
+
+        :param topic: The topic of the message
+        :param callback: The coroutine function to run
+        :param args: The arguments to call the callback with
+        :return: True if the queue of the topic is full, False otherwise
+        """
+        queue = self.__queues.get(topic)
+        self.__pending += 1
+
+        if queue is None:
+            queue = self.__queues[topic] = deque([(callback, args)])
+
+            if self.__workers < self.__max_concurrency:
+                self.__start_worker(topic)
+            else:
+                self.__waiting_topics.append(topic)
+            return False
+
+        queue.append((callback, args))
+        return self.__update_capacity(topic, len(queue))
+
+    async def wait_for_capacity(self, topics: Optional[Iterable[str]] = None) -> None:
+        """
+        Wait until the queues of some topics are no longer full and not too
+        many messages are queued over all topics.
+
+        Readers should call this between reads to apply backpressure.
+
+        :param topics: The topics whose queues must not be full, usually those
+            the reader dispatched to since it last waited. None for all topics.
+        """
+        while not self.__has_room(topics):
+            if self.__has_capacity is None:
+                self.__has_capacity = asyncio.Event()
+            await self.__has_capacity.wait()
+
+    def pending(self) -> int:
+        """
+        Get the number of queued messages over all topics.
+
+        :return: The number of queued messages
+        """
+        return self.__pending
@@ -11,3 +11,18 @@ class TopicAlreadySubscribedError(Exception):
 class ConnectionError(Exception):
     def __init__(self, *args: object) -> None:
         super().__init__(*args)
+
+
+class FramingError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class InvalidTopicPatternError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class ChunkingError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
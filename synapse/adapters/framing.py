@@ -0,0 +1,158 @@
+"""
+Wire framing for stream based adapters.
+
+Stream transports such as TCP do not preserve message boundaries: a single
+read may return part of a message or several messages at once. Every
+serialized message is therefore wrapped in a frame before it is written and
+recovered by a FrameDecoder on the receiving side.
+
+Two framing modes are supported:
+
+- ``Framing.LENGTH_PREFIXED``: every frame is prefixed with the size of its
+  body as a 4 byte big-endian unsigned integer. Any body can be transported.
+- ``Framing.NEWLINE_DELIMITED``: every frame is terminated by a newline. The
+  body must not contain a newline, which holds for JSON produced by the
+  serializers.
+
+"""
+
+import struct
+from enum import Enum
+from typing import List, Tuple
+
+from .errors import FramingError
+
+_LENGTH_HEADER = struct.Struct(">I")
+_DELIMITER = b"\n"
+
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class Framing(Enum):
+    LENGTH_PREFIXED = "length"
+    NEWLINE_DELIMITED = "newline"
+
+
+def encode_frame(body: bytes, framing: Framing = Framing.LENGTH_PREFIXED) -> bytes:
+    """
+    Wrap a message body in a frame.
+
+    :param body: The serialized message
+    :param framing: The framing mode to use
+    :return: The framed message, ready to be written to the stream
+    :raises FramingError: If the body cannot be represented in the framing mode
+    """
+    if framing is Framing.LENGTH_PREFIXED:
+        if len(body) > 0xFFFFFFFF:
+            raise FramingError("Frame too large: %d bytes" % len(body))
+        return _LENGTH_HEADER.pack(len(body)) + body
+
+    if _DELIMITER in body:
+        raise FramingError("Newline delimited frame body contains a newline")
+    return body + _DELIMITER
+
+
+class FrameDecoder:
+    """
+    Incremental decoder turning a byte stream back into frames.
+
+    Incoming data is appended to a single receive buffer which is reused for
+    the lifetime of the decoder. Every call to ``feed`` extracts all frames
+    completed by the new data in one pass and compacts the buffer once.
+    """
+
+    def __init__(
+        self,
+        framing: Framing = Framing.LENGTH_PREFIXED,
+        max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+    ) -> None:
+        """
+        Initialize the decoder.
+
+        :param framing: The framing mode used by the remote end
+        :param max_frame_size: The largest frame body accepted, in bytes
+        """
+        self.__framing = framing
+        self.__max_frame_size = max_frame_size
+
+        self.__buffer = bytearray()
+
+        # Number of buffered bytes already searched for a delimiter
+        self.__scanned = 0
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Feed received data to the decoder.
+
+        :param data: The bytes read from the stream
+        :return: The bodies of all frames completed by the data, in order
+        :raises FramingError: If a frame exceeds the maximum frame size
+        """
+        self.__buffer += data
+
+        if self.__framing is Framing.LENGTH_PREFIXED:
+            frames, consumed = self.__split_length_prefixed()
+        else:
+            frames, consumed = self.__split_newline_delimited()
+
+        if consumed:
+            del self.__buffer[:consumed]
+
+        return frames
+
+    def pending(self) -> int:
+        """
+        Get the number of buffered bytes belonging to an incomplete frame.
+
+        :return: The number of buffered bytes
+        """
+        return len(self.__buffer)
+
+    # Private methods
+    def __split_length_prefixed(self) -> Tuple[List[bytes], int]:
+        frames: list[bytes] = []
+        offset = 0
+        size = len(self.__buffer)
+
+        with memoryview(self.__buffer) as view:
+            while size - offset >= _LENGTH_HEADER.size:
+                (length,) = _LENGTH_HEADER.unpack_from(view, offset)
+
+                if length > self.__max_frame_size:
+                    raise FramingError(
+                        "Frame of %d bytes exceeds the limit of %d bytes"
+                        % (length, self.__max_frame_size)
+                    )
+
+                end = offset + _LENGTH_HEADER.size + length
+                if end > size:
+                    break
+
+                frames.append(bytes(view[offset + _LENGTH_HEADER.size : end]))
+                offset = end
+
+        return frames, offset
+
+    def __split_newline_delimited(self) -> Tuple[List[bytes], int]:
+        frames: list[bytes] = []
+        offset = 0
+        search_from = self.__scanned
+
+        with memoryview(self.__buffer) as view:
+            while True:
+                end = self.__buffer.find(_DELIMITER, search_from)
+
+                if end == -1:
+                    break
+
+                frames.append(bytes(view[offset:end]))
+                offset = search_from = end + 1
+
+        self.__scanned = len(self.__buffer) - offset
+
+        if self.__scanned > self.__max_frame_size:
+            raise FramingError(
+                "Frame exceeds the limit of %d bytes" % self.__max_frame_size
+            )
+
+        return frames, offset
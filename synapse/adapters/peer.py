@@ -0,0 +1,637 @@
+"""
+Outbound side of a single adapter connection.
+
+Every connection gets its own bounded queue of encoded frames which is
+drained by a dedicated writer task. Publishing only enqueues, so a slow
+connection delays nothing but itself. What happens when the queue of a
+connection is full is decided by its overflow policy.
+
+Frames may be queued with a conflation key, usually their topic. A frame
+queued while an older frame with the same key is still waiting replaces the
+older one in place, so the connection only ever gets the latest value of
+each key and the queue holds at most one frame per key.
+
+Large messages may be queued as a transfer, an iterator of chunk frames
+produced on demand. The writer sends one chunk of every transfer along with
+the frames queued in the meantime, so small messages are not held up by a
+large one. Frames and transfers may be queued with the topics they carry,
+in which case they are held back until the transfers queued before them
+with one of their topics are written, so messages of a topic never
+overtake each other while messages of other topics pass large ones.
+Transfers and held back frames count as queued frames, and a transfer not
+started yet is replaced like a frame by a newer one with the same
+conflation key.
+
+A connection may have several priority classes, each with its own queue and
+weight. The writer then writes small batches, taking from every class in
+turn up to its weight until the batch is full, so a frame of a high priority
+class never waits for more than one batch of other frames. When the queue is
+full, the oldest frame of the lowest priority class is dropped first.
+
+"""
+
+import asyncio
+from collections import deque
+from enum import Enum
+from typing import Iterator, List, Optional, Sequence, Union
+
+from ..logger import Logger
+from ..serializers.codecs import JSON_CODEC, Codec, get_codec
+
+logger = Logger("Peer")
+
+FRAME = Union[bytes, str]
+
+DEFAULT_MAX_QUEUE_SIZE = 1024
+DEFAULT_BLOCK_TIMEOUT = 1.0
+# Frames written at once when there are several priority classes
+PRIORITY_BATCH_SIZE = 64
+
+
+class OverflowPolicy(Enum):
+    # Discard the oldest queued frame to make room for the new one
+    DROP_OLDEST = "drop_oldest"
+    # Discard the new frame
+    DROP_NEWEST = "drop_newest"
+    # Make the publisher wait for room, up to a timeout
+    BLOCK = "block"
+    # Close the connection
+    DISCONNECT = "disconnect"
+
+
+class _Entry:
+    """
+    A frame with a conflation key or topics, or a transfer.
+    """
+
+    __slots__ = ("item", "key", "priority", "topics", "is_transfer", "is_started")
+
+    def __init__(
+        self,
+        item: object,
+        key: Optional[str],
+        priority: int,
+        topics: Sequence[str],
+        is_transfer: bool,
+    ) -> None:
+        # The frame, or the chunk iterator of a transfer
+        self.item = item
+        self.key = key
+        self.priority = priority
+        self.topics = frozenset(topics)
+        self.is_transfer = is_transfer
+        # Whether a chunk of the transfer was written, after which it can no
+        # longer be replaced or dropped
+        self.is_started = False
+
+
+class Peer:
+    def __init__(
+        self,
+        name: str,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+        priority_weights: Sequence[int] = (1,),
+        logger: Logger = logger,
+    ) -> None:
+        """
+        Initialize the peer.
+
+        :param name: A human readable name of the connection, used for logging
+        :param max_queue_size: The maximum number of frames and transfers
+            waiting to be written
+        :param overflow_policy: What to do with a frame when the queue is full
+        :param block_timeout: How long a publisher may wait for room, in seconds,
+            when the overflow policy is BLOCK
+        :param priority_weights: The weight of every priority class, highest
+            priority first. Classes take turns filling every written batch,
+            each taking up to its weight in frames per turn.
+        :param logger: The logger to use for logging.
+        """
+        self.__name = name
+        self.__max_queue_size = max_queue_size
+        self.__overflow_policy = overflow_policy
+        self.__block_timeout = block_timeout
+
+        # Queues of frames ready to be written by priority class, entries for
+        # frames with a conflation key
+        self.__weights = tuple(priority_weights)
+        self.__queues: list[deque[Union[FRAME, _Entry]]] = [
+            deque() for _ in self.__weights
+        ]
+        self.__queued = 0
+        # Frames and transfers not written yet, wherever they wait
+        self.__size = 0
+        # Entries that may still be replaced, by conflation key
+        self.__conflated: dict[str, _Entry] = dict()
+        # Transfers being written
+        self.__transfers: deque[_Entry] = deque()
+        # Frames and transfers not written yet by topic, in queuing order,
+        # while a transfer of the topic is being written
+        self.__pending: dict[str, deque[_Entry]] = dict()
+        self.__not_empty = asyncio.Event()
+        self.__not_full = asyncio.Event()
+        self.__not_full.set()
+
+        # Every connection starts with JSON until another codec is negotiated
+        self.__codec = get_codec(JSON_CODEC)
+
+        self.__writer_task: Optional[asyncio.Task] = None
+        self.__is_closed = False
+        self.__dropped_frames = 0
+        self.__conflated_frames = 0
+
+        self._logger = logger
+
+    # Protected methods
+    async def _write(self, frames: List[FRAME]) -> None:
+        """
+        Write frames to the connection.
+
+        Subclasses must override this method and only return once the
+        transport is ready to accept more data.
+
+        :param frames: The frames to write, in order
+        """
+        raise NotImplementedError
+
+    def _abort(self) -> None:
+        """
+        Forcefully close the connection.
+
+        Subclasses must override this method. The adapter notices the closed
+        connection through its reading side and cleans up from there.
+        """
+        raise NotImplementedError
+
+    # Private methods
+    async def __keep_writing(self) -> None:
+        while True:
+            while not self.__queued and not self.__transfers:
+                self.__not_empty.clear()
+                await self.__not_empty.wait()
+
+            frames = self.__next_frames()
+            self.__next_chunks(frames)
+            self.__not_full.set()
+
+            if not frames:
+                continue
+
+            try:
+                await self._write(frames)
+            except Exception as e:
+                self._logger.error("Error while writing to %s: %s", self.__name, e)
+                self.close()
+                self._abort()
+                return
+
+    def __next_frames(self) -> List[FRAME]:
+        # Without priorities, everything queued is written at once
+        if len(self.__queues) == 1:
+            items = list(self.__queues[0])
+            self.__queues[0].clear()
+            self.__size -= self.__queued
+            self.__queued = 0
+            return [self.__dequeued(item) for item in items]
+
+        frames: list[FRAME] = []
+        batch_size = max(sum(self.__weights), PRIORITY_BATCH_SIZE)
+
+        # Classes without frames leave their share to the others
+        while self.__queued and len(frames) < batch_size:
+            for queue, weight in zip(self.__queues, self.__weights):
+                for _ in range(min(weight, len(queue), batch_size - len(frames))):
+                    self.__queued -= 1
+                    self.__size -= 1
+                    frames.append(self.__dequeued(queue.popleft()))
+
+        return frames
+
+    def __dequeued(self, item: Union[FRAME, _Entry]) -> FRAME:
+        if not isinstance(item, _Entry):
+            return item
+
+        self.__forget(item)
+        return item.item
+
+    def __forget(self, entry: _Entry) -> None:
+        # The key may already belong to a newer entry
+        if entry.key is not None and self.__conflated.get(entry.key) is entry:
+            del self.__conflated[entry.key]
+
+    def __next_chunks(self, frames: List[FRAME]) -> None:
+        for _ in range(len(self.__transfers)):
+            transfer = self.__transfers.popleft()
+
+            if not transfer.is_started:
+                transfer.is_started = True
+                self.__forget(transfer)
+
+            try:
+                frame = next(transfer.item, None)
+            except Exception as e:
+                self._logger.error("Error in transfer to %s: %s", self.__name, e)
+                frame = None
+
+            if frame is not None:
+                frames.append(frame)
+                self.__transfers.append(transfer)
+            else:
+                self.__size -= 1
+                self.__finish(transfer)
+
+    def __is_held(self, topics: Sequence[str]) -> bool:
+        return any(topic in self.__pending for topic in topics)
+
+    def __hold(self, entry: _Entry) -> None:
+        for topic in entry.topics:
+            self.__pending.setdefault(topic, deque()).append(entry)
+
+        # Entries without topics, or whose topics have nothing pending, are
+        # ready right away
+        if self.__is_ready(entry):
+            self.__release(entry)
+
+    def __is_ready(self, entry: _Entry) -> bool:
+        return all(self.__pending[topic][0] is entry for topic in entry.topics)
+
+    def __release(self, entry: _Entry) -> None:
+        if entry.is_transfer:
+            # Stays pending until it is written
+            self.__transfers.append(entry)
+            self.__not_empty.set()
+        else:
+            self.__enqueue(entry)
+            self.__finish(entry)
+
+    def __finish(self, entry: _Entry) -> None:
+        # The entries next in line may now be ready, released without
+        # recursion as long runs of frames may be held back
+        finished = [entry]
+        while finished:
+            entry = finished.pop()
+            for topic in entry.topics:
+                pending = self.__pending[topic]
+                pending.popleft()
+                if not pending:
+                    del self.__pending[topic]
+                    continue
+
+                head = pending[0]
+                if not self.__is_ready(head):
+                    continue
+
+                if head.is_transfer:
+                    self.__transfers.append(head)
+                    self.__not_empty.set()
+                else:
+                    self.__enqueue(head)
+                    finished.append(head)
+
+    def __enqueue(self, entry: _Entry) -> None:
+        # Frames that may no longer be replaced are queued as they are
+        item = entry if entry.key is not None else entry.item
+        self.__queues[min(entry.priority, len(self.__queues) - 1)].append(item)
+        self.__queued += 1
+        self.__not_empty.set()
+
+    async def __wait_for_room(self) -> None:
+        while self.__size >= self.__max_queue_size and not self.__is_closed:
+            self.__not_full.clear()
+            await self.__not_full.wait()
+
+    def __drop(self, reason: str) -> None:
+        self.__dropped_frames += 1
+        self._logger.debug("Dropped frame for %s: %s", self.__name, reason)
+
+    def __conflate(self, item: object, key: str, is_transfer: bool) -> bool:
+        entry = self.__conflated.get(key)
+
+        # A frame replaces a frame, a transfer a transfer not started yet
+        if entry is None or entry.is_transfer != is_transfer:
+            return False
+
+        entry.item = item
+        self.__conflated_frames += 1
+        return True
+
+    def __append(
+        self,
+        item: object,
+        key: Optional[str],
+        priority: int,
+        topics: Sequence[str],
+        is_transfer: bool,
+    ) -> None:
+        self.__size += 1
+
+        # Newer values of its topics must not replace frames queued before it
+        if self.__conflated:
+            for topic in topics:
+                if topic != key:
+                    self.__conflated.pop(topic, None)
+
+        # Frames never replaced nor held back are queued as they are
+        if key is None and not is_transfer and not self.__is_held(topics):
+            self.__queues[min(priority, len(self.__queues) - 1)].append(item)
+            self.__queued += 1
+            self.__not_empty.set()
+            return
+
+        entry = _Entry(item, key, priority, topics, is_transfer)
+        if key is not None:
+            self.__conflated[key] = entry
+
+        if is_transfer or self.__is_held(topics):
+            self.__hold(entry)
+        else:
+            self.__enqueue(entry)
+
+    def __drop_oldest(self) -> bool:
+        # From the lowest priority class holding frames
+        for queue in reversed(self.__queues):
+            if queue:
+                oldest = queue.popleft()
+                self.__queued -= 1
+                self.__size -= 1
+                if isinstance(oldest, _Entry):
+                    self.__forget(oldest)
+                return True
+
+        # Otherwise the oldest held back frame or transfer not started yet,
+        # as the chunks of a started transfer are all needed
+        for pending in self.__pending.values():
+            for entry in pending:
+                if not entry.is_started:
+                    self.__discard(entry)
+                    return True
+
+        for entry in self.__transfers:
+            if not entry.is_started:
+                self.__discard(entry)
+                return True
+
+        return False
+
+    def __discard(self, entry: _Entry) -> None:
+        self.__size -= 1
+        self.__forget(entry)
+
+        if entry.is_transfer and entry in self.__transfers:
+            self.__transfers.remove(entry)
+            self.__finish(entry)
+            return
+
+        # Held back, the entries next in line where it was first may be ready
+        heads = []
+        for topic in entry.topics:
+            pending = self.__pending[topic]
+            is_head = pending[0] is entry
+            pending.remove(entry)
+            if not pending:
+                del self.__pending[topic]
+            elif is_head:
+                heads.append(pending[0])
+
+        for head in heads:
+            if self.__is_ready(head):
+                self.__release(head)
+
+    def __put_nowait(
+        self,
+        item: object,
+        key: Optional[str],
+        priority: int,
+        topics: Sequence[str],
+        is_transfer: bool,
+    ) -> bool:
+        if self.__is_closed:
+            return True
+
+        if key is not None and self.__conflate(item, key, is_transfer):
+            return True
+
+        if self.__size < self.__max_queue_size:
+            self.__append(item, key, priority, topics, is_transfer)
+            return True
+
+        if self.__overflow_policy is OverflowPolicy.DROP_OLDEST:
+            self.__drop("queue full, dropped oldest")
+            if self.__drop_oldest():
+                self.__append(item, key, priority, topics, is_transfer)
+        elif self.__overflow_policy is OverflowPolicy.DROP_NEWEST:
+            self.__drop("queue full, dropped newest")
+        elif self.__overflow_policy is OverflowPolicy.DISCONNECT:
+            self._logger.warning("Send queue of %s is full, disconnecting", self.__name)
+            self.close()
+            self._abort()
+        else:
+            return False
+
+        return True
+
+    async def __put(
+        self,
+        item: object,
+        key: Optional[str],
+        priority: int,
+        topics: Sequence[str],
+        is_transfer: bool,
+    ) -> bool:
+        if self.__put_nowait(item, key, priority, topics, is_transfer):
+            return not self.__is_closed
+
+        try:
+            await asyncio.wait_for(self.__wait_for_room(), self.__block_timeout)
+        except asyncio.TimeoutError:
+            self.__drop("timed out waiting for room")
+            return False
+
+        if self.__is_closed:
+            return False
+
+        # Another frame with the same key may have been queued while waiting
+        if key is None or not self.__conflate(item, key, is_transfer):
+            self.__append(item, key, priority, topics, is_transfer)
+        return True
+
+    # Public methods
+    def start(self) -> None:
+        """
+        Start the writer task of the peer.
+        """
+        self.__writer_task = asyncio.create_task(self.__keep_writing())
+
+    def close(self) -> None:
+        """
+        Stop the writer task and discard all queued frames.
+        """
+        if self.__is_closed:
+            return
+
+        self.__is_closed = True
+        for queue in self.__queues:
+            queue.clear()
+        self.__queued = 0
+        self.__size = 0
+        self.__conflated.clear()
+        self.__transfers.clear()
+        self.__pending.clear()
+        self.__not_full.set()
+
+        if self.__writer_task is not None:
+            self.__writer_task.cancel()
+
+    def put_nowait(
+        self,
+        frame: FRAME,
+        key: Optional[str] = None,
+        priority: int = 0,
+        topics: Sequence[str] = (),
+    ) -> bool:
+        """
+        Queue a frame without waiting.
+
+        If a frame with the same conflation key is still queued, it is replaced.
+        Otherwise, if the queue is full, the overflow policy is applied. A frame
+        with one of the topics of a transfer being written is held back behind
+        it.
+
+        :param frame: The encoded frame
+        :param key: The conflation key of the frame, None to never conflate it
+        :param priority: The priority class of the frame, 0 being the highest.
+            Classes beyond the last one are the last one.
+        :param topics: The topics of the messages in the frame, whose order
+            with other frames and transfers is kept
+        :return: False if the frame has to wait for room because the overflow
+            policy is BLOCK, True otherwise
+        """
+        return self.__put_nowait(frame, key, priority, topics, False)
+
+    async def put(
+        self,
+        frame: FRAME,
+        key: Optional[str] = None,
+        priority: int = 0,
+        topics: Sequence[str] = (),
+    ) -> bool:
+        """
+        Queue a frame, waiting for room if the overflow policy is BLOCK.
+
+        :param frame: The encoded frame
+        :param key: The conflation key of the frame, None to never conflate it
+        :param priority: The priority class of the frame, 0 being the highest
+        :param topics: The topics of the messages in the frame, whose order
+            with other frames and transfers is kept
+        :return: False if waiting for room timed out or the peer is closed,
+            True otherwise
+        """
+        return await self.__put(frame, key, priority, topics, False)
+
+    def put_chunks_nowait(
+        self,
+        chunks: Iterator[FRAME],
+        key: Optional[str] = None,
+        topics: Sequence[str] = (),
+    ) -> bool:
+        """
+        Queue a transfer, whose chunks are written between other frames,
+        without waiting.
+
+        A transfer counts as a single frame of the queue. If a transfer with
+        the same conflation key has not started yet, it is replaced. The
+        transfer starts once the transfers queued before it with one of its
+        topics are written, and frames queued after it with one of its topics
+        are held back until it is written.
+
+        :param chunks: The chunk frames of the transfer, produced on demand
+        :param key: The conflation key of the transfer, None to never conflate it
+        :param topics: The topics of the messages in the transfer
+        :return: False if the transfer has to wait for room because the
+            overflow policy is BLOCK, True otherwise
+        """
+        return self.__put_nowait(chunks, key, 0, topics, True)
+
+    async def put_chunks(
+        self,
+        chunks: Iterator[FRAME],
+        key: Optional[str] = None,
+        topics: Sequence[str] = (),
+    ) -> bool:
+        """
+        Queue a transfer, waiting for room if the overflow policy is BLOCK.
+
+        :param chunks: The chunk frames of the transfer, produced on demand
+        :param key: The conflation key of the transfer, None to never conflate it
+        :param topics: The topics of the messages in the transfer
+        :return: False if waiting for room timed out or the peer is closed,
+            True otherwise
+        """
+        return await self.__put(chunks, key, 0, topics, True)
+
+    def name(self) -> str:
+        """
+        Get the name of the peer.
+
+        :return: The name of the peer
+        """
+        return self.__name
+
+    def codec(self) -> Codec:
+        """
+        Get the codec used to encode frames for the peer.
+
+        :return: The codec
+        """
+        return self.__codec
+
+    def set_codec(self, codec: Codec) -> None:
+        """
+        Set the codec used to encode frames for the peer.
+
+        :param codec: The codec
+        """
+        self.__codec = codec
+
+    def queue_size(self) -> int:
+        """
+        Get the number of frames and transfers waiting to be written.
+
+        :return: The number of queued frames and transfers
+        """
+        return self.__size
+
+    def transfers(self) -> int:
+        """
+        Get the number of transfers being written.
+
+        :return: The number of transfers
+        """
+        return len(self.__transfers)
+
+    def dropped_frames(self) -> int:
+        """
+        Get the number of frames dropped because of the overflow policy.
+
+        :return: The number of dropped frames
+        """
+        return self.__dropped_frames
+
+    def conflated_frames(self) -> int:
+        """
+        Get the number of queued frames replaced by a newer frame with the
+        same conflation key.
+
+        :return: The number of replaced frames
+        """
+        return self.__conflated_frames
+
+    def is_closed(self) -> bool:
+        """
+        Check if the peer is closed.
+
+        :return: True if the peer is closed, False otherwise
+        """
+        return self.__is_closed
@@ -0,0 +1,104 @@
+"""
+Priority classes of outbound frames.
+
+Every frame an adapter queues on a connection belongs to a priority class,
+chosen by the longest class prefix its topic starts with. Topics matching no
+prefix belong to the last class. Classes are listed from the highest to the
+lowest priority, and the weight of a class is the share of every written
+batch it gets while other classes are waiting, see `Peer`.
+
+With the default classes, control messages, commands and command responses
+go first, then events, then states::
+
+    TCPAdapter(priority_classes=DEFAULT_PRIORITY_CLASSES)
+
+"""
+
+from typing import Sequence, Tuple
+
+# Topics whose class is remembered, beyond which the cache starts over
+_MAX_CACHED_TOPICS = 4096
+
+
+class PriorityClass:
+    def __init__(self, name: str, weight: int, prefixes: Sequence[str] = ()) -> None:
+        """
+        Initialize a priority class.
+
+        :param name: The name of the class, used for logging
+        :param weight: The number of frames of the class in every written batch
+            while other classes are waiting, at least 1
+        :param prefixes: The prefixes of the topics belonging to the class
+        """
+        self.name = name
+        self.weight = weight
+        self.prefixes = tuple(prefixes)
+
+
+DEFAULT_PRIORITY_CLASSES = (
+    PriorityClass(
+        "control",
+        8,
+        ("control/", "command/", "batch/", "cancel/", "credit/", "resync/"),
+    ),
+    PriorityClass("events", 4, ("event/",)),
+    PriorityClass("states", 1),
+)
+
+
+class TopicPriorities:
+    def __init__(self, classes: Sequence[PriorityClass]) -> None:
+        """
+        Initialize the classification of topics.
+
+        :param classes: The priority classes, highest priority first
+        :raises ValueError: If there is no class or a weight is below 1
+        """
+        if not classes:
+            raise ValueError("At least one priority class is required")
+
+        if any(priority_class.weight < 1 for priority_class in classes):
+            raise ValueError("Priority weights must be at least 1")
+
+        self.__weights = tuple(priority_class.weight for priority_class in classes)
+
+        # Longest prefixes first, so that they win over shorter ones
+        self.__prefixes = sorted(
+            (
+                (prefix, i)
+                for i, priority_class in enumerate(classes)
+                for prefix in priority_class.prefixes
+            ),
+            key=lambda entry: -len(entry[0]),
+        )
+        self.__cache: dict[str, int] = dict()
+
+    def classify(self, topic: str) -> int:
+        """
+        Get the priority class of a topic.
+
+        :param topic: The topic
+        :return: The index of the class, 0 being the highest priority
+        """
+        priority = self.__cache.get(topic)
+
+        if priority is None:
+            priority = len(self.__weights) - 1
+            for prefix, i in self.__prefixes:
+                if topic.startswith(prefix):
+                    priority = i
+                    break
+
+            if len(self.__cache) >= _MAX_CACHED_TOPICS:
+                self.__cache.clear()
+            self.__cache[topic] = priority
+
+        return priority
+
+    def weights(self) -> Tuple[int, ...]:
+        """
+        Get the weights of the classes.
+
+        :return: The weights, highest priority first
+        """
+        return self.__weights
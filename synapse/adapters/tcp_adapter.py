@@ -1,9 +1,32 @@
 import asyncio
-from typing import Optional, Union
+from typing import List, Optional, Sequence, Union
 
 from ..logger import Logger
 from ..serializers import adapter_message_serializer as ams
+from ..serializers.codecs import JSON_CODEC, Codec
 from .adapter import Adapter
+from .chunking import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_REASSEMBLY_SIZE
+from .dispatcher import Dispatcher
+from .errors import FramingError
+from .framing import DEFAULT_MAX_FRAME_SIZE, FrameDecoder, Framing, encode_frame
+from .peer import DEFAULT_BLOCK_TIMEOUT, DEFAULT_MAX_QUEUE_SIZE, OverflowPolicy, Peer
+from .priority import PriorityClass
+
+READ_SIZE = 64 * 1024
+
+
+class TCPPeer(Peer):
+    def __init__(self, writer: asyncio.StreamWriter, **kwargs) -> None:
+        super().__init__(str(writer.get_extra_info("peername")), **kwargs)
+
+        self.__writer = writer
+
+    async def _write(self, frames: List[bytes]) -> None:
+        self.__writer.writelines(frames)
+        await self.__writer.drain()
+
+    def _abort(self) -> None:
+        self.__writer.transport.abort()
 
 
 class TCPAdapter(Adapter):
@@ -12,48 +35,104 @@ class TCPAdapter(Adapter):
         host: str = "127.0.0.1",
         port: int = 8765,
         logger: Logger = Logger("TCPAdapter"),
+        framing: Framing = Framing.LENGTH_PREFIXED,
+        max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+        dispatcher: Optional[Dispatcher] = None,
+        codec: str = JSON_CODEC,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+        max_reassembly_size: int = DEFAULT_MAX_REASSEMBLY_SIZE,
+        priority_classes: Optional[Sequence[PriorityClass]] = None,
     ) -> None:
-        super().__init__(logger)
+        super().__init__(
+            logger,
+            max_queue_size,
+            overflow_policy,
+            block_timeout,
+            dispatcher,
+            codec,
+            chunk_size,
+            max_reassembly_size,
+            priority_classes,
+        )
 
         self.__connection: Optional[Union[asyncio.Server, asyncio.StreamWriter]] = None
 
         self.__host = host
         self.__port = port
 
-        self.__writers: set[asyncio.StreamWriter] = set()
+        self.__framing = framing
+        self.__max_frame_size = max_frame_size
 
     # Private methods
     async def __on_connection(
         self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
     ):
         async def keep_listening(reader: asyncio.StreamReader) -> None:
+            decoder = FrameDecoder(self.__framing, self.__max_frame_size)
+
             while True:
-                data = await reader.read(1024)
+                data = await reader.read(READ_SIZE)
 
                 if len(data) == 0:
+                    if decoder.pending():
+                        self._logger.warning(
+                            "Connection closed with %d bytes of an incomplete frame",
+                            decoder.pending(),
+                        )
                     self._logger.info("Connection closed")
                     return
 
-                message = data.decode("utf-8")
-
                 try:
-                    message_dict = ams.deserialize(message)
-                except ams.DeserializationError as e:
-                    self._logger.error(
-                        "Error while deserializing message: %s, Error: %s", message, e
-                    )
-                    continue
+                    frames = decoder.feed(data)
+                except FramingError as e:
+                    self._logger.error("Invalid frame, closing connection: %s", e)
+                    return
+
+                self.__dispatch_frames(peer, frames)
+                await self._wait_for_dispatch(peer)
+
+        peer = TCPPeer(writer, logger=self._logger, **self._peer_options)
+        self._add_peer(peer)
+
+        try:
+            await keep_listening(reader)
+        except ConnectionError as e:
+            self._logger.warning("Connection lost: %s", e)
+        finally:
+            self._remove_peer(peer)
 
-                self._notify_subscriber(message_dict["topic"], message_dict["message"])
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
 
-        self.__writers.add(writer)
+    def __dispatch_frames(self, peer: TCPPeer, frames: List[bytes]) -> None:
+        for frame in frames:
+            try:
+                # The message itself is only decoded if someone subscribed
+                topic, payload = ams.decode_frame(frame)
+            except ams.DeserializationError as e:
+                self._logger.error(
+                    "Error while deserializing message: %s, Error: %s", frame, e
+                )
+                continue
 
-        await keep_listening(reader)
+            self._handle_message(peer, topic, payload)
 
-        writer.close()
-        await writer.wait_closed()
+    # Protected methods
+    def _frame(self, data: bytes, codec: Codec) -> bytes:
+        try:
+            return encode_frame(data, self.__framing)
+        except FramingError as e:
+            raise ams.SerializationError(str(e)) from e
 
-        self.__writers.remove(writer)
+    def _accepts_codec(self, codec: Codec) -> bool:
+        # Binary frames may contain the newline delimiter
+        return self.__framing is Framing.LENGTH_PREFIXED or codec.is_text
 
     # Public methods
     async def connect(self):
@@ -111,32 +190,3 @@ class TCPAdapter(Adapter):
                 await self.__connection.serve_forever()
             except asyncio.CancelledError:
                 self._logger.info("Server stopped")
-
-    async def publish(self, topic: str, message: str) -> bool:
-        if not await super().publish(topic, message):
-            return False
-
-        try:
-            serialized_message = ams.serialize(topic, message)
-        except ams.SerializationError as e:
-            self._logger.error(
-                "Error while serializing message: %s, topic: %s, Error: %s",
-                message,
-                topic,
-                e,
-            )
-            return False
-
-        for writer in self.__writers:
-            try:
-                writer.write(serialized_message.encode("utf-8"))
-                await writer.drain()
-            except Exception as e:
-                self._logger.error(
-                    "Error while publishing message: %s, topic: %s, Error: %s",
-                    message,
-                    topic,
-                    e,
-                )
-
-        return True
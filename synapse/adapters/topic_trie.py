@@ -0,0 +1,224 @@
+"""
+Index of topic patterns with MQTT style wildcards.
+
+Topics are split into levels separated by ``/``. A pattern level may be:
+
+- ``+``: matches exactly one level, e.g. ``state/+/temperature`` matches
+  ``state/kitchen/temperature``.
+- ``#``: matches any number of levels, including none, and must be the last
+  level, e.g. ``state/sensor/#`` matches ``state/sensor`` and
+  ``state/sensor/a/b``.
+
+Matching walks the trie level by level, so its cost grows with the depth of
+the topic rather than with the number of indexed patterns.
+
+"""
+
+from typing import Generic, List, Optional, TypeVar
+
+from .errors import InvalidTopicPatternError
+
+SEPARATOR = "/"
+SINGLE_LEVEL_WILDCARD = "+"
+MULTI_LEVEL_WILDCARD = "#"
+
+T = TypeVar("T")
+
+
+def is_pattern(topic: str) -> bool:
+    """
+    Check if a topic contains wildcards.
+
+    :param topic: The topic to check
+    :return: True if the topic is a pattern, False otherwise
+    """
+    return SINGLE_LEVEL_WILDCARD in topic or MULTI_LEVEL_WILDCARD in topic
+
+
+def validate_pattern(pattern: str) -> None:
+    """
+    Validate a topic pattern.
+
+    :param pattern: The pattern to validate
+    :raises InvalidTopicPatternError: If a wildcard does not span a whole level
+        or ``#`` is not the last level
+    """
+    levels = pattern.split(SEPARATOR)
+
+    for i, level in enumerate(levels):
+        if level in (SINGLE_LEVEL_WILDCARD, MULTI_LEVEL_WILDCARD):
+            if level == MULTI_LEVEL_WILDCARD and i != len(levels) - 1:
+                raise InvalidTopicPatternError(
+                    "'#' must be the last level of [%s]" % pattern
+                )
+        elif is_pattern(level):
+            raise InvalidTopicPatternError(
+                "Wildcards must span a whole level in [%s]" % pattern
+            )
+
+
+def matches(pattern: str, topic: str) -> bool:
+    """
+    Check if a topic matches a pattern.
+
+    :param pattern: The pattern, which may contain wildcards
+    :param topic: The concrete topic
+    :return: True if the topic matches the pattern, False otherwise
+    """
+    if not is_pattern(pattern):
+        return pattern == topic
+
+    levels = topic.split(SEPARATOR)
+    pattern_levels = pattern.split(SEPARATOR)
+
+    for i, level in enumerate(pattern_levels):
+        if level == MULTI_LEVEL_WILDCARD:
+            return True
+        if i == len(levels):
+            return False
+        if level != SINGLE_LEVEL_WILDCARD and level != levels[i]:
+            return False
+
+    return len(pattern_levels) == len(levels)
+
+
+class _Node(Generic[T]):
+    __slots__ = ("children", "values")
+
+    def __init__(self) -> None:
+        self.children: dict[str, "_Node[T]"] = dict()
+        # Used as an insertion ordered set
+        self.values: dict[T, None] = dict()
+
+
+class TopicTrie(Generic[T]):
+    def __init__(self) -> None:
+        """
+        Initialize an empty trie.
+        """
+        self.__root: _Node[T] = _Node()
+
+        # Nodes holding values, by pattern
+        self.__nodes: dict[str, _Node[T]] = dict()
+
+    def add(self, pattern: str, value: T) -> bool:
+        """
+        Add a value for a pattern.
+
+        :param pattern: The pattern to add the value for
+        :param value: The value to add
+        :return: True if the value was added, False if it was already present
+        :raises InvalidTopicPatternError: If the pattern is invalid
+        """
+        validate_pattern(pattern)
+
+        node = self.__nodes.get(pattern)
+
+        if node is None:
+            node = self.__root
+            for level in pattern.split(SEPARATOR):
+                node = node.children.setdefault(level, _Node())
+            self.__nodes[pattern] = node
+
+        if value in node.values:
+            return False
+
+        node.values[value] = None
+        return True
+
+    def remove(self, pattern: str, value: Optional[T] = None) -> bool:
+        """
+        Remove a value, or all values, of a pattern.
+
+        :param pattern: The pattern to remove the value from
+        :param value: The value to remove. All values are removed if None.
+        :return: True if anything was removed, False otherwise
+        """
+        node = self.__nodes.get(pattern)
+
+        if node is None:
+            return False
+
+        if value is None:
+            node.values.clear()
+        elif value in node.values:
+            del node.values[value]
+        else:
+            return False
+
+        if not node.values:
+            del self.__nodes[pattern]
+            self.__prune(pattern.split(SEPARATOR))
+
+        return True
+
+    def get(self, pattern: str) -> List[T]:
+        """
+        Get the values added for exactly this pattern.
+
+        :param pattern: The pattern
+        :return: The values of the pattern, in insertion order
+        """
+        node = self.__nodes.get(pattern)
+        return list(node.values) if node is not None else []
+
+    def patterns(self) -> List[str]:
+        """
+        Get all patterns that have values.
+
+        :return: The patterns
+        """
+        return list(self.__nodes)
+
+    def match(self, topic: str) -> List[T]:
+        """
+        Get the values of all patterns matching a topic.
+
+        Values are returned once even if several patterns match.
+
+        :param topic: The concrete topic
+        :return: The matching values
+        """
+        levels = topic.split(SEPARATOR)
+        depth = len(levels)
+        matches: dict[T, None] = dict()
+
+        stack = [(self.__root, 0)]
+        while stack:
+            node, i = stack.pop()
+
+            multi_level = node.children.get(MULTI_LEVEL_WILDCARD)
+            if multi_level is not None:
+                matches.update(multi_level.values)
+
+            if i == depth:
+                matches.update(node.values)
+                continue
+
+            child = node.children.get(levels[i])
+            if child is not None:
+                stack.append((child, i + 1))
+
+            single_level = node.children.get(SINGLE_LEVEL_WILDCARD)
+            if single_level is not None:
+                stack.append((single_level, i + 1))
+
+        return list(matches)
+
+    # Private methods
+    def __prune(self, levels: List[str]) -> None:
+        path = [self.__root]
+        for level in levels:
+            path.append(path[-1].children[level])
+
+        for i in range(len(levels), 0, -1):
+            node = path[i]
+            if node.values or node.children:
+                return
+            del path[i - 1].children[levels[i - 1]]
+
+    def __len__(self) -> int:
+        return len(self.__nodes)
+
+    def __contains__(self, pattern: str) -> bool:
+        return pattern in self.__nodes
@@ -1,16 +1,40 @@
 import asyncio
-from typing import Optional, Union
+from typing import List, Optional, Sequence, Union
 
 import websockets
-from websockets import (ConnectionClosedOK, WebSocketCommonProtocol,
-                        WebSocketServer)
+from websockets import WebSocketCommonProtocol, WebSocketServer
 from websockets.exceptions import ConnectionClosedError
 from websockets.server import serve
 
 from ..logger import Logger
 from ..serializers import adapter_message_serializer as ams
+from ..serializers.codecs import JSON_CODEC, Codec
 from .adapter import Adapter
+from .chunking import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_REASSEMBLY_SIZE
+from .dispatcher import Dispatcher
 from .errors import ConnectionError
+from .peer import (
+    DEFAULT_BLOCK_TIMEOUT,
+    DEFAULT_MAX_QUEUE_SIZE,
+    FRAME,
+    OverflowPolicy,
+    Peer,
+)
+from .priority import PriorityClass
+
+
+class WSPeer(Peer):
+    def __init__(self, websocket: WebSocketCommonProtocol, **kwargs) -> None:
+        super().__init__(str(websocket.remote_address), **kwargs)
+
+        self.__websocket = websocket
+
+    async def _write(self, frames: List[FRAME]) -> None:
+        for frame in frames:
+            await self.__websocket.send(frame)
+
+    def _abort(self) -> None:
+        self.__websocket.transport.abort()
 
 
 class WSAdapter(Adapter):
@@ -19,31 +43,47 @@ class WSAdapter(Adapter):
         host: str = "127.0.0.1",
         port: int = 8765,
         logger: Logger = Logger("WebSocketAdapter"),
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+        dispatcher: Optional[Dispatcher] = None,
+        codec: str = JSON_CODEC,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+        max_reassembly_size: int = DEFAULT_MAX_REASSEMBLY_SIZE,
+        priority_classes: Optional[Sequence[PriorityClass]] = None,
     ) -> None:
-        super().__init__(logger)
+        super().__init__(
+            logger,
+            max_queue_size,
+            overflow_policy,
+            block_timeout,
+            dispatcher,
+            codec,
+            chunk_size,
+            max_reassembly_size,
+            priority_classes,
+        )
 
         self.__connection: Optional[Union[WebSocketCommonProtocol, WebSocketServer]] = None
 
         self.__host = host
         self.__port = port
 
-        self.__connections: set[WebSocketCommonProtocol] = set()
-
     # Private methods
     async def __on_connection(self, websocket: WebSocketCommonProtocol) -> None:
         self._logger.info(
             "New connection: %s %s", websocket.path, websocket.remote_address
         )
 
-        self.__connections.add(websocket)
+        peer = WSPeer(websocket, logger=self._logger, **self._peer_options)
+        self._add_peer(peer)
 
         async def keep_listening(websocket: WebSocketCommonProtocol):
             async def on_message(message):
                 try:
-                    message_dict = ams.deserialize(message)
-                    self._notify_subscriber(
-                        message_dict["topic"], message_dict["message"]
-                    )
+                    # The message itself is only decoded if someone subscribed
+                    topic, payload = ams.decode_frame(message)
+                    self._handle_message(peer, topic, payload)
                 except ams.DeserializationError as e:
                     self._logger.error(
                         "Error while deserializing message: %s, Error: %s", message, e
@@ -51,6 +91,7 @@ class WSAdapter(Adapter):
 
             async for message in websocket:
                 await on_message(message)
+                await self._wait_for_dispatch(peer)
 
         try:
             await keep_listening(websocket)
@@ -61,7 +102,12 @@ class WSAdapter(Adapter):
             )
         finally:
             self._logger.info("Connection closed: %s", websocket.remote_address)
-            self.__connections.remove(websocket)
+            self._remove_peer(peer)
+
+    # Protected methods
+    def _frame(self, data: bytes, codec: Codec) -> FRAME:
+        # Text codecs are sent as text frames, which browsers read as strings
+        return data.decode("utf-8") if codec.is_text else data
 
     async def connect(self):
         if self.is_connected():
@@ -114,39 +160,3 @@ class WSAdapter(Adapter):
             await self.__connection.serve_forever()
         except asyncio.CancelledError:
             self._logger.info("Server stopped")
-
-    async def publish(self, topic: str, message: str) -> bool:
-        if not await super().publish(topic, message):
-            return False
-
-        try:
-            # Serialize the message
-            serialized_message = ams.serialize(topic, message)
-        except ams.SerializationError as e:
-            # Handle serialization errors
-            self._logger.error(
-                "Error while serializing message: %s, topic: %s, Error: %s",
-                message,
-                topic,
-                e,
-            )
-
-        for connection in self.__connections:
-            try:
-                # Send the message to the client
-                await connection.send(serialized_message)
-            except ConnectionClosedOK:
-                # Handle connection closed errors
-                self._logger.warning(
-                    "Connection closed ungracefully: %s", connection.remote_address
-                )
-            except Exception as e:
-                # Handle unknown errors
-                self._logger.error(
-                    "Unknown error while publishing message: %s, topic: %s, Error: %s",
-                    message,
-                    topic,
-                    e,
-                )
-
-        return True
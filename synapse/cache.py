@@ -0,0 +1,127 @@
+"""
+Caching of command results.
+
+Commands whose result only depends on their payload may cache it. Results
+are keyed on the canonical JSON form of the payload, so dictionaries with the
+same items in a different order share an entry, as do dataclass instances
+and their dictionary form. Entries expire after a time
+to live, and the least recently used entry is evicted when the cache is full.
+
+"""
+
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from .serializers.codecs import encode_named_record
+
+DEFAULT_MAX_ENTRIES = 1024
+
+
+def canonical_key(payload: Any) -> Optional[str]:
+    """
+    Get the cache key of a payload.
+
+    :param payload: The payload of a command
+    :return: The key, or None if the payload cannot be used as a key
+    """
+    try:
+        return json.dumps(
+            payload,
+            sort_keys=True,
+            separators=(",", ":"),
+            default=encode_named_record,
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+class CachePolicy:
+    def __init__(self, ttl: float, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """
+        Initialize a cache policy.
+
+        :param ttl: How long a result stays valid, in seconds
+        :param max_entries: The maximum number of cached results
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+
+class ResponseCache:
+    def __init__(self, policy: CachePolicy) -> None:
+        """
+        Initialize an empty cache.
+
+        :param policy: The time to live and size of the cache
+        """
+        self.__policy = policy
+
+        # Expiry time and result by key, least recently used first
+        self.__entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        # Changed by every invalidation, so that results computed before it
+        # are not cached after it
+        self.__generation = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Get a cached result.
+
+        :param key: The key of the payload
+        :return: Whether a valid result was found, and the result
+        """
+        entry = self.__entries.get(key)
+
+        if entry is None:
+            return False, None
+
+        if entry[0] <= time.monotonic():
+            del self.__entries[key]
+            return False, None
+
+        self.__entries.move_to_end(key)
+        return True, entry[1]
+
+    def put(self, key: str, result: Any, generation: Optional[int] = None) -> None:
+        """
+        Cache a result, evicting the least recently used one if the cache is full.
+
+        :param key: The key of the payload
+        :param result: The result
+        :param generation: The generation of the cache when the result started
+            being computed, see `generation`. The result is not cached if the
+            cache was invalidated since. None to cache it anyway.
+        """
+        if generation is not None and generation != self.__generation:
+            return
+
+        self.__entries[key] = (time.monotonic() + self.__policy.ttl, result)
+        self.__entries.move_to_end(key)
+
+        while len(self.__entries) > self.__policy.max_entries:
+            self.__entries.popitem(last=False)
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """
+        Remove a cached result, or all of them.
+
+        :param key: The key of the payload, None to remove all results
+        """
+        self.__generation += 1
+
+        if key is None:
+            self.__entries.clear()
+        else:
+            self.__entries.pop(key, None)
+
+    def generation(self) -> int:
+        """
+        Get the generation of the cache, which changes on every invalidation.
+
+        :return: The generation
+        """
+        return self.__generation
+
+    def __len__(self) -> int:
+        return len(self.__entries)
@@ -3,7 +3,18 @@ from typing import Union
 
 from .adapters.adapter import Adapter
 
-PAYLOAD = Union[str, int, float, dict]
+PAYLOAD = Union[str, int, float, dict, bytes, bytearray, memoryview]
+
+# Responses to clients that do not send a reply topic are published here
+COMMAND_RESPONSE_TOPIC = "command/response"
+# Clients missing a state update in delta mode ask for a keyframe here
+STATE_RESYNC_TOPIC = "resync/state"
+# Several commands sent in one frame, answered with one response
+COMMAND_BATCH_TOPIC = "batch/command"
+# Clients giving up on a command ask the server to stop processing it here
+COMMAND_CANCEL_TOPIC = "cancel/command"
+# Clients consuming a streamed response let the server send more chunks here
+COMMAND_CREDIT_TOPIC = "credit/command"
 
 
 class Connector:
@@ -1,10 +1,29 @@
 import asyncio
-from typing import Callable, Coroutine, Optional, Tuple
+import functools
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Coroutine, List, Optional, Tuple
 
 from .adapters import Adapter
-from .connector import PAYLOAD, Connector
+from .cache import canonical_key
+from .connector import (
+    COMMAND_BATCH_TOPIC,
+    COMMAND_CANCEL_TOPIC,
+    COMMAND_CREDIT_TOPIC,
+    COMMAND_RESPONSE_TOPIC,
+    PAYLOAD,
+    STATE_RESYNC_TOPIC,
+    Connector,
+)
+from .errors import CommandStreamError
+from .execution import SingleFlight
 from .logger import Logger
 from .serializers import connector_messsage_serializer as cms
+from .serializers import delta
+from .serializers.schema import get_schema
+from .state import State
+
+DEFAULT_STREAM_WINDOW = 16
 
 
 class ConnectorClient(Connector):
@@ -15,67 +34,272 @@ class ConnectorClient(Connector):
 
         self.__command_correlation_id = 0
 
-        # Command responses
-        self._adapter.subscribe("command/response", self.__on_command_response)
-        self.__awaiting_command_responses: dict[int, asyncio.Future[PAYLOAD]] = dict()
+        # Command responses are sent to a topic only this client subscribes to,
+        # so correlation ids only have to be unique within the session
+        self.__session_id = uuid.uuid4().hex
+        self.__response_topic = f"{COMMAND_RESPONSE_TOPIC}/{self.__session_id}"
+
+        self._adapter.subscribe(self.__response_topic, self.__on_command_response)
+        # Futures of the payload and success of responses, by correlation id
+        self.__awaiting_command_responses: dict[
+            int, asyncio.Future[Tuple[PAYLOAD, bool]]
+        ] = dict()
+        # Chunks of streamed responses not consumed yet, by correlation id
+        self.__streams: dict[int, asyncio.Queue] = dict()
+
+        # Sequence number and value of states the server sends in delta mode
+        self.__states: dict[str, tuple[int, PAYLOAD]] = dict()
+        # States a keyframe was asked for
+        self.__resyncing: set[str] = set()
+
+        # Latest value of every state received through a subscription
+        self.__state_cache: dict[str, State] = dict()
+
+        # Cancellations sent on behalf of cancelled callers, kept until sent
+        self.__cancellations: set[asyncio.Task] = set()
+
+        # Commands sent on behalf of all concurrent identical calls
+        self.__in_flight = SingleFlight()
 
     def __get_correlation_id(self) -> int:
         self.__command_correlation_id += 1
         return self.__command_correlation_id
 
-    async def __on_command_response(self, message: str) -> None:
+    async def __on_command_response(self, message: Any) -> None:
         self._logger.debug("Received command response [%s]", message)
 
         try:
             payload, correlation_id = cms.deserialize_command(message)
+            error = cms.deserialize_command_error(message)
+            is_chunk = cms.is_stream_chunk(message)
         except cms.DeserializationError as e:
             self._logger.error("Failed to deserialize command response: %s", e)
             return
         else:
+            stream = self.__streams.get(correlation_id)
+            if stream is not None:
+                stream.put_nowait((payload, error, is_chunk))
+                return
+
             if correlation_id not in self.__awaiting_command_responses:
                 self._logger.error("'correlation_id' not in awaiting command responses")
                 return
 
-            self.__awaiting_command_responses[correlation_id].set_result(payload)
+            if error is not None:
+                self._logger.error("Command [%d] failed: %s", correlation_id, error)
+
+            response_future = self.__awaiting_command_responses[correlation_id]
+            if not response_future.done():
+                response_future.set_result((payload, error is None))
+
+    async def __update_state(
+        self, name: str, message: PAYLOAD
+    ) -> Tuple[Optional[PAYLOAD], bool]:
+        try:
+            update = cms.read_state_update(message)
+        except cms.DeserializationError as e:
+            self._logger.error("Failed to deserialize state: %s", e)
+            return None, False
+
+        if update is None:
+            return message, True
+
+        seq, is_keyframe, body = update
+        current = self.__states.get(name)
+
+        # Already applied for another subscription matching the state
+        if current is not None and current[0] == seq:
+            return current[1], True
+
+        if is_keyframe:
+            self.__resyncing.discard(name)
+            self.__states[name] = (seq, body)
+            return body, True
+
+        if current is not None and current[0] == seq - 1:
+            try:
+                value = delta.apply(current[1], body)
+            except ValueError as e:
+                self._logger.error("Failed to apply state [%s] diff: %s", name, e)
+            else:
+                self.__states[name] = (seq, value)
+                return value, True
+
+        # An update was missed, the value can only be rebuilt from a keyframe
+        self.__states.pop(name, None)
+        if name not in self.__resyncing:
+            self._logger.debug("Requesting keyframe of state [%s]", name)
+            self.__resyncing.add(name)
+            await self._adapter.publish(STATE_RESYNC_TOPIC, name)
+
+        return None, False
+
+    async def __request(
+        self,
+        topic: str,
+        name: str,
+        payload: PAYLOAD,
+        correlation_id: int,
+        timeout: int,
+    ) -> Tuple[Optional[PAYLOAD], bool]:
+        # The server stops processing the command once nobody waits for it
+        request = cms.make_command(
+            payload, correlation_id, self.__response_topic, time.time() + timeout
+        )
+
+        # Registered before sending so that no response can be missed
+        response_future: asyncio.Future[Tuple[PAYLOAD, bool]] = asyncio.Future()
+        self.__awaiting_command_responses[correlation_id] = response_future
+
+        try:
+            if not await self._adapter.publish(topic, request):
+                self._logger.error("Failed to send command [%s]", name)
+                return None, False
+
+            response, is_success = await asyncio.wait_for(
+                response_future, timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            self._logger.error("Command [%s] timed out", name)
+            # In case the clock of the server is behind
+            await self.__cancel_command(correlation_id)
+            return None, False
+        except asyncio.CancelledError:
+            task = asyncio.ensure_future(self.__cancel_command(correlation_id))
+            self.__cancellations.add(task)
+            task.add_done_callback(self.__cancellations.discard)
+            raise
+        finally:
+            del self.__awaiting_command_responses[correlation_id]
+
+        return response, is_success
+
+    async def __cancel_command(self, correlation_id: int) -> None:
+        self._logger.debug("Cancelling command [%d]", correlation_id)
+
+        if not await self._adapter.publish(
+            COMMAND_CANCEL_TOPIC,
+            cms.make_command(None, correlation_id, self.__response_topic),
+        ):
+            self._logger.error("Failed to cancel command [%d]", correlation_id)
 
     def subscribe_to_state(
-        self, name: str, callback: Callable[[PAYLOAD], Coroutine[None, None, None]]
+        self,
+        name: str,
+        callback: Callable[..., Coroutine[None, None, None]],
+        schema: Optional[type] = None,
     ) -> None:
+        # The name may be a wildcard pattern such as "sensor/+" or "sensor/#", in
+        # which case the callback also receives the concrete state name. With a
+        # schema, a dataclass compiled once here, states are delivered and
+        # cached as instances of the dataclass.
         self._logger.debug("Subscribing to state [%s]", name)
+        decoder = get_schema(schema).decode if schema is not None else None
 
-        async def _callback(message: str):
-            try:
-                payload = cms.deserialize_payload(message)
-            except cms.DeserializationError as e:
-                self._logger.error("Failed to deserialize state: %s", e)
+        # The payload arrives decoded together with the envelope of the adapter,
+        # states sent in delta mode are rebuilt before the callback is called
+        async def _callback(message: PAYLOAD, topic: Optional[str] = None):
+            state_name = name if topic is None else topic[len("state/") :]
+
+            payload, is_complete = await self.__update_state(state_name, message)
+            if not is_complete:
                 return
-            else:
+
+            if decoder is not None:
+                try:
+                    payload = decoder(payload)
+                except cms.DeserializationError as e:
+                    self._logger.error("Invalid state [%s]: %s", state_name, e)
+                    return
+
+            self.local_state(state_name).set(payload)
+
+            if topic is None:
                 await callback(payload)
+            else:
+                await callback(payload, state_name)
 
         self._adapter.subscribe(f"state/{name}", _callback)
 
     def subscribe_to_event(
-        self, name: str, callback: Callable[[PAYLOAD], Coroutine[None, None, None]]
+        self,
+        name: str,
+        callback: Callable[..., Coroutine[None, None, None]],
+        schema: Optional[type] = None,
     ) -> None:
+        # The name may be a wildcard pattern such as "sensor/+" or "sensor/#", in
+        # which case the callback also receives the concrete event name. With a
+        # schema, events are delivered as instances of its dataclass.
         self._logger.debug("Subscribing to event [%s]", name)
+        decoder = get_schema(schema).decode if schema is not None else None
 
-        async def _callback(message: str):
-            try:
-                payload = cms.deserialize_payload(message)
-            except cms.DeserializationError as e:
-                self._logger.error("Failed to deserialize event: %s", e)
-                return
-            else:
+        # The payload arrives decoded together with the envelope of the adapter
+        async def _callback(payload: PAYLOAD, topic: Optional[str] = None):
+            if decoder is not None:
+                try:
+                    payload = decoder(payload)
+                except cms.DeserializationError as e:
+                    self._logger.error("Invalid event [%s]: %s", topic or name, e)
+                    return
+
+            if topic is None:
                 await callback(payload)
+            else:
+                await callback(payload, topic[len("event/") :])
 
         self._adapter.subscribe(f"event/{name}", _callback)
 
+    def unsubscribe_from_state(self, name: str) -> None:
+        self._logger.debug("Unsubscribing from state [%s]", name)
+
+        self._adapter.unsubscribe(f"state/{name}")
+        self.__states.pop(name, None)
+        self.__state_cache.pop(name, None)
+
+    def unsubscribe_from_event(self, name: str) -> None:
+        self._logger.debug("Unsubscribing from event [%s]", name)
+
+        self._adapter.unsubscribe(f"event/{name}")
+
+    def get_state(self, name: str) -> Tuple[Optional[PAYLOAD], int]:
+        # Served from the local cache of subscribed states, without any I/O
+        state = self.__state_cache.get(name)
+
+        if state is None:
+            return None, 0
+        return state.get(), state.version()
+
+    def local_state(self, name: str) -> State:
+        # Observers of the returned State are notified whenever a subscribed
+        # state changes, it may be requested before the first update arrives
+        state = self.__state_cache.get(name)
+
+        if state is None:
+            state = self.__state_cache[name] = State()
+        return state
+
     async def send_command(
         self,
         name: str,
         payload: str,
         timeout: int = 30,
+        single_flight: bool = False,
+        schema: Optional[type] = None,
     ) -> Tuple[Optional[PAYLOAD], bool]:
+        # In single flight mode, a call with the same name and payload as a
+        # running one waits for its response instead of sending the command.
+        # With a schema, the response is decoded into an instance of its
+        # dataclass.
+        if single_flight:
+            key = canonical_key(payload)
+            if key is not None:
+                return await self.__in_flight.run(
+                    (name, key),
+                    functools.partial(
+                        self.send_command, name, payload, timeout, schema=schema
+                    ),
+                )
+
         correlation_id = self.__get_correlation_id()
 
         self._logger.debug(
@@ -85,27 +309,143 @@ class ConnectorClient(Connector):
             correlation_id,
         )
 
-        try:
-            request = cms.serialize_command(payload, correlation_id)
-        except cms.SerializationError as e:
-            self._logger.error("Failed to serialize command: %s", e)
-            return None, False
-        else:
-            if not await self._adapter.publish(f"command/{name}", request):
-                self._logger.error("Failed to send command [%s]", name)
-                return None, False
-
-            response_future: asyncio.Future[PAYLOAD] = asyncio.Future()
-            self.__awaiting_command_responses[correlation_id] = response_future
+        response, is_success = await self.__request(
+            f"command/{name}", name, payload, correlation_id, timeout
+        )
 
+        if schema is not None and is_success:
             try:
-                response = await asyncio.wait_for(response_future, timeout=timeout)
-            except asyncio.TimeoutError:
-                self._logger.error("Command [%s] timed out", name)
+                response = get_schema(schema).decode(response)
+            except cms.DeserializationError as e:
+                self._logger.error("Invalid response of command [%s]: %s", name, e)
                 return None, False
-            finally:
-                del self.__awaiting_command_responses[correlation_id]
-                return response, True
+
+        return response, is_success
+
+    async def send_commands(
+        self,
+        commands: List[Tuple[str, PAYLOAD]],
+        timeout: int = 30,
+    ) -> List[Tuple[Optional[PAYLOAD], bool]]:
+        # All commands travel in one frame and are answered in one frame, the
+        # results are in the order of the commands
+        correlation_id = self.__get_correlation_id()
+
+        self._logger.debug(
+            "Sending batch of %d commands with correlation_id [%d]",
+            len(commands),
+            correlation_id,
+        )
+
+        failed: List[Tuple[Optional[PAYLOAD], bool]] = [(None, False)] * len(commands)
+
+        response, is_success = await self.__request(
+            COMMAND_BATCH_TOPIC,
+            "batch",
+            [[name, payload] for name, payload in commands],
+            correlation_id,
+            timeout,
+        )
+        if not is_success:
+            return failed
+
+        if not isinstance(response, list) or len(response) != len(commands):
+            self._logger.error("Invalid command batch response")
+            return failed
+
+        results = []
+        for result in response:
+            if isinstance(result, list) and len(result) == 2:
+                results.append((result[0], result[1] is True))
+            else:
+                results.append((None, False))
+        return results
+
+    async def stream_command(
+        self,
+        name: str,
+        payload: PAYLOAD,
+        timeout: int = 30,
+        window: int = DEFAULT_STREAM_WINDOW,
+        schema: Optional[type] = None,
+    ) -> AsyncIterator[PAYLOAD]:
+        # Yields the chunks of a command whose handler streams its result. The
+        # server sends at most window chunks ahead of the consumer, and waits
+        # for the consumer to catch up before producing more. Closing the
+        # iterator early, e.g. by leaving an "async for" loop, cancels the
+        # command. The timeout applies to every chunk. With a schema, chunks
+        # are decoded into instances of its dataclass.
+        correlation_id = self.__get_correlation_id()
+        decoder = get_schema(schema).decode if schema is not None else None
+
+        self._logger.debug(
+            "Streaming command [%s] with payload [%s] and correlation_id [%d]",
+            name,
+            payload,
+            correlation_id,
+        )
+
+        # Registered before sending so that no chunk can be missed
+        stream: asyncio.Queue = asyncio.Queue()
+        self.__streams[correlation_id] = stream
+        is_finished = False
+
+        try:
+            if not await self._adapter.publish(
+                f"command/{name}",
+                cms.make_command(
+                    payload, correlation_id, self.__response_topic, credit=window
+                ),
+            ):
+                is_finished = True
+                raise CommandStreamError("Failed to send command [%s]" % name)
+
+            # Credit is granted in batches of half the window, so the server
+            # can keep producing while the consumer works through the rest
+            consumed = 0
+            while True:
+                try:
+                    chunk, error, is_chunk = await asyncio.wait_for(
+                        stream.get(), timeout=timeout
+                    )
+                except asyncio.TimeoutError:
+                    raise CommandStreamError("Command [%s] timed out" % name) from None
+
+                if error is not None:
+                    is_finished = True
+                    raise CommandStreamError("Command [%s] failed: %s" % (name, error))
+
+                if not is_chunk:
+                    is_finished = True
+                    return
+
+                if decoder is not None:
+                    try:
+                        chunk = decoder(chunk)
+                    except cms.DeserializationError as e:
+                        raise CommandStreamError(
+                            "Invalid chunk of command [%s]: %s" % (name, e)
+                        ) from e
+
+                yield chunk
+
+                consumed += 1
+                if consumed >= max(window // 2, 1):
+                    await self._adapter.publish(
+                        COMMAND_CREDIT_TOPIC,
+                        cms.make_command(
+                            consumed, correlation_id, self.__response_topic
+                        ),
+                    )
+                    consumed = 0
+        finally:
+            del self.__streams[correlation_id]
+
+            # Not awaited, as the iterator may be closed outside of the loop
+            if not is_finished:
+                task = asyncio.ensure_future(self.__cancel_command(correlation_id))
+                self.__cancellations.add(task)
+                task.add_done_callback(self.__cancellations.discard)
 
     def run(self) -> None:
         self._logger.info("Running connector client")
@@ -1,77 +1,501 @@
 import asyncio
-import json
-from typing import Awaitable, Callable
+import functools
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 from .adapters import Adapter
-from .connector import PAYLOAD, Connector
+from .adapters.peer import Peer
+from .connector import (
+    COMMAND_BATCH_TOPIC,
+    COMMAND_CANCEL_TOPIC,
+    COMMAND_CREDIT_TOPIC,
+    COMMAND_RESPONSE_TOPIC,
+    PAYLOAD,
+    STATE_RESYNC_TOPIC,
+    Connector,
+)
+from .cache import CachePolicy
+from .errors import CommandRejectedError, CommandStreamError
+from .execution import CommandExecutor, ExecutionPolicy
 from .logger import Logger
 from .serializers import connector_messsage_serializer as cms
+from .serializers import delta
+from .serializers.codecs import is_binary_message
+from .serializers.schema import get_schema, is_record
+
+DEFAULT_KEYFRAME_INTERVAL = 100
+DEFAULT_MAX_REQUESTS = 1024
+
+# Requesting peer, reply topic and correlation id of a command
+REQUEST_KEY = Tuple[Optional[Peer], Optional[str], int]
+
+
+def _is_reply_topic(topic: Any) -> bool:
+    # Clients get their responses on the command response topic, or on a topic
+    # of their own below it
+    return topic is None or (
+        isinstance(topic, str)
+        and (
+            topic == COMMAND_RESPONSE_TOPIC
+            or topic.startswith(COMMAND_RESPONSE_TOPIC + "/")
+        )
+    )
 
 
 class ConnectorServer(Connector):
     def __init__(
-        self, adapter: Adapter, logger: Logger = Logger("ConnectorServer")
+        self,
+        adapter: Adapter,
+        logger: Logger = Logger("ConnectorServer"),
+        state_delta: bool = False,
+        keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+        conflate_states: bool = False,
+        max_workers: Optional[int] = None,
+        max_requests: int = DEFAULT_MAX_REQUESTS,
     ) -> None:
         super().__init__(adapter, logger)
 
-        self.__commands: dict[str, Callable[[str], Awaitable[str]]] = dict()
+        self.__commands: dict[str, CommandExecutor] = dict()
+        self._adapter.subscribe(COMMAND_BATCH_TOPIC, self.__process_command_batch)
 
-    async def publish_state(self, name: str, payload: PAYLOAD) -> None:
-        self._logger.debug("Publishing state [%s] with payload [%s]", name, payload)
+        # Handlers still running, by requesting peer, reply topic and
+        # correlation id
+        self.__running_commands: dict[REQUEST_KEY, asyncio.Future] = dict()
+        # Requests beyond max_requests wait for one of them to finish, which
+        # stops the subscriber callbacks of commands and in turn reading from
+        # the connections sending them
+        self.__requests: set[asyncio.Task] = set()
+        self.__max_requests = max_requests
+        # Set and replaced whenever a request finishes, created on first use
+        # as the server may be created before the event loop runs
+        self.__request_done: Optional[asyncio.Event] = None
+        self._adapter.subscribe(COMMAND_CANCEL_TOPIC, self.__on_command_cancel)
+
+        # Chunks streamed responses may still send, by requesting peer, reply
+        # topic and correlation id
+        self.__stream_credits: dict[REQUEST_KEY, asyncio.Semaphore] = dict()
+        self._adapter.subscribe(COMMAND_CREDIT_TOPIC, self.__on_command_credit)
+
+        # In delta mode, dictionary states are sent as diffs against their
+        # previous value, with the full value every keyframe_interval updates
+        self.__state_delta = state_delta
+        self.__keyframe_interval = keyframe_interval
+        # Sequence number, last value and updates since the last keyframe
+        self.__states: dict[str, tuple[int, PAYLOAD, int]] = dict()
+
+        if state_delta:
+            self._adapter.subscribe(STATE_RESYNC_TOPIC, self.__on_state_resync)
+
+        # A state update still queued for a slow connection is replaced by the
+        # next update of the same state. Diffs depend on every previous update,
+        # so conflation does not apply in delta mode.
+        self.__conflate_states = conflate_states and not state_delta
+        if conflate_states and state_delta:
+            self._logger.warning("State conflation is disabled in delta mode")
+
+        # Pools shared by all commands that do not run on the event loop,
+        # created on first use
+        self.__max_workers = max_workers
+        self.__thread_pool: Optional[ThreadPoolExecutor] = None
+        self.__process_pool: Optional[ProcessPoolExecutor] = None
+
+    def __next_state_update(self, name: str, payload: PAYLOAD) -> dict:
+        seq, previous, since_keyframe = self.__states.get(
+            name, (0, None, self.__keyframe_interval)
+        )
+        seq += 1
+
+        patch = None
+        if since_keyframe < self.__keyframe_interval:
+            patch = delta.diff(previous, payload)
+
+        # A copy, as the payload may be modified in place before the next update
+        self.__states[name] = (
+            seq,
+            delta.snapshot(payload),
+            0 if patch is None else since_keyframe + 1,
+        )
+
+        if patch is None:
+            return cms.make_state_keyframe(seq, payload)
+        return cms.make_state_delta(seq, patch)
+
+    async def __on_state_resync(self, name: Any) -> None:
+        self._logger.debug("Resynchronizing state [%s]", name)
+
+        if name not in self.__states:
+            self._logger.warning("Resync of unknown state [%s]", name)
+            return
+
+        # Only the requester missed an update, it gets the current value with
+        # the current sequence number, which other clients already have
+        peer = self._adapter.sender()
+        if peer is None:
+            self._logger.warning("Resync of state [%s] not requested by a peer", name)
+            return
+
+        seq, value, _ = self.__states[name]
+
+        # Bytes and arrays are not sequenced, they are sent as they are
+        if not is_binary_message(value):
+            value = cms.make_state_keyframe(seq, value)
+
+        if not await self._adapter.send_to(peer, f"state/{name}", value):
+            self._logger.error("Failed to resynchronize state [%s]", name)
+
+    async def __run_batched_command(self, entry: Any) -> list:
+        if not isinstance(entry, list) or len(entry) != 2:
+            self._logger.error("Invalid command in batch: %s", entry)
+            return [None, False]
+
+        name, payload = entry
+        executor = self.__commands.get(name)
+
+        if executor is None:
+            self._logger.error("Unknown command [%s] in batch", name)
+            return [None, False]
+
+        # One failing command must not fail the whole batch
+        try:
+            return [await executor.run(payload), True]
+        except Exception as e:
+            self._logger.error("Error in command [%s]: %s", name, e)
+            return [None, False]
+
+    async def __run_command_batch(self, commands: PAYLOAD) -> PAYLOAD:
+        if not isinstance(commands, list):
+            self._logger.error("Command batch is not a list")
+            return []
+
+        self._logger.debug("Processing batch of %d commands", len(commands))
+
+        # Handlers run concurrently, their responses are sent back together
+        # in the order of the commands
+        return await asyncio.gather(
+            *(self.__run_batched_command(entry) for entry in commands)
+        )
+
+    async def __process_command_batch(self, message: Any) -> None:
+        await self.__start_request(
+            "batch", message, self._adapter.sender(), self.__run_command_batch
+        )
+
+    async def __start_request(
+        self,
+        name: str,
+        message: Any,
+        peer: Optional[Peer],
+        callback: Callable[[PAYLOAD], Awaitable[PAYLOAD]],
+    ) -> None:
+        while len(self.__requests) >= self.__max_requests:
+            if self.__request_done is None:
+                self.__request_done = asyncio.Event()
+            await self.__request_done.wait()
+
+        # Not awaited by the subscriber callback, as callbacks of the same topic
+        # run one after the other and calls of a command may run concurrently
+        task = asyncio.ensure_future(
+            self.__process_request(name, message, peer, callback)
+        )
+        self.__requests.add(task)
+        task.add_done_callback(self.__on_request_done)
+
+    def __on_request_done(self, task: asyncio.Task) -> None:
+        self.__requests.discard(task)
+
+        if self.__request_done is not None:
+            self.__request_done.set()
+            self.__request_done = None
+
+    async def __reply(
+        self, peer: Optional[Peer], reply_to: Optional[str], message: PAYLOAD
+    ) -> bool:
+        # Written to the requesting peer only, so that a client can neither
+        # have responses published on other topics nor see the responses of
+        # other clients. Requests not received from a peer are answered to
+        # the subscribers of the reply topic.
+        topic = reply_to or COMMAND_RESPONSE_TOPIC
+        if peer is None:
+            return await self._adapter.publish(topic, message)
+        return await self._adapter.send_to(peer, topic, message)
+
+    async def __process_request(
+        self,
+        name: str,
+        message: Any,
+        peer: Optional[Peer],
+        callback: Callable[[PAYLOAD], Awaitable[PAYLOAD]],
+    ) -> None:
+        try:
+            payload, correlation_id, reply_to = cms.deserialize_command_request(message)
+            deadline = cms.deserialize_command_deadline(message)
+        except cms.DeserializationError as e:
+            self._logger.error("Failed to deserialize command: %s", e)
+            return
+
+        if not _is_reply_topic(reply_to):
+            self._logger.error("Invalid reply topic [%s] of [%s]", reply_to, name)
+            return
+
+        # Deadlines are absolute, so clocks of clients and servers are expected
+        # to be synchronized
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                self._logger.warning("Command [%s] expired before processing", name)
+                return
+
+        # Run as a task of its own so that it can be cancelled by the client,
+        # which identifies it by its reply topic and correlation id
+        task = asyncio.ensure_future(callback(payload))
+        key = (peer, reply_to, correlation_id)
+        if reply_to is not None:
+            self.__running_commands[key] = task
 
         try:
-            serialized_payload = cms.serialize_payload(payload)
-        except cms.SerializationError as e:
-            self._logger.error("Failed to serialize state: %s", e)
+            await asyncio.wait((task,), timeout=timeout)
+        finally:
+            if self.__running_commands.get(key) is task:
+                del self.__running_commands[key]
+            if not task.done():
+                task.cancel()
+
+        if task.cancelled():
+            self._logger.warning("Command [%s] cancelled by the client", name)
+            return
+
+        if not task.done():
+            self._logger.warning("Command [%s] cancelled, deadline passed", name)
+            return
+
+        if task.exception() is not None:
+            self._logger.error("Error in command [%s]: %s", name, task.exception())
+            response = cms.make_command_error(correlation_id, str(task.exception()))
         else:
-            if not await self._adapter.publish(f"state/{name}", serialized_payload):
-                self._logger.error("Failed to publish state [%s]", name)
+            response = cms.make_command(task.result(), correlation_id)
+
+        if not await self.__reply(peer, reply_to, response):
+            self._logger.error("Failed to send command response")
+
+    async def __on_command_cancel(self, message: Any) -> None:
+        try:
+            _, correlation_id, reply_to = cms.deserialize_command_request(message)
+        except cms.DeserializationError as e:
+            self._logger.error("Failed to deserialize command cancellation: %s", e)
+            return
+
+        task = self.__running_commands.get(
+            (self._adapter.sender(), reply_to, correlation_id)
+        )
+        if task is not None:
+            self._logger.debug("Cancelling command [%d]", correlation_id)
+            task.cancel()
+
+    async def __stream_response(
+        self,
+        name: str,
+        executor: CommandExecutor,
+        message: Any,
+        peer: Optional[Peer],
+        payload: PAYLOAD,
+    ) -> PAYLOAD:
+        # Every chunk is sent as soon as it is produced, the handler is only
+        # resumed while the client has granted credit for more chunks. The
+        # plain response sent once this returns marks the end of the stream.
+        _, correlation_id, reply_to = cms.deserialize_command_request(message)
+        credit = cms.deserialize_command_credit(message)
+
+        if credit is None:
+            raise CommandRejectedError("[%s] streams its result" % name)
+
+        key = (peer, reply_to, correlation_id)
+        credits = self.__stream_credits[key] = asyncio.Semaphore(credit)
+
+        chunks = executor.stream(payload)
+        try:
+            while True:
+                await credits.acquire()
+
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    return None
+
+                if not await self.__reply(
+                    peer, reply_to, cms.make_stream_chunk(correlation_id, chunk)
+                ):
+                    raise CommandStreamError("Failed to send chunk of [%s]" % name)
+        finally:
+            if self.__stream_credits.get(key) is credits:
+                del self.__stream_credits[key]
+            await chunks.aclose()
+
+    async def __on_command_credit(self, message: Any) -> None:
+        try:
+            credit, correlation_id, reply_to = cms.deserialize_command_request(message)
+        except cms.DeserializationError as e:
+            self._logger.error("Failed to deserialize command credit: %s", e)
+            return
+
+        if not isinstance(credit, int) or isinstance(credit, bool) or credit < 1:
+            self._logger.error("Invalid credit [%s]", credit)
+            return
+
+        credits = self.__stream_credits.get(
+            (self._adapter.sender(), reply_to, correlation_id)
+        )
+        if credits is not None:
+            for _ in range(credit):
+                credits.release()
+
+    def __state_message(self, name: str, payload: PAYLOAD) -> PAYLOAD:
+        # The last value of every state is sent to clients when they subscribe
+        if not self.__state_delta:
+            self._adapter.retain(f"state/{name}", payload)
+            return payload
+
+        # Bytes and arrays are sent as they are, without a sequence number, and
+        # are never diffed against, so the next update is a keyframe
+        if is_binary_message(payload):
+            seq = self.__states.get(name, (0,))[0]
+            self.__states[name] = (seq, payload, 0)
+            self._adapter.retain(f"state/{name}", payload)
+            return payload
+
+        # Dataclasses are diffed by field name, clients with the schema decode
+        # the rebuilt dictionary
+        if is_record(payload):
+            payload = get_schema(type(payload)).to_dict(payload)
+
+        message = self.__next_state_update(name, payload)
+
+        # New subscribers need the full value to apply the next diffs to
+        seq, value, _ = self.__states[name]
+        self._adapter.retain(f"state/{name}", cms.make_state_keyframe(seq, value))
+
+        return message
+
+    async def publish_state(self, name: str, payload: PAYLOAD) -> None:
+        self._logger.debug("Publishing state [%s] with payload [%s]", name, payload)
+
+        # The payload is encoded once, together with the envelope of the adapter
+        if not await self._adapter.publish(
+            f"state/{name}",
+            self.__state_message(name, payload),
+            conflate=self.__conflate_states,
+        ):
+            self._logger.error("Failed to publish state [%s]", name)
+
+    async def publish_states(self, states: Dict[str, PAYLOAD]) -> None:
+        self._logger.debug("Publishing %d states", len(states))
+
+        # Sent to every client as a single frame holding the states it
+        # subscribed to
+        messages = [
+            (f"state/{name}", self.__state_message(name, payload))
+            for name, payload in states.items()
+        ]
+
+        if not await self._adapter.publish_batch(messages):
+            self._logger.error("Failed to publish %d states", len(states))
 
     async def publish_event(self, name: str, payload: str) -> None:
         self._logger.debug("Publishing event [%s] with payload [%s]", name, payload)
 
-        try:
-            serialized_payload = cms.serialize_payload(payload)
-        except cms.SerializationError as e:
-            self._logger.error("Failed to serialize event: %s", e)
-        else:
-            if not await self._adapter.publish(f"event/{name}", serialized_payload):
-                self._logger.error("Failed to publish event [%s]", name)
+        # The payload is encoded once, together with the envelope of the adapter
+        if not await self._adapter.publish(f"event/{name}", payload):
+            self._logger.error("Failed to publish event [%s]", name)
+
+    async def publish_events(self, events: List[Tuple[str, PAYLOAD]]) -> None:
+        self._logger.debug("Publishing %d events", len(events))
+
+        # Sent to every client as a single frame holding the events it
+        # subscribed to, in order
+        messages = [(f"event/{name}", payload) for name, payload in events]
+
+        if not await self._adapter.publish_batch(messages):
+            self._logger.error("Failed to publish %d events", len(events))
+
+    def __get_executor(self, policy: ExecutionPolicy) -> Optional[Executor]:
+        if policy is ExecutionPolicy.THREAD:
+            if self.__thread_pool is None:
+                self.__thread_pool = ThreadPoolExecutor(self.__max_workers)
+            return self.__thread_pool
+
+        if policy is ExecutionPolicy.PROCESS:
+            if self.__process_pool is None:
+                self.__process_pool = ProcessPoolExecutor(self.__max_workers)
+            return self.__process_pool
+
+        return None
 
     def register_command(
-        self, name: str, callback: Callable[[PAYLOAD], Awaitable[PAYLOAD]]
+        self,
+        name: str,
+        callback: Callable[[PAYLOAD], Any],
+        policy: ExecutionPolicy = ExecutionPolicy.INLINE,
+        max_concurrency: Optional[int] = None,
+        max_queue_size: Optional[int] = None,
+        cache: Optional[CachePolicy] = None,
+        single_flight: bool = False,
+        schema: Optional[type] = None,
     ) -> None:
+        # The callback is a coroutine function, or a plain callable run as the
+        # policy says. Calls beyond max_concurrency wait, calls beyond
+        # max_queue_size waiting ones are answered with an error. With a cache,
+        # results are reused for calls with the same payload until they expire.
+        # In single flight mode, calls with the same payload as a running call
+        # wait for it and are answered with its result. Async generator
+        # callbacks stream their result to the client chunk by chunk. With a
+        # schema, a dataclass compiled once here, the callback receives its
+        # payload as an instance of the dataclass.
         self._logger.debug("Registering command [%s]", name)
 
         if name in self.__commands:
             self._logger.warning("Command [%s] already registered", name)
             return
 
-        async def process_command(message: str):
+        executor = self.__commands[name] = CommandExecutor(
+            name,
+            callback,
+            self.__get_executor(policy),
+            max_concurrency,
+            max_queue_size,
+            cache,
+            single_flight,
+            get_schema(schema) if schema is not None else None,
+        )
+
+        async def process_command(message: Any):
             self._logger.debug(
                 "Processing command [%s] with message [%s]", name, message
             )
 
-            try:
-                payload, correlation_id = cms.deserialize_command(message)
-            except cms.DeserializationError as e:
-                self._logger.error("Failed to deserialize command: %s", e)
+            peer = self._adapter.sender()
+            if executor.is_stream():
+                callback = functools.partial(
+                    self.__stream_response, name, executor, message, peer
+                )
+                await self.__start_request(name, message, peer, callback)
             else:
-                try:
-                    response = cms.serialize_payload(await callback(payload))
-                except cms.SerializationError as e:
-                    self._logger.error("Failed to serialize response: %s", e)
-                else:
-                    response_to_be_sent = json.dumps(
-                        {"correlation_id": correlation_id, "payload": response}
-                    )
-                    if not await self._adapter.publish(
-                        "command/response", response_to_be_sent
-                    ):
-                        self._logger.error("Failed to send command response")
+                await self.__start_request(name, message, peer, executor.run)
 
         self._adapter.subscribe(f"command/{name}", process_command)
 
+    def invalidate_command(self, name: str, payload: PAYLOAD = None) -> None:
+        # Drops the cached result of a payload, or all cached results of the
+        # command when no payload is given
+        self._logger.debug("Invalidating cached results of command [%s]", name)
+
+        executor = self.__commands.get(name)
+        if executor is None:
+            self._logger.warning("Command [%s] not registered", name)
+            return
+
+        executor.invalidate(payload)
+
     def run(self) -> None:
         self._logger.info("Running connector server")
 
@@ -0,0 +1,8 @@
+class CommandRejectedError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class CommandStreamError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
@@ -0,0 +1,338 @@
+"""
+Execution of command handlers.
+
+A handler may be a coroutine function, awaited on the event loop, or a plain
+callable. Plain callables either run inline on the event loop, which is only
+suitable for cheap handlers, or in a thread or process pool shared by all
+commands of a server, which keeps the event loop free while they work.
+
+Every command may limit how many of its calls run at once and how many more
+may wait for their turn. Calls beyond that are rejected right away. Commands
+may also cache their results, in which case repeated calls with the same
+payload skip the handler, and share one execution among concurrent calls
+with the same payload.
+
+Handlers that are async generators stream their result chunk by chunk. They
+always run on the event loop, and hold their slot until the stream ends.
+
+Commands registered with a schema receive their payload decoded into an
+instance of its dataclass, see `schema`.
+
+"""
+
+import asyncio
+import functools
+import inspect
+from concurrent.futures import Executor
+from enum import Enum
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Optional
+
+from .cache import CachePolicy, ResponseCache, canonical_key
+from .errors import CommandRejectedError
+from .serializers.schema import Schema
+
+
+class ExecutionPolicy(Enum):
+    # Call the handler on the event loop thread
+    INLINE = "inline"
+    # Call the handler in the thread pool of the server
+    THREAD = "thread"
+    # Call the handler in the process pool of the server, the handler, its
+    # payload and its result must be picklable
+    PROCESS = "process"
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        """
+        Initialize a group of calls sharing their execution by key.
+        """
+        # Task and number of waiting callers, by key
+        self.__calls: dict[Hashable, list] = dict()
+
+    # Private methods
+    def __forget(self, key: Hashable, call: list, _: asyncio.Future) -> None:
+        if self.__calls.get(key) is call:
+            del self.__calls[key]
+
+    # Public methods
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run a call, or wait for the running call with the same key.
+
+        The call is cancelled once all its callers are cancelled.
+
+        :param key: The key identifying identical calls
+        :param factory: The function starting the call
+        :return: The result of the call
+        """
+        call = self.__calls.get(key)
+
+        if call is None:
+            task = asyncio.ensure_future(factory())
+            call = self.__calls[key] = [task, 0]
+            task.add_done_callback(functools.partial(self.__forget, key, call))
+
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                # Later calls must not join the cancelled one
+                self.__forget(key, call, task)
+                task.cancel()
+
+    def forget(self, key: Optional[Hashable] = None) -> None:
+        """
+        Make later calls start a new call instead of waiting for a running one.
+
+        The running call goes on for the callers already waiting for it.
+
+        :param key: The key of the call, None for all calls
+        """
+        if key is None:
+            self.__calls.clear()
+        else:
+            self.__calls.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self.__calls)
+
+
+class CommandExecutor:
+    def __init__(
+        self,
+        name: str,
+        callback: Callable[[Any], Any],
+        executor: Optional[Executor] = None,
+        max_concurrency: Optional[int] = None,
+        max_queue_size: Optional[int] = None,
+        cache: Optional[CachePolicy] = None,
+        single_flight: bool = False,
+        schema: Optional[Schema] = None,
+    ) -> None:
+        """
+        Initialize the executor of a command.
+
+        :param name: The name of the command, used in errors
+        :param callback: The handler of the command
+        :param executor: The pool to run the handler in, None to run it on the
+            event loop
+        :param max_concurrency: The maximum number of calls running at once,
+            None for no limit
+        :param max_queue_size: The maximum number of calls waiting for one of
+            the running calls to finish, None for no limit
+        :param cache: How results are cached, None to not cache them
+        :param single_flight: Whether concurrent calls with the same payload
+            share one execution
+        :param schema: The schema payloads are decoded with before being passed
+            to the handler, None to pass them as they are received
+        """
+        if executor is not None and inspect.iscoroutinefunction(callback):
+            raise ValueError("Coroutine handlers can only run inline")
+
+        self.__is_stream = inspect.isasyncgenfunction(callback)
+        if self.__is_stream and (
+            executor is not None or cache is not None or single_flight
+        ):
+            raise ValueError(
+                "Streaming handlers can only run inline, without cache or single flight"
+            )
+
+        self.__name = name
+        self.__callback = callback
+        self.__executor = executor
+        self.__max_concurrency = max_concurrency
+        self.__max_queue_size = max_queue_size
+
+        # Created by the first call, as the executor may be created before the
+        # event loop runs
+        self.__semaphore: Optional[asyncio.Semaphore] = None
+        self.__waiting = 0
+
+        self.__cache = ResponseCache(cache) if cache is not None else None
+        self.__in_flight = SingleFlight() if single_flight else None
+
+        self.__schema = schema
+
+    # Private methods
+    async def __call(self, payload: Any) -> Any:
+        result = self.__callback(payload)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def __acquire(self) -> None:
+        if self.__max_concurrency is None:
+            return
+
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.__max_concurrency)
+
+        if (
+            self.__semaphore.locked()
+            and self.__max_queue_size is not None
+            and self.__waiting >= self.__max_queue_size
+        ):
+            raise CommandRejectedError("Too many pending calls of [%s]" % self.__name)
+
+        self.__waiting += 1
+        try:
+            await self.__semaphore.acquire()
+        finally:
+            self.__waiting -= 1
+
+    def __release(self) -> None:
+        if self.__semaphore is not None:
+            self.__semaphore.release()
+
+    async def __run_limited(self, payload: Any) -> Any:
+        await self.__acquire()
+
+        if self.__executor is not None:
+            return await self.__run_in_pool(payload)
+
+        try:
+            return await self.__call(payload)
+        finally:
+            self.__release()
+
+    async def __run_in_pool(self, payload: Any) -> Any:
+        try:
+            job = self.__executor.submit(self.__callback, payload)
+        except BaseException:
+            self.__release()
+            raise
+
+        # A handler running in a pool cannot be stopped, so a cancelled call
+        # holds its slot until the handler returns
+        future = asyncio.wrap_future(job)
+        future.add_done_callback(self.__on_job_done)
+
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Unless it did not start yet
+            job.cancel()
+            raise
+
+    def __on_job_done(self, future: asyncio.Future) -> None:
+        self.__release()
+
+        # Nobody may wait for the result of a cancelled call anymore
+        if not future.cancelled():
+            future.exception()
+
+    async def __run_cached(self, key: str, payload: Any) -> Any:
+        if self.__cache is None:
+            return await self.__run_limited(payload)
+
+        # Results computed while the cache is invalidated may be stale
+        generation = self.__cache.generation()
+        result = await self.__run_limited(payload)
+        self.__cache.put(key, result, generation)
+        return result
+
+    # Public methods
+    async def run(self, payload: Any) -> Any:
+        """
+        Run the handler, waiting for a free slot if too many calls are running.
+
+        If results are cached, a valid cached result is returned instead. In
+        single flight mode, a call with the same payload as a running call
+        waits for its result.
+
+        :param payload: The payload of the command
+        :return: The result of the handler
+        :raises CommandRejectedError: If too many calls are already waiting, or
+            the handler streams its result
+        :raises DeserializationError: If the payload does not match the schema
+        """
+        if self.__is_stream:
+            raise CommandRejectedError("[%s] streams its result" % self.__name)
+
+        # Decoded first, so that payloads encoded by name or position share
+        # their cache entry
+        if self.__schema is not None:
+            payload = self.__schema.decode(payload)
+
+        if self.__cache is None and self.__in_flight is None:
+            return await self.__run_limited(payload)
+
+        key = canonical_key(payload)
+        if key is None:
+            return await self.__run_limited(payload)
+
+        if self.__cache is not None:
+            is_cached, result = self.__cache.get(key)
+            if is_cached:
+                return result
+
+        if self.__in_flight is not None:
+            return await self.__in_flight.run(
+                key, functools.partial(self.__run_cached, key, payload)
+            )
+        return await self.__run_cached(key, payload)
+
+    async def stream(self, payload: Any) -> AsyncIterator[Any]:
+        """
+        Run a streaming handler, waiting for a free slot if too many calls are
+        running.
+
+        The handler is closed when the stream is closed before its end.
+
+        :param payload: The payload of the command
+        :return: The chunks of the result
+        :raises CommandRejectedError: If too many calls are already waiting, or
+            the handler does not stream its result
+        :raises DeserializationError: If the payload does not match the schema
+        """
+        if not self.__is_stream:
+            raise CommandRejectedError("[%s] does not stream its result" % self.__name)
+
+        if self.__schema is not None:
+            payload = self.__schema.decode(payload)
+
+        await self.__acquire()
+        try:
+            chunks = self.__callback(payload)
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                await chunks.aclose()
+        finally:
+            self.__release()
+
+    def is_stream(self) -> bool:
+        """
+        Check if the handler streams its result.
+
+        :return: True if the handler is an async generator function
+        """
+        return self.__is_stream
+
+    def invalidate(self, payload: Any = None) -> None:
+        """
+        Remove the cached result of a payload, or all cached results.
+
+        :param payload: The payload, None to remove all results
+        """
+        if self.__cache is None:
+            return
+
+        key = None if payload is None else canonical_key(payload)
+        self.__cache.invalidate(key)
+        # Calls joining a running call would get its stale result
+        if self.__in_flight is not None:
+            self.__in_flight.forget(key)
+
+    def waiting(self) -> int:
+        """
+        Get the number of calls waiting for a free slot.
+
+        :return: The number of waiting calls
+        """
+        return self.__waiting
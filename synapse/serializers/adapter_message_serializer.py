@@ -3,13 +3,116 @@ Module containing functions for serializing and deserializing messages.
 
 The functions in this module are used by adapters to serialize and deserialize
 messages. They are used by the `publish` and `subscribe` methods of the adapter
-to convert messages to and from JSON strings.
+to convert messages to and from JSON strings, or to and from frames encoded
+with one of the codecs of the `codecs` module.
+
+The envelope built by `encode` holds the topic and the message, which may be
+any value the codec can encode. Messages should be placed in the envelope as
+they are rather than serialized beforehand, so that the whole frame is encoded
+and decoded in a single pass.
+
+The topic always comes first and can be read by `decode_frame` without
+touching the message, which is wrapped in a `Payload` and only decoded when
+it is needed. Frames of binary codecs are laid out as follows::
+
+    +----------+----------------------+-------------+------------------+
+    | codec id | topic length (2B BE) | topic UTF-8 | encoded message  |
+    +----------+----------------------+-------------+------------------+
+
+JSON frames are the JSON document ``{"topic":...,"message":...}`` with the
+topic first and no whitespace, so that the topic can be sliced out of the
+document while it stays valid JSON.
+
+Bytes-like messages and NumPy arrays are framed as binary frames of the raw
+and array codecs whatever the codec of the connection, see `message_codec`.
+The message is copied into the frame once, and decoded as a memoryview
+slice of the frame or an array sharing its memory. The message of every
+binary frame is a slice of the frame rather than a copy.
 
 """
 
 import json
+import struct
+from typing import Any, Sequence, Tuple, Union
+
+from .codecs import (
+    ARRAY,
+    BYTES_TYPES,
+    JSON_CODEC,
+    RAW,
+    Codec,
+    get_codec,
+    get_codec_by_id,
+    is_array,
+)
+from .errors import DeserializationError, SerializationError, UnknownCodecError
+
+_TOPIC_LENGTH = struct.Struct(">H")
+
+# Codecs chosen by the type of a message rather than negotiated
+_MESSAGE_CODECS = {RAW.id: RAW, ARRAY.id: ARRAY}
+
+# Parts of JSON frames around the topic and the message
+_JSON_TOPIC = b'{"topic":'
+_JSON_MESSAGE = b',"message":'
+_JSON_END = b"}"
+
+
+class Payload:
+    """Message of a frame, decoded on first access.
+
+    The decoded value is kept, so that several subscribers of the same message
+    only decode it once.
+    """
+
+    __slots__ = ("__codec", "__data", "__value", "__is_decoded")
+
+    def __init__(self, codec: Codec, data: bytes) -> None:
+        """
+        Initialize a payload that is not decoded yet.
+
+        :param codec: The codec the message was encoded with
+        :param data: The encoded message
+        """
+        self.__codec = codec
+        self.__data = data
+        self.__value: Any = None
+        self.__is_decoded = False
+
+    @classmethod
+    def decoded(cls, value: Any) -> "Payload":
+        """
+        Create a payload from an already decoded message.
+
+        :param value: The decoded message
+        :return: The payload
+        """
+        payload = cls(get_codec(JSON_CODEC), b"")
+        payload.__value = value
+        payload.__is_decoded = True
+        return payload
 
-from .errors import DeserializationError, SerializationError
+    def value(self) -> Any:
+        """
+        Get the decoded message, decoding it on the first call.
+
+        :return: The decoded message
+        :raises DeserializationError: If the message is not a valid encoding
+        """
+        if not self.__is_decoded:
+            self.__value = self.__codec.decode(self.__data)
+            self.__is_decoded = True
+            # Not needed anymore
+            self.__data = b""
+        return self.__value
+
+    def size(self) -> int:
+        """
+        Get the size of the encoded message.
+
+        :return: The size in bytes, 0 once the message is decoded
+        """
+        return len(self.__data)
 
 
 def deserialize(message: str) -> dict:
@@ -64,3 +167,153 @@ def serialize(topic: str, message: str) -> str:
     except TypeError as e:
         # If the message is not in the correct format, raise an error
         raise SerializationError("Invalid message format") from e
+
+
+def message_codec(message: Any, codec: Codec) -> Codec:
+    """Get the codec a message is actually encoded with.
+
+    :param message: The message
+    :param codec: The codec of the connection
+    :return: The raw codec for bytes-like messages, the array codec for NumPy
+        arrays, the given codec otherwise
+    """
+    if isinstance(message, BYTES_TYPES):
+        return RAW
+    if is_array(message):
+        return ARRAY
+    return codec
+
+
+def encode_parts(topic: str, parts: Sequence[Any], codec: Codec = RAW) -> bytes:
+    """Encode a binary frame from several bytes-like parts.
+
+    The parts are copied once, into the frame.
+
+    :param topic: The topic of the message
+    :param parts: The parts of the encoded message, in order
+    :param codec: The codec the message was encoded with
+    :return: The encoded frame
+    :raises SerializationError: If the topic is too long
+    """
+    encoded_topic = topic.encode("utf-8")
+
+    try:
+        header = _TOPIC_LENGTH.pack(len(encoded_topic))
+    except struct.error as e:
+        raise SerializationError("Topic too long") from e
+
+    return b"".join((bytes((codec.id,)), header, encoded_topic, *parts))
+
+
+def encode(topic: str, message: Any, codec: Codec = get_codec(JSON_CODEC)) -> bytes:
+    """Encode a message into a frame using a codec.
+
+    The frame starts with the id of the codec, except for JSON frames which
+    are plain JSON documents. The topic comes before the message in both
+    cases. Bytes-like messages and arrays are framed with their own codec,
+    see `message_codec`.
+
+    :param topic: The topic of the message
+    :param message: The message to encode
+    :param codec: The codec to encode the message with
+    :return: The encoded frame
+    :raises SerializationError: If the message cannot be encoded
+    """
+    codec = message_codec(message, codec)
+
+    if codec.is_text:
+        return b"".join(
+            (
+                _JSON_TOPIC,
+                codec.encode(topic),
+                _JSON_MESSAGE,
+                codec.encode(message),
+                _JSON_END,
+            )
+        )
+
+    return encode_parts(topic, codec.encode_parts(message), codec)
+
+
+def decode_frame(frame: Union[bytes, str]) -> Tuple[str, Payload]:
+    """Decode the topic of a frame, leaving the message encoded.
+
+    :param frame: The frame to decode
+    :return: The topic and the still encoded message
+    :raises DeserializationError: If the frame is not in the correct format
+    """
+    if isinstance(frame, str):
+        frame = frame.encode("utf-8")
+
+    if not frame:
+        raise DeserializationError("Empty frame")
+
+    try:
+        codec = _MESSAGE_CODECS.get(frame[0]) or get_codec_by_id(frame[0])
+    except UnknownCodecError as e:
+        raise DeserializationError(str(e)) from e
+
+    if codec.is_text:
+        return _decode_text_frame(frame, codec)
+
+    try:
+        (size,) = _TOPIC_LENGTH.unpack_from(frame, 1)
+        end = _TOPIC_LENGTH.size + 1 + size
+        if end > len(frame):
+            raise DeserializationError("Truncated topic")
+        topic = str(frame[_TOPIC_LENGTH.size + 1 : end], "utf-8")
+    except (struct.error, UnicodeDecodeError) as e:
+        raise DeserializationError("Invalid frame header") from e
+
+    return topic, Payload(codec, memoryview(frame)[end:])
+
+
+def decode(frame: Union[bytes, str]) -> dict:
+    """Decode a frame encoded by `encode` or `serialize`.
+
+    The codec is detected from the first byte of the frame.
+
+    :param frame: The frame to decode
+    :return: A dictionary containing the decoded message
+    :raises DeserializationError: If the frame is not in the correct format
+    """
+    topic, payload = decode_frame(frame)
+
+    return {"topic": topic, "message": payload.value()}
+
+
+def _decode_text_frame(frame: bytes, codec: Codec) -> Tuple[str, Payload]:
+    # Frames written by `encode` have the topic first and no whitespace
+    start = len(_JSON_TOPIC) + 1
+    end = frame.find(b'"', start)
+
+    if (
+        frame.startswith(_JSON_TOPIC + b'"')
+        and end != -1
+        and b"\\" not in frame[start:end]
+        and frame.startswith(_JSON_MESSAGE, end + 1)
+        and frame.endswith(_JSON_END)
+    ):
+        try:
+            topic = str(frame[start:end], "utf-8")
+        except UnicodeDecodeError as e:
+            raise DeserializationError("Invalid topic") from e
+
+        return topic, Payload(codec, frame[end + 1 + len(_JSON_MESSAGE) : -1])
+
+    # Any other layout, such as frames of `serialize`, is decoded as a whole
+    message_dict = codec.decode(frame)
+
+    if not isinstance(message_dict, dict):
+        raise DeserializationError("message is not a dictionary")
+
+    if "topic" not in message_dict:
+        raise DeserializationError("topic not in message")
+
+    if "message" not in message_dict:
+        raise DeserializationError("message not in message")
+
+    if not isinstance(message_dict["topic"], str):
+        raise DeserializationError("topic is not a string")
+
+    return message_dict["topic"], Payload.decoded(message_dict["message"])
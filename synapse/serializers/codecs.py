@@ -0,0 +1,540 @@
+"""
+Module containing the codecs used to encode messages on the wire.
+
+A codec turns a value made of None, booleans, numbers, strings, bytes, lists
+and dictionaries into bytes and back. Codecs are looked up by name in a
+registry, chosen per adapter and negotiated per connection.
+
+Every codec has a one byte id which prefixes the frames it encodes. The id
+of the JSON codec is ``{``, the first byte of every JSON object, so JSON
+frames need no prefix and stay plain JSON for clients that do not know about
+codecs.
+
+The following codecs are available:
+
+- ``json``: JSON text, encoded with orjson or ujson when they are installed
+  and with the standard library otherwise.
+- ``binary``: A compact built-in binary format.
+- ``msgpack``: MessagePack, only registered when msgpack is installed.
+
+Messages that are bytes, bytearrays or memoryviews are not encoded at all.
+They are framed as they are with the ``raw`` codec, whatever the codec of
+the connection, and decoded as a memoryview of the frame. In the same way,
+NumPy arrays are framed with the ``ndarray`` codec as a header holding their
+dtype, byte order and shape followed by their buffer, and decoded as
+read-only arrays sharing the memory of the frame. These codecs are never
+negotiated, as they cannot encode anything else, see `is_binary_message`.
+
+Instances of dataclasses are encoded with their compiled schema, see
+`schema`: as the list of their field values by positional codecs, which
+are the binary ones, and as a dictionary by the others.
+
+"""
+
+import json
+import struct
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .errors import DeserializationError, SerializationError, UnknownCodecError
+from .schema import get_schema, is_record
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover - depends on the environment
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - depends on the environment
+    numpy = None
+
+JSON_CODEC = "json"
+BINARY_CODEC = "binary"
+MSGPACK_CODEC = "msgpack"
+RAW_CODEC = "raw"
+ARRAY_CODEC = "ndarray"
+
+BYTES_TYPES = (bytes, bytearray, memoryview)
+
+
+class Codec:
+    """Base class of all codecs."""
+
+    # Name used to select and negotiate the codec
+    name: str = ""
+    # Byte prefixing the frames encoded with the codec
+    id: int = 0
+    # Whether the encoded data is UTF-8 text
+    is_text: bool = False
+    # Whether dataclasses are encoded as lists of field values
+    is_positional: bool = False
+
+    def encode(self, value: Any) -> bytes:
+        """Encode a value.
+
+        :param value: The value to encode
+        :return: The encoded value
+        :raises SerializationError: If the value cannot be encoded
+        """
+        raise NotImplementedError
+
+    def encode_parts(self, value: Any) -> Sequence[Any]:
+        """Encode a value as several bytes-like parts, to be joined in a frame.
+
+        Codecs override this method to avoid copying large buffers of the
+        value before the frame is assembled.
+
+        :param value: The value to encode
+        :return: The parts of the encoded value
+        :raises SerializationError: If the value cannot be encoded
+        """
+        return (self.encode(value),)
+
+    def decode(self, data: bytes) -> Any:
+        """Decode a value.
+
+        :param data: The encoded value
+        :return: The decoded value
+        :raises DeserializationError: If the data is not a valid encoding
+        """
+        raise NotImplementedError
+
+
+def encode_positional_record(value: Any) -> list:
+    """Encode an instance of a dataclass as the list of its field values.
+
+    :param value: The instance
+    :return: The field values
+    :raises TypeError: If the value is not an instance of a dataclass
+    """
+    if not is_record(value):
+        raise TypeError("Unsupported type %s" % type(value).__name__)
+    return get_schema(type(value)).to_list(value)
+
+
+def encode_named_record(value: Any) -> dict:
+    """Encode an instance of a dataclass as a dictionary.
+
+    :param value: The instance
+    :return: The field values, by field name
+    :raises TypeError: If the value is not an instance of a dataclass
+    """
+    if not is_record(value):
+        raise TypeError("Unsupported type %s" % type(value).__name__)
+    return get_schema(type(value)).to_dict(value)
+
+
+class JSONCodec(Codec):
+    """JSON codec using the fastest JSON library installed."""
+
+    name = JSON_CODEC
+    id = ord("{")
+    is_text = True
+
+    def encode(self, value: Any) -> bytes:
+        # Values the fast libraries reject, such as integers over 64 bits, are
+        # retried with the standard library
+        try:
+            if orjson is not None:
+                return orjson.dumps(value, default=encode_named_record)
+            if ujson is not None:
+                # Topics with escaped slashes could not be sliced out of frames
+                return ujson.dumps(
+                    value, ensure_ascii=False, escape_forward_slashes=False
+                ).encode("utf-8")
+        except (TypeError, OverflowError):
+            pass
+
+        try:
+            return json.dumps(
+                value, separators=(",", ":"), default=encode_named_record
+            ).encode("utf-8")
+        except (TypeError, ValueError) as e:
+            raise SerializationError("Invalid JSON value") from e
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            if orjson is not None:
+                return orjson.loads(data)
+            if ujson is not None:
+                return ujson.loads(data)
+            return json.loads(data)
+        except ValueError as e:
+            raise DeserializationError("Invalid JSON") from e
+
+
+_NONE = 0xC0
+_FALSE = 0xC2
+_TRUE = 0xC3
+_BYTES = 0xC4
+_FLOAT = 0xCB
+_INT = 0xD3
+_BIG_INT = 0xD4
+_STR = 0xD9
+_LIST = 0xDC
+_DICT = 0xDE
+# Integers from 0 to 127 are encoded as a single byte
+_MAX_SMALL_INT = 0x7F
+# Lists and dictionaries nested deeper are rejected when decoding, long before
+# the recursion limit of the interpreter
+MAX_DEPTH = 100
+
+_INT64 = struct.Struct(">q")
+_FLOAT64 = struct.Struct(">d")
+
+
+class BinaryCodec(Codec):
+    """Compact binary codec.
+
+    Every value starts with a tag byte. Integers from 0 to 127 are the tag
+    itself, lengths and counts are unsigned LEB128 varints and fixed size
+    numbers are big-endian. Dictionary keys are strings, and lists and
+    dictionaries are nested at most `MAX_DEPTH` levels deep.
+    """
+
+    name = BINARY_CODEC
+    id = 0x02
+    is_positional = True
+
+    def encode(self, value: Any) -> bytes:
+        out = bytearray()
+        try:
+            self.__encode(value, out)
+        except (TypeError, ValueError) as e:
+            raise SerializationError("Invalid binary value") from e
+        return bytes(out)
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            with memoryview(data) as view:
+                value, offset = self.__decode(view, 0, 0)
+        except (
+            IndexError,
+            TypeError,
+            ValueError,
+            struct.error,
+            RecursionError,
+        ) as e:
+            raise DeserializationError("Invalid binary data") from e
+
+        if offset != len(data):
+            raise DeserializationError("Trailing bytes after binary value")
+        return value
+
+    # Private methods
+    def __encode(self, value: Any, out: bytearray) -> None:
+        if value is None:
+            out.append(_NONE)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, int):
+            if 0 <= value <= _MAX_SMALL_INT:
+                out.append(value)
+            elif -(2**63) <= value < 2**63:
+                out.append(_INT)
+                out += _INT64.pack(value)
+            else:
+                data = value.to_bytes((value.bit_length() + 8) // 8, "big", signed=True)
+                out.append(_BIG_INT)
+                self.__encode_size(len(data), out)
+                out += data
+        elif isinstance(value, float):
+            out.append(_FLOAT)
+            out += _FLOAT64.pack(value)
+        elif isinstance(value, str):
+            data = value.encode("utf-8")
+            out.append(_STR)
+            self.__encode_size(len(data), out)
+            out += data
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            out.append(_BYTES)
+            self.__encode_size(len(value), out)
+            out += value
+        elif isinstance(value, (list, tuple)):
+            out.append(_LIST)
+            self.__encode_size(len(value), out)
+            for item in value:
+                self.__encode(item, out)
+        elif isinstance(value, dict):
+            out.append(_DICT)
+            self.__encode_size(len(value), out)
+            for key, item in value.items():
+                if not isinstance(key, str):
+                    raise TypeError("Dictionary keys must be strings")
+                self.__encode(key, out)
+                self.__encode(item, out)
+        else:
+            self.__encode(encode_positional_record(value), out)
+
+    def __encode_size(self, size: int, out: bytearray) -> None:
+        while size > 0x7F:
+            out.append((size & 0x7F) | 0x80)
+            size >>= 7
+        out.append(size)
+
+    def __decode_size(self, view: memoryview, offset: int) -> Tuple[int, int]:
+        size = 0
+        shift = 0
+        while True:
+            byte = view[offset]
+            offset += 1
+            size |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return size, offset
+            shift += 7
+
+    def __decode(self, view: memoryview, offset: int, depth: int) -> Tuple[Any, int]:
+        tag = view[offset]
+        offset += 1
+
+        if tag <= _MAX_SMALL_INT:
+            return tag, offset
+        if tag == _NONE:
+            return None, offset
+        if tag == _TRUE:
+            return True, offset
+        if tag == _FALSE:
+            return False, offset
+        if tag == _INT:
+            return _INT64.unpack_from(view, offset)[0], offset + _INT64.size
+        if tag == _FLOAT:
+            return _FLOAT64.unpack_from(view, offset)[0], offset + _FLOAT64.size
+
+        if tag in (_STR, _BYTES, _BIG_INT):
+            size, offset = self.__decode_size(view, offset)
+            end = offset + size
+            if end > len(view):
+                raise ValueError("Truncated value")
+            if tag == _STR:
+                return str(view[offset:end], "utf-8"), end
+            if tag == _BYTES:
+                return bytes(view[offset:end]), end
+            return int.from_bytes(view[offset:end], "big", signed=True), end
+
+        if tag in (_LIST, _DICT) and depth >= MAX_DEPTH:
+            raise ValueError("Values nested deeper than %d levels" % MAX_DEPTH)
+
+        if tag == _LIST:
+            size, offset = self.__decode_size(view, offset)
+            items = []
+            for _ in range(size):
+                item, offset = self.__decode(view, offset, depth + 1)
+                items.append(item)
+            return items, offset
+
+        if tag == _DICT:
+            size, offset = self.__decode_size(view, offset)
+            items = {}
+            for _ in range(size):
+                key, offset = self.__decode(view, offset, depth + 1)
+                if not isinstance(key, str):
+                    raise ValueError("Dictionary keys must be strings")
+                items[key], offset = self.__decode(view, offset, depth + 1)
+            return items, offset
+
+        raise ValueError("Unknown tag 0x%02x" % tag)
+
+
+class MsgpackCodec(Codec):
+    """MessagePack codec, available when msgpack is installed."""
+
+    name = MSGPACK_CODEC
+    id = 0x03
+    is_positional = True
+
+    def encode(self, value: Any) -> bytes:
+        try:
+            return msgpack.packb(
+                value, use_bin_type=True, default=encode_positional_record
+            )
+        except (TypeError, ValueError, OverflowError) as e:
+            raise SerializationError("Invalid msgpack value") from e
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError) as e:
+            raise DeserializationError("Invalid msgpack data") from e
+
+
+class RawCodec(Codec):
+    """Codec leaving bytes-like values as they are."""
+
+    name = RAW_CODEC
+    id = 0x01
+
+    def encode(self, value: Any) -> bytes:
+        # Copied once, when the frame is assembled
+        if not isinstance(value, BYTES_TYPES):
+            raise SerializationError("Raw values must be bytes-like")
+        return value
+
+    def decode(self, data: bytes) -> Any:
+        # A view of the received frame, which is never modified
+        return data if isinstance(data, memoryview) else memoryview(data)
+
+
+_ARRAY_KINDS = "biufcmMSU"
+_ARRAY_DTYPE_SIZE = struct.Struct(">B")
+_ARRAY_NDIM = struct.Struct(">B")
+_ARRAY_DIM = struct.Struct(">Q")
+
+
+class ArrayCodec(Codec):
+    """Codec of NumPy arrays, available when numpy is installed.
+
+    An array is encoded as the size and string of its dtype, which holds the
+    byte order, the number of dimensions, every dimension as an unsigned
+    64 bits integer and the buffer of the array in C order.
+    """
+
+    name = ARRAY_CODEC
+    id = 0x04
+
+    def encode(self, value: Any) -> bytes:
+        return b"".join(self.encode_parts(value))
+
+    def encode_parts(self, value: Any) -> Sequence[Any]:
+        if not is_array(value) or value.dtype.kind not in _ARRAY_KINDS:
+            raise SerializationError("Unsupported array")
+
+        dtype = value.dtype.str.encode("ascii")
+        try:
+            header = b"".join(
+                (
+                    _ARRAY_DTYPE_SIZE.pack(len(dtype)),
+                    dtype,
+                    _ARRAY_NDIM.pack(value.ndim),
+                    *(_ARRAY_DIM.pack(size) for size in value.shape),
+                )
+            )
+        except struct.error as e:
+            raise SerializationError("Unsupported array shape") from e
+
+        # Only copied here if the array is not contiguous
+        data = numpy.ascontiguousarray(value).reshape(-1).view(numpy.uint8)
+        return header, memoryview(data)
+
+    def decode(self, data: bytes) -> Any:
+        if numpy is None:
+            raise DeserializationError("Arrays cannot be decoded without numpy")
+
+        try:
+            (size,) = _ARRAY_DTYPE_SIZE.unpack_from(data, 0)
+            offset = _ARRAY_DTYPE_SIZE.size
+            dtype = numpy.dtype(str(data[offset : offset + size], "ascii"))
+            offset += size
+
+            (ndim,) = _ARRAY_NDIM.unpack_from(data, offset)
+            offset += _ARRAY_NDIM.size
+            shape = []
+            for _ in range(ndim):
+                shape.append(_ARRAY_DIM.unpack_from(data, offset)[0])
+                offset += _ARRAY_DIM.size
+
+            count = 1
+            for dim in shape:
+                count *= dim
+
+            if dtype.kind not in _ARRAY_KINDS or len(data) - offset != (
+                count * dtype.itemsize
+            ):
+                raise ValueError("Array size does not match its header")
+
+            # Read-only, as the frame is never modified
+            array = numpy.frombuffer(data, dtype, count, offset)
+            return array.reshape(shape)
+        except (TypeError, ValueError, UnicodeDecodeError, struct.error) as e:
+            raise DeserializationError("Invalid array data") from e
+
+
+def is_array(value: Any) -> bool:
+    """Check if a value is a NumPy array.
+
+    :param value: The value to check
+    :return: True if numpy is installed and the value is an array
+    """
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+def is_binary_message(value: Any) -> bool:
+    """Check if a message is framed as it is rather than encoded by a codec.
+
+    Such messages are bytes-like values, framed with the raw codec, and NumPy
+    arrays, framed with the array codec.
+
+    :param value: The message
+    :return: True if the message is bytes-like or an array
+    """
+    return isinstance(value, BYTES_TYPES) or is_array(value)
+
+
+RAW = RawCodec()
+ARRAY = ArrayCodec()
+
+_codecs_by_name: Dict[str, Codec] = dict()
+_codecs_by_id: Dict[int, Codec] = dict()
+
+
+def register_codec(codec: Codec) -> None:
+    """Register a codec.
+
+    A codec registered under the name or id of another codec replaces it.
+
+    :param codec: The codec to register
+    """
+    _codecs_by_name[codec.name] = codec
+    _codecs_by_id[codec.id] = codec
+
+
+def get_codec(name: str) -> Codec:
+    """Get a registered codec by name.
+
+    :param name: The name of the codec
+    :return: The codec
+    :raises UnknownCodecError: If no codec is registered under the name
+    """
+    try:
+        return _codecs_by_name[name]
+    except KeyError:
+        raise UnknownCodecError("Unknown codec [%s]" % name) from None
+
+
+def get_codec_by_id(codec_id: int) -> Codec:
+    """Get a registered codec by the id prefixing its frames.
+
+    :param codec_id: The id of the codec
+    :return: The codec
+    :raises UnknownCodecError: If no codec is registered under the id
+    """
+    try:
+        return _codecs_by_id[codec_id]
+    except KeyError:
+        raise UnknownCodecError("Unknown codec id [0x%02x]" % codec_id) from None
+
+
+def available_codecs() -> List[str]:
+    """Get the names of all registered codecs.
+
+    :return: The names of the registered codecs
+    """
+    return list(_codecs_by_name)
+
+
+register_codec(JSONCodec())
+register_codec(BinaryCodec())
+
+if msgpack is not None:  # pragma: no cover - depends on the environment
+    register_codec(MsgpackCodec())
@@ -1,9 +1,37 @@
+"""
+Module containing functions for building and reading connector messages.
+
+States and events are published as their payload, commands and command
+responses as a dictionary holding the payload and the correlation id. These
+messages are placed as they are in the envelope of the adapter and encoded
+together with it in a single pass, so payloads are never encoded twice.
+
+States published in delta mode are dictionaries holding a sequence number
+under ``$seq`` and either the full value under ``$value`` or a diff against
+the previous value under ``$patch``, see the `delta` module. Plain state
+payloads must therefore not be dictionaries with a ``$seq`` key.
+
+Commands whose handler streams its response are answered with one message
+per chunk, marked with ``more``, followed by a plain response without
+payload. The requester grants the server a number of chunks it may send
+ahead with ``credit``, and grants more as it consumes them.
+
+The ``serialize_*`` and ``deserialize_*`` functions working on JSON strings
+are kept for peers that still send connector messages as strings.
+
+"""
+
 import json
-from typing import Tuple
+from typing import Optional, Tuple, Union
 
 from ..connector import PAYLOAD
 from .errors import DeserializationError, SerializationError
 
+# Keys of states published in delta mode
+STATE_SEQ = "$seq"
+STATE_VALUE = "$value"
+STATE_PATCH = "$patch"
+
 
 # TODO: Replace raising errors with returning error
 def deserialize_payload(message: str) -> PAYLOAD:
@@ -23,10 +51,13 @@ def serialize_payload(payload: PAYLOAD) -> str:
         raise SerializationError("Invalid payload format") from e
 
 
-# TODO: Replace raising errors with returning error
-def deserialize_command(message: str) -> Tuple[PAYLOAD, int]:
+def _deserialize_command_dict(message: Union[str, dict]) -> dict:
     try:
-        message_dict = json.loads(message)
+        # Strings come from peers that still serialize commands separately
+        message_dict = json.loads(message) if isinstance(message, str) else message
+
+        if not isinstance(message_dict, dict):
+            raise DeserializationError("command is not a dictionary")
 
         if "correlation_id" not in message_dict:
             raise DeserializationError("correlation_id not in message")
@@ -34,16 +65,176 @@ def deserialize_command(message: str) -> Tuple[PAYLOAD, int]:
         if "payload" not in message_dict:
             raise DeserializationError("payload not in message")
 
-        return message_dict["payload"], message_dict["correlation_id"]
+        return message_dict
     except json.decoder.JSONDecodeError as e:
         # If the JSON is invalid, raise an error
         raise DeserializationError("Invalid JSON") from e
 
 
+def make_command(
+    payload: PAYLOAD,
+    correlation_id: int,
+    reply_to: Optional[str] = None,
+    deadline: Optional[float] = None,
+    credit: Optional[int] = None,
+) -> dict:
+    """Build a command or command response message.
+
+    :param payload: The payload of the command or response
+    :param correlation_id: The id matching a response to its command
+    :param reply_to: The topic the response is expected on, if any
+    :param deadline: The time, in seconds since the epoch, after which the
+        response is not wanted anymore, if any
+    :param credit: The number of chunks a streamed response may send before
+        the requester grants more, for streaming commands only
+    :return: The message, to be published as it is
+    """
+    message_dict = {"payload": payload, "correlation_id": correlation_id}
+
+    if reply_to is not None:
+        message_dict["reply_to"] = reply_to
+
+    if deadline is not None:
+        message_dict["deadline"] = deadline
+
+    if credit is not None:
+        message_dict["credit"] = credit
+
+    return message_dict
+
+
+def make_stream_chunk(correlation_id: int, payload: PAYLOAD) -> dict:
+    """Build a message holding one chunk of a streamed response.
+
+    :param correlation_id: The id of the command
+    :param payload: The chunk
+    :return: The message, to be published as it is
+    """
+    return {"payload": payload, "correlation_id": correlation_id, "more": True}
+
+
+# TODO: Replace raising errors with returning error
+def deserialize_command(message: Union[str, dict]) -> Tuple[PAYLOAD, int]:
+    message_dict = _deserialize_command_dict(message)
+
+    return message_dict["payload"], message_dict["correlation_id"]
+
+
+def deserialize_command_request(
+    message: Union[str, dict],
+) -> Tuple[PAYLOAD, int, Optional[str]]:
+    message_dict = _deserialize_command_dict(message)
+
+    # Only present if the response is expected on a topic of the requester
+    return (
+        message_dict["payload"],
+        message_dict["correlation_id"],
+        message_dict.get("reply_to"),
+    )
+
+
+def make_command_error(correlation_id: int, error: str) -> dict:
+    """Build the response to a command that failed.
+
+    :param correlation_id: The id of the failed command
+    :param error: A description of the failure
+    :return: The message, to be published as it is
+    """
+    return {"payload": None, "correlation_id": correlation_id, "error": error}
+
+
+def deserialize_command_error(message: Union[str, dict]) -> Optional[str]:
+    message_dict = _deserialize_command_dict(message)
+
+    # Only present if the command failed
+    return message_dict.get("error")
+
+
+def deserialize_command_deadline(message: Union[str, dict]) -> Optional[float]:
+    message_dict = _deserialize_command_dict(message)
+
+    # Only present if the requester stops waiting at some point
+    deadline = message_dict.get("deadline")
+
+    if deadline is not None and (
+        not isinstance(deadline, (int, float)) or isinstance(deadline, bool)
+    ):
+        raise DeserializationError("deadline is not a number")
+
+    return deadline
+
+
+def deserialize_command_credit(message: Union[str, dict]) -> Optional[int]:
+    message_dict = _deserialize_command_dict(message)
+
+    # Only present if the requester expects a streamed response
+    credit = message_dict.get("credit")
+
+    if credit is not None and (
+        not isinstance(credit, int) or isinstance(credit, bool) or credit < 1
+    ):
+        raise DeserializationError("credit is not a positive integer")
+
+    return credit
+
+
+def is_stream_chunk(message: Union[str, dict]) -> bool:
+    message_dict = _deserialize_command_dict(message)
+
+    # More chunks follow, the end of the stream is a plain response
+    return message_dict.get("more") is True
+
+
 # TODO: Replace raising errors with returning error
-def serialize_command(payload: PAYLOAD, correlation_id: int) -> str:
+def serialize_command(
+    payload: PAYLOAD, correlation_id: int, reply_to: Optional[str] = None
+) -> str:
     try:
-        return json.dumps({"payload": payload, "correlation_id": correlation_id})
+        return json.dumps(make_command(payload, correlation_id, reply_to))
     except TypeError as e:
         # If the message is not in the correct format, raise an error
         raise SerializationError("Invalid message format") from e
+
+
+def make_state_keyframe(seq: int, payload: PAYLOAD) -> dict:
+    """Build a state update of the delta mode holding the full value.
+
+    :param seq: The sequence number of the update
+    :param payload: The value of the state
+    :return: The message, to be published as it is
+    """
+    return {STATE_SEQ: seq, STATE_VALUE: payload}
+
+
+def make_state_delta(seq: int, patch: dict) -> dict:
+    """Build a state update of the delta mode holding a diff.
+
+    :param seq: The sequence number of the update
+    :param patch: The diff against the update with the previous sequence number
+    :return: The message, to be published as it is
+    """
+    return {STATE_SEQ: seq, STATE_PATCH: patch}
+
+
+def read_state_update(message: PAYLOAD) -> Optional[Tuple[int, bool, PAYLOAD]]:
+    """Read a state update of the delta mode.
+
+    :param message: The received state message
+    :return: The sequence number, whether the update is a keyframe and the
+        value or diff, or None if the message is a plain payload
+    :raises DeserializationError: If the update is not in the correct format
+    """
+    if not isinstance(message, dict) or STATE_SEQ not in message:
+        return None
+
+    seq = message[STATE_SEQ]
+    if not isinstance(seq, int):
+        raise DeserializationError("state sequence number is not an integer")
+
+    if STATE_VALUE in message:
+        return seq, True, message[STATE_VALUE]
+
+    if not isinstance(message.get(STATE_PATCH), dict):
+        raise DeserializationError("state update has neither value nor patch")
+
+    return seq, False, message[STATE_PATCH]
@@ -0,0 +1,107 @@
+"""
+Module containing functions for computing and applying structural diffs.
+
+A diff turns one dictionary into another. It is a dictionary with up to three
+entries, each left out when empty:
+
+- ``s``: Keys set to a new value, with the value.
+- ``d``: Keys removed.
+- ``p``: Keys whose value is a dictionary in both versions, with the diff of
+  that dictionary.
+
+Values that are not dictionaries are never diffed, they are replaced as a
+whole when they change.
+
+"""
+
+from typing import Any, Optional
+
+_SET = "s"
+_DELETE = "d"
+_PATCH = "p"
+
+
+def diff(old: Any, new: Any) -> Optional[dict]:
+    """Compute the diff turning a value into another.
+
+    :param old: The previous value
+    :param new: The new value
+    :return: The diff, or None if the values cannot be diffed because one of
+        them is not a dictionary
+    """
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return None
+
+    changes: dict = dict()
+    patches: dict = dict()
+
+    for key, value in new.items():
+        if key not in old:
+            changes[key] = value
+            continue
+
+        previous = old[key]
+        if previous is value or previous == value:
+            continue
+
+        patch = diff(previous, value)
+        if patch is not None:
+            patches[key] = patch
+        else:
+            changes[key] = value
+
+    removed = [key for key in old if key not in new]
+
+    result: dict = dict()
+    if changes:
+        result[_SET] = changes
+    if removed:
+        result[_DELETE] = removed
+    if patches:
+        result[_PATCH] = patches
+    return result
+
+
+def apply(value: dict, patch: dict) -> dict:
+    """Apply a diff to a value.
+
+    The value is not modified, only the dictionaries on the path of a change
+    are copied.
+
+    :param value: The value the diff was computed against
+    :param patch: The diff
+    :return: The new value
+    :raises ValueError: If the diff does not apply to the value
+    """
+    if not isinstance(value, dict) or not isinstance(patch, dict):
+        raise ValueError("Diffs only apply to dictionaries")
+
+    result = dict(value)
+
+    for key in patch.get(_DELETE, ()):
+        result.pop(key, None)
+
+    result.update(patch.get(_SET, {}))
+
+    for key, sub_patch in patch.get(_PATCH, {}).items():
+        if key not in result:
+            raise ValueError("Diff of missing key [%s]" % key)
+        result[key] = apply(result[key], sub_patch)
+
+    return result
+
+
+def snapshot(value: Any) -> Any:
+    """Copy the dictionaries and lists of a value.
+
+    Diffs are computed against snapshots, so that values modified in place
+    after being published are still seen as changed.
+
+    :param value: The value to copy
+    :return: The copy
+    """
+    if isinstance(value, dict):
+        return {key: snapshot(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [snapshot(item) for item in value]
+    return value
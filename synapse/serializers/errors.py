@@ -10,3 +10,10 @@ class SerializationError(Exception):
 
     def __init__(self, message: str):
         super().__init__(message)
+
+
+class UnknownCodecError(Exception):
+    """Raised when a codec is not registered."""
+
+    def __init__(self, message: str):
+        super().__init__(message)
@@ -0,0 +1,283 @@
+"""
+Module compiling dataclasses into specialised encoders and decoders.
+
+The schema of a dataclass is compiled once, the first time it is used, into
+functions reading and passing every field directly, without going through
+`dataclasses.asdict` or iterating over the fields for every message:
+
+- The positional encoder turns an instance into the list of its field
+  values, in the order of the fields. It is used by binary codecs, so that
+  messages carry no field names.
+- The named encoder turns an instance into a dictionary. It is used by the
+  JSON codec, so that messages stay readable by peers without the schema.
+
+The decoder accepts both forms and builds an instance of the dataclass.
+Positional values may leave out trailing fields that have a default, so
+fields can be appended to a schema without breaking older peers.
+
+Fields whose type is a dataclass, or a list, tuple, dictionary or optional
+value of dataclasses, are converted recursively, and tuples are rebuilt as
+tuples. Other values are taken as they are, without validation.
+
+"""
+
+import collections.abc
+import dataclasses
+import types
+import typing
+from typing import Any, Callable, Dict, Generic, Optional, Tuple, Type, TypeVar
+
+from .errors import DeserializationError
+
+T = TypeVar("T")
+
+CONVERTER = Callable[[Any], Any]
+
+_LIST_TYPES = (list, collections.abc.Sequence, collections.abc.Iterable)
+_DICT_TYPES = (dict, collections.abc.Mapping)
+# Unions written as X | Y have their own type from Python 3.10
+_UNION_TYPES = (typing.Union, getattr(types, "UnionType", typing.Union))
+
+_schemas: Dict[type, "Schema"] = dict()
+
+
+def is_record(value: Any) -> bool:
+    """
+    Check if a value is an instance of a dataclass.
+
+    :param value: The value to check
+    :return: True if the value is a dataclass instance, False otherwise
+    """
+    return dataclasses.is_dataclass(value) and not isinstance(value, type)
+
+
+def get_schema(cls: type) -> "Schema":
+    """
+    Get the schema of a dataclass, compiling it on first use.
+
+    :param cls: The dataclass
+    :return: The schema
+    :raises TypeError: If the class is not a dataclass or the types of its
+        fields cannot be resolved
+    """
+    schema = _schemas.get(cls)
+    if schema is None:
+        schema = Schema(cls)
+    return schema
+
+
+def _optional(converter: Optional[CONVERTER]) -> Optional[CONVERTER]:
+    if converter is None:
+        return None
+    return lambda value: None if value is None else converter(value)
+
+
+def _each(converter: Optional[CONVERTER]) -> Optional[CONVERTER]:
+    if converter is None:
+        return None
+    return lambda values: [converter(value) for value in values]
+
+
+def _each_value(converter: Optional[CONVERTER]) -> Optional[CONVERTER]:
+    if converter is None:
+        return None
+    return lambda values: {key: converter(value) for key, value in values.items()}
+
+
+def _converters(
+    hint: Any,
+) -> Tuple[Optional[CONVERTER], Optional[CONVERTER], Optional[CONVERTER]]:
+    # Positional encoder, named encoder and decoder of a field type, None for
+    # values taken as they are
+    if isinstance(hint, type) and dataclasses.is_dataclass(hint):
+        schema = get_schema(hint)
+        return schema.to_list, schema.to_dict, schema.decode
+
+    origin = typing.get_origin(hint)
+    args = typing.get_args(hint)
+
+    if origin in _UNION_TYPES:
+        items = [arg for arg in args if arg is not type(None)]
+        if len(items) != 1:
+            return None, None, None
+
+        positional, named, decode = _converters(items[0])
+        return _optional(positional), _optional(named), _optional(decode)
+
+    # Codecs decode tuples as lists
+    if origin is tuple:
+        if len(args) != 2 or args[1] is not Ellipsis:
+            return None, None, tuple
+
+        positional, named, decode = _converters(args[0])
+        if decode is None:
+            return None, None, tuple
+        return (
+            _each(positional),
+            _each(named),
+            lambda values: tuple(decode(value) for value in values),
+        )
+
+    if origin in _LIST_TYPES and len(args) == 1:
+        positional, named, decode = _converters(args[0])
+        return _each(positional), _each(named), _each(decode)
+
+    if origin in _DICT_TYPES and len(args) == 2:
+        positional, named, decode = _converters(args[1])
+        return _each_value(positional), _each_value(named), _each_value(decode)
+
+    return None, None, None
+
+
+class Schema(Generic[T]):
+    """
+    Compiled encoders and decoder of a dataclass.
+    """
+
+    def __init__(self, cls: Type[T]) -> None:
+        """
+        Compile the schema of a dataclass.
+
+        Schemas are shared, use `get_schema` rather than creating them.
+
+        :param cls: The dataclass
+        :raises TypeError: If the class is not a dataclass or the types of its
+            fields cannot be resolved
+        """
+        if not isinstance(cls, type) or not dataclasses.is_dataclass(cls):
+            raise TypeError("%s is not a dataclass" % getattr(cls, "__name__", cls))
+
+        self.__cls = cls
+
+        # Registered before the fields are compiled, for recursive dataclasses
+        _schemas[cls] = self
+        try:
+            self.__compile()
+        except Exception as e:
+            del _schemas[cls]
+            raise TypeError(
+                "Cannot compile schema of %s: %s" % (cls.__name__, e)
+            ) from e
+
+    # Private methods
+    def __compile(self) -> None:
+        fields = [field for field in dataclasses.fields(self.__cls) if field.init]
+        hints = typing.get_type_hints(self.__cls)
+
+        namespace: dict[str, Any] = {"cls": self.__cls}
+        positional = []
+        named = []
+        from_list = []
+        from_dict = []
+
+        for i, field in enumerate(fields):
+            encode_positional, encode_named, decode = _converters(hints[field.name])
+            namespace[f"p{i}"] = encode_positional
+            namespace[f"n{i}"] = encode_named
+            namespace[f"d{i}"] = decode
+
+            value = f"v.{field.name}"
+            positional.append(value if encode_positional is None else f"p{i}({value})")
+            named.append(
+                f"{field.name!r}: "
+                + (value if encode_named is None else f"n{i}({value})")
+            )
+
+            item = "d[%d]" % i
+            key = "d[%r]" % field.name
+            if decode is not None:
+                item = f"d{i}({item})"
+                key = f"d{i}({key})"
+
+            # Fields with a default may be left out
+            if field.default is not dataclasses.MISSING:
+                namespace[f"default{i}"] = field.default
+                default = f"default{i}"
+            elif field.default_factory is not dataclasses.MISSING:
+                namespace[f"factory{i}"] = field.default_factory
+                default = f"factory{i}()"
+            else:
+                default = None
+
+            if default is not None:
+                item = f"{item} if len(d) > {i} else {default}"
+                key = f"{key} if {field.name!r} in d else {default}"
+
+            from_list.append(f"{field.name}={item}")
+            from_dict.append(f"{field.name}={key}")
+
+        source = "\n".join(
+            (
+                "def to_list(v):",
+                "    return [%s]" % ", ".join(positional),
+                "def to_dict(v):",
+                "    return {%s}" % ", ".join(named),
+                "def from_list(d):",
+                f"    if len(d) > {len(fields)}:",
+                "        raise ValueError('Too many values')",
+                "    return cls(%s)" % ", ".join(from_list),
+                "def from_dict(d):",
+                "    return cls(%s)" % ", ".join(from_dict),
+            )
+        )
+        exec(source, namespace)
+
+        self.__to_list = namespace["to_list"]
+        self.__to_dict = namespace["to_dict"]
+        self.__from_list = namespace["from_list"]
+        self.__from_dict = namespace["from_dict"]
+
+    # Public methods
+    def type(self) -> Type[T]:
+        """
+        Get the dataclass of the schema.
+
+        :return: The dataclass
+        """
+        return self.__cls
+
+    def to_list(self, value: T) -> list:
+        """
+        Encode an instance as the list of its field values.
+
+        :param value: The instance
+        :return: The field values, in the order of the fields
+        """
+        return self.__to_list(value)
+
+    def to_dict(self, value: T) -> dict:
+        """
+        Encode an instance as a dictionary.
+
+        :param value: The instance
+        :return: The field values, by field name
+        """
+        return self.__to_dict(value)
+
+    def decode(self, value: Any) -> T:
+        """
+        Build an instance from its list or dictionary encoding.
+
+        Instances are returned as they are, for messages that were never
+        encoded.
+
+        :param value: The encoded instance
+        :return: The instance
+        :raises DeserializationError: If the value does not match the schema
+        """
+        if isinstance(value, self.__cls):
+            return value
+
+        try:
+            if isinstance(value, list):
+                return self.__from_list(value)
+            if isinstance(value, dict):
+                return self.__from_dict(value)
+        except (IndexError, KeyError, TypeError, ValueError) as e:
+            raise DeserializationError(
+                "Invalid %s value: %s" % (self.__cls.__name__, e)
+            ) from e
+
+        raise DeserializationError(
+            "Invalid %s value of type %s" % (self.__cls.__name__, type(value).__name__)
+        )
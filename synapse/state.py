@@ -7,16 +7,27 @@ class State(Event):
     def __init__(self, initial_value: Any = None) -> None:
         super().__init__()
         self._value = initial_value
+        # Incremented every time the value changes
+        self._version = 0
 
     def set(self, value: Any) -> None:
-        if self._value == value:
-            return
+        try:
+            if self._value is value or self._value == value:
+                return
+        except ValueError:
+            # Values such as arrays have no single truth value when compared,
+            # they are always seen as changed
+            pass
         self._value = value
+        self._version += 1
         self.notify(self._value)
 
     def get(self) -> Any:
         return self._value
 
+    def version(self) -> int:
+        return self._version
+
     def subscribe(self, callback: Callable[..., Any]) -> None:
         if self.get() is not None:
             callback(self.get())
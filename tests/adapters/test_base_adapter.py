@@ -1,6 +1,23 @@
 import asyncio
 
 from synapse.adapters import Adapter
+from synapse.adapters.adapter import (
+    BATCH_TOPIC,
+    CHUNK_TOPIC,
+    HELLO_TOPIC,
+    SUBSCRIBE_TOPIC,
+    UNSUBSCRIBE_TOPIC,
+)
+from synapse.adapters.dispatcher import Dispatcher
+from synapse.adapters.peer import Peer
+from synapse.adapters.priority import DEFAULT_PRIORITY_CLASSES
+from synapse.serializers.adapter_message_serializer import (
+    Payload,
+    decode,
+    decode_frame,
+    encode,
+)
+from synapse.serializers.codecs import BINARY_CODEC, get_codec
 
 
 def test_when_updating_connection_status_then_is_connected_is_updated():
@@ -37,3 +54,433 @@ async def test_given_a_topic_is_subscribed_when_notifying_then_callback_is_calle
         ), f"callback for topic {topic} was not called with message {message}"
 
     assert True
+
+
+class RecordingPeer(Peer):
+    def __init__(self, name: str, **kwargs) -> None:
+        super().__init__(name, **kwargs)
+
+        self.written: list = []
+
+    async def _write(self, frames: list) -> None:
+        self.written.extend(frames)
+
+    def _abort(self) -> None:
+        pass
+
+
+async def test_given_server_when_publishing_then_only_subscribed_peers_receive():
+    """Test that servers only send messages to peers subscribed to the topic."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+
+    subscribed, other = RecordingPeer("subscribed"), RecordingPeer("other")
+    adapter._add_peer(subscribed)
+    adapter._add_peer(other)
+
+    adapter._handle_message(subscribed, SUBSCRIBE_TOPIC, "state/a")
+
+    assert await adapter.publish("state/a", "1")
+    await asyncio.sleep(0)
+
+    assert subscribed.written == [encode("state/a", "1")]
+    assert other.written == []
+
+    adapter._handle_message(subscribed, UNSUBSCRIBE_TOPIC, "state/a")
+
+    assert await adapter.publish("state/a", "2")
+    await asyncio.sleep(0)
+
+    assert subscribed.written == [encode("state/a", "1")]
+
+
+async def test_given_full_topic_when_waiting_for_dispatch_then_only_its_sender_waits():
+    """Test that a slow subscriber only slows down the peers sending to it."""
+
+    adapter = Adapter(dispatcher=Dispatcher(max_queue_size=2))
+    release = asyncio.Event()
+
+    async def callback(msg):
+        await release.wait()
+
+    adapter.subscribe("slow", callback)
+    flooding, other = RecordingPeer("flooding"), RecordingPeer("other")
+    for i in range(4):
+        adapter._handle_message(flooding, "slow", i)
+        await asyncio.sleep(0)
+
+    await asyncio.wait_for(adapter._wait_for_dispatch(other), 1)
+    waiter = asyncio.ensure_future(adapter._wait_for_dispatch(flooding))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    release.set()
+    await asyncio.wait_for(waiter, 1)
+
+
+async def test_given_client_subscriptions_when_connecting_then_they_are_announced():
+    """Test that clients announce their subscriptions to the server."""
+
+    async def callback(msg):
+        pass
+
+    adapter = Adapter()
+    adapter.subscribe("state/a", callback)
+    adapter.subscribe("event/#", callback)
+    adapter._update_connection_status(False, True)
+
+    peer = RecordingPeer("server")
+    adapter._add_peer(peer)
+    adapter.subscribe("state/b", callback)
+    adapter.unsubscribe("state/a")
+    await asyncio.sleep(0)
+
+    # The subscriptions known when connecting are sent together
+    assert peer.written == [
+        encode(
+            BATCH_TOPIC,
+            [[SUBSCRIBE_TOPIC, "state/a"], [SUBSCRIBE_TOPIC, "event/#"]],
+        ),
+        encode(SUBSCRIBE_TOPIC, "state/b"),
+        encode(UNSUBSCRIBE_TOPIC, "state/a"),
+    ]
+
+
+async def test_given_wildcard_subscriptions_when_notifying_then_all_callbacks_run():
+    """Test that exact and wildcard subscriptions are all notified."""
+
+    adapter = Adapter()
+    received = []
+
+    async def exact(msg):
+        received.append(("exact", msg))
+
+    async def wildcard(msg, topic):
+        received.append(("wildcard", msg, topic))
+
+    adapter.subscribe("state/sensor/a", exact)
+    adapter.subscribe("state/sensor/+", wildcard)
+
+    adapter._notify_subscriber("state/sensor/a", "1")
+    await asyncio.sleep(0)
+
+    assert sorted(received) == [
+        ("exact", "1"),
+        ("wildcard", "1", "state/sensor/a"),
+    ]
+
+
+async def test_given_client_codec_when_connecting_then_codec_is_negotiated():
+    """Test that a client and a server agree on the codec proposed by the client."""
+
+    client = Adapter(codec=BINARY_CODEC)
+    client._update_connection_status(False, True)
+    server = Adapter()
+    server._update_connection_status(True, True)
+
+    server_side, client_side = RecordingPeer("client"), RecordingPeer("server")
+    client._add_peer(client_side)
+    server._add_peer(server_side)
+    await asyncio.sleep(0)
+
+    hello = decode(client_side.written[0])
+    assert hello["topic"] == HELLO_TOPIC
+
+    server._handle_message(server_side, hello["topic"], hello["message"])
+    await asyncio.sleep(0)
+    assert server_side.codec().name == BINARY_CODEC
+
+    answer = decode(server_side.written[0])
+    client._handle_message(client_side, answer["topic"], answer["message"])
+    assert client_side.codec().name == BINARY_CODEC
+
+
+async def test_given_frame_when_handling_then_payload_is_decoded_once_for_subscribers():
+    """Test that payloads are decoded lazily and shared between callbacks."""
+
+    adapter = Adapter()
+    peer = RecordingPeer("peer")
+    received = []
+
+    async def callback(message):
+        received.append(message)
+
+    adapter.subscribe("state/a", callback)
+    adapter.subscribe("state/+", lambda message, topic: callback(message))
+
+    # Never decoded, as nobody subscribed to the topic
+    adapter._handle_message(peer, "state/b/c", Payload(get_codec(BINARY_CODEC), b""))
+
+    topic, payload = decode_frame(encode("state/a", {"value": 1}))
+    adapter._handle_message(peer, topic, payload)
+    await asyncio.sleep(0)
+
+    assert received == [{"value": 1}, {"value": 1}]
+    assert received[0] is received[1]
+
+
+async def test_given_retained_messages_when_subscribing_then_snapshot_is_delivered():
+    """Test that retained messages reach new subscribers in a single batch."""
+
+    server = Adapter()
+    server._update_connection_status(True, True)
+    assert await server.publish("state/a", 1, retain=True)
+    assert await server.publish("state/b", 2, retain=True)
+    assert await server.publish("event/c", 3)
+
+    server_side = RecordingPeer("client")
+    server._add_peer(server_side)
+    server._handle_message(server_side, SUBSCRIBE_TOPIC, "state/+")
+    await asyncio.sleep(0)
+
+    assert len(server_side.written) == 1
+
+    client = Adapter()
+    received = []
+
+    async def callback(message, topic):
+        received.append((topic, message))
+
+    client.subscribe("state/+", callback)
+
+    topic, payload = decode_frame(server_side.written[0])
+    client._handle_message(RecordingPeer("server"), topic, payload)
+    await asyncio.sleep(0)
+
+    assert received == [("state/a", 1), ("state/b", 2)]
+
+
+async def test_given_batched_subscriptions_when_handling_then_one_snapshot_is_sent():
+    """Test that subscriptions sent together get a single snapshot."""
+
+    server = Adapter()
+    server._update_connection_status(True, True)
+    for i in range(3):
+        assert await server.publish("state/%d" % i, i, retain=True)
+
+    peer = RecordingPeer("client")
+    server._add_peer(peer)
+    server._handle_message(
+        peer,
+        BATCH_TOPIC,
+        [[SUBSCRIBE_TOPIC, "state/0"], [SUBSCRIBE_TOPIC, "state/+"]],
+    )
+    await asyncio.sleep(0)
+
+    # Matching both subscriptions, state/0 is sent once
+    assert [decode(frame) for frame in peer.written] == [
+        {
+            "topic": BATCH_TOPIC,
+            "message": [["state/0", 0], ["state/1", 1], ["state/2", 2]],
+        }
+    ]
+    assert [p.name() for p in server._route("state/1")] == ["client"]
+
+
+async def test_given_bytes_messages_when_batching_then_they_get_frames_of_their_own():
+    """Test that bytes-like messages are split out of batches and snapshots."""
+
+    server = Adapter()
+    server._update_connection_status(True, True)
+    assert await server.publish("state/a", b"\x01", retain=True)
+    assert await server.publish("state/b", 2, retain=True)
+
+    peer = RecordingPeer("client")
+    server._add_peer(peer)
+    server._handle_message(peer, SUBSCRIBE_TOPIC, "state/+")
+    assert await server.publish_batch(
+        [("state/c", 3), ("state/d", 4), ("state/e", b"\x05"), ("state/f", 6)]
+    )
+    await asyncio.sleep(0)
+
+    assert [decode_frame(frame)[0] for frame in peer.written] == [
+        "state/a",
+        "state/b",
+        BATCH_TOPIC,
+        "state/e",
+        "state/f",
+    ]
+
+    client = Adapter()
+    received = []
+
+    async def callback(message, topic):
+        received.append((topic, bytes(message) if topic == "state/e" else message))
+
+    client.subscribe("state/+", callback)
+    for frame in peer.written:
+        client._handle_message(RecordingPeer("server"), *decode_frame(frame))
+    await asyncio.sleep(0)
+
+    assert received == [
+        ("state/a", memoryview(b"\x01")),
+        ("state/b", 2),
+        ("state/c", 3),
+        ("state/d", 4),
+        ("state/e", b"\x05"),
+        ("state/f", 6),
+    ]
+
+
+async def test_given_batch_when_publishing_then_each_peer_gets_one_frame():
+    """Test that batches are split by subscription and frames are shared."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+
+    peers = [RecordingPeer("all"), RecordingPeer("all too"), RecordingPeer("one")]
+    for peer, pattern in zip(peers, ["state/#", "state/#", "state/b"]):
+        adapter._add_peer(peer)
+        adapter._handle_message(peer, SUBSCRIBE_TOPIC, pattern)
+
+    assert await adapter.publish_batch([("state/a", 1), ("state/b", 2)])
+    await asyncio.sleep(0)
+
+    assert decode(peers[0].written[0]) == {
+        "topic": BATCH_TOPIC,
+        "message": [["state/a", 1], ["state/b", 2]],
+    }
+    assert peers[1].written[0] is peers[0].written[0]
+    assert peers[2].written == [encode("state/b", 2)]
+
+
+async def test_given_large_message_when_publishing_then_it_is_sent_in_chunks():
+    """Test that large messages are chunked and reassembled by the receiver."""
+
+    server = Adapter(chunk_size=64)
+    server._update_connection_status(True, True)
+    peer = RecordingPeer("client")
+    server._add_peer(peer)
+    server._handle_message(peer, SUBSCRIBE_TOPIC, "#")
+
+    message = {"text": "é" * 100}
+    assert await server.publish("large", message)
+    assert await server.publish("small", 1)
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    topics = [decode_frame(frame)[0] for frame in peer.written]
+    assert len(topics) > 3 and topics.count("small") == 1
+    assert topics.index("small") < len(topics) - 1
+
+    client = Adapter()
+    server_peer = RecordingPeer("server")
+    client._add_peer(server_peer)
+    received = []
+
+    async def callback(payload):
+        received.append(payload)
+
+    client.subscribe("large", callback)
+    client.subscribe("small", callback)
+    for frame in peer.written:
+        client._handle_message(server_peer, *decode_frame(frame))
+    await asyncio.sleep(0)
+
+    assert received == [1, message]
+
+
+async def test_given_hostile_chunks_when_handling_then_they_are_dropped():
+    """Test that invalid chunk headers do not break the connection."""
+
+    adapter = Adapter()
+    peer = RecordingPeer("client")
+    adapter._add_peer(peer)
+
+    adapter._handle_message(peer, CHUNK_TOPIC, [1, 0, -5, "ab"])
+    adapter._handle_message(peer, CHUNK_TOPIC, [True, 0, 2, "ab"])
+    adapter._handle_message(peer, CHUNK_TOPIC, [2, -1, 2, "ab"])
+
+    assert not peer.is_closed()
+
+
+async def test_given_large_message_when_publishing_on_its_topic_then_order_is_kept():
+    """Test that messages published after a large one on its topic follow it."""
+
+    server = Adapter(chunk_size=64)
+    server._update_connection_status(True, True)
+    peer = RecordingPeer("client")
+    server._add_peer(peer)
+    server._handle_message(peer, SUBSCRIBE_TOPIC, "#")
+
+    message = {"text": "é" * 100}
+    assert await server.publish("large", message)
+    assert await server.publish("large", 1)
+    assert await server.publish_batch([("large", 2), ("small", 3)])
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    client = Adapter()
+    server_peer = RecordingPeer("server")
+    client._add_peer(server_peer)
+    received = []
+
+    async def callback(payload):
+        received.append(payload)
+
+    client.subscribe("large", callback)
+    for frame in peer.written:
+        client._handle_message(server_peer, *decode_frame(frame))
+    await asyncio.sleep(0)
+
+    assert received == [message, 1, 2]
+
+
+async def test_given_priority_classes_when_publishing_then_urgent_frames_go_first():
+    """Test that frames are queued in the priority class of their topic."""
+
+    adapter = Adapter(priority_classes=DEFAULT_PRIORITY_CLASSES)
+    adapter._update_connection_status(True, True)
+    peer = RecordingPeer("client", **adapter._peer_options)
+    adapter._add_peer(peer)
+    adapter._handle_message(peer, SUBSCRIBE_TOPIC, "#")
+    await asyncio.sleep(0)
+
+    assert await adapter.publish("state/a", 1)
+    assert await adapter.publish_batch([("state/b", 2), ("state/c", 3)])
+    assert await adapter.publish("command/response/x", 4)
+    await asyncio.sleep(0)
+
+    assert [decode_frame(frame)[0] for frame in peer.written] == [
+        "command/response/x",
+        "state/a",
+        BATCH_TOPIC,
+    ]
+
+
+async def test_given_bytes_message_when_publishing_then_it_is_sent_raw():
+    """Test that bytes are framed as they are, whole or in chunks."""
+
+    server = Adapter(chunk_size=64)
+    server._update_connection_status(True, True)
+    peer = RecordingPeer("client")
+    server._add_peer(peer)
+    server._handle_message(peer, SUBSCRIBE_TOPIC, "#")
+
+    small = b"\x00\x01\n"
+    large = bytes(range(256)) * 2
+    assert await server.publish("small", small)
+    assert await server.publish("large", memoryview(large))
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+    assert peer.written[0] == encode("small", small)
+    assert len(peer.written) > 2
+
+    client = Adapter()
+    server_peer = RecordingPeer("server")
+    client._add_peer(server_peer)
+    received = []
+
+    async def callback(payload):
+        received.append(payload)
+
+    client.subscribe("small", callback)
+    client.subscribe("large", callback)
+    for frame in peer.written:
+        client._handle_message(server_peer, *decode_frame(frame))
+    await asyncio.sleep(0)
+
+    assert received == [small, large]
+    assert all(isinstance(payload, memoryview) for payload in received)
@@ -0,0 +1,84 @@
+import pytest
+
+from synapse.adapters.chunking import (
+    ChunkAssembler,
+    decode_chunk,
+    encode_header,
+    split,
+)
+from synapse.adapters.errors import ChunkingError
+
+
+def test_given_text_when_splitting_then_characters_are_not_cut():
+    """Test that text chunks end on UTF-8 character boundaries."""
+
+    data = "aéé€".encode("utf-8")
+    chunks = list(split(data, 2, True))
+
+    assert chunks == [(0, "a"), (1, "é"), (3, "é"), (5, "€")]
+
+
+def test_given_chunks_when_feeding_then_message_is_reassembled():
+    """Test that binary chunks are copied into the buffer of their transfer."""
+
+    data = bytes(range(10))
+    assembler = ChunkAssembler()
+    results = [
+        assembler.feed(1, offset, len(data), chunk)
+        for offset, chunk in split(data, 4, False)
+    ]
+
+    assert results[:-1] == [None, None]
+    assert results[-1] == data
+    assert assembler.pending_size() == 0
+
+
+def test_given_transfer_over_limit_when_feeding_then_transfer_is_dropped():
+    """Test the memory limit of incomplete transfers."""
+
+    assembler = ChunkAssembler(max_pending_size=8)
+
+    assert assembler.feed(1, 0, 8, b"aaaa") is None
+    with pytest.raises(ChunkingError):
+        assembler.feed(2, 0, 4, b"bb")
+
+    # The remaining chunks of the dropped transfer are ignored
+    assert assembler.feed(2, 2, 4, b"bb") is None
+    assert assembler.feed(1, 4, 8, b"aaaa") == b"aaaaaaaa"
+    assert assembler.pending_size() == 0
+
+
+def test_given_missing_chunk_when_feeding_then_error_is_raised():
+    """Test that chunks must continue their transfer."""
+
+    assembler = ChunkAssembler()
+    assembler.feed(1, 0, 6, b"aa")
+
+    with pytest.raises(ChunkingError):
+        assembler.feed(1, 4, 6, b"aa")
+    assert assembler.pending_size() == 0
+
+
+def test_given_negative_size_when_feeding_then_error_is_raised():
+    """Test that hostile chunk headers are rejected."""
+
+    assembler = ChunkAssembler()
+
+    with pytest.raises(ChunkingError):
+        assembler.feed(1, 0, -5, b"ab")
+    with pytest.raises(ChunkingError):
+        assembler.feed(1, -2, 4, b"ab")
+    assert assembler.pending_size() == 0
+
+
+def test_given_raw_chunk_when_decoding_then_chunk_is_not_copied():
+    """Test that chunks sent as raw frames are slices of the frame."""
+
+    frame = encode_header(3, 8, 12) + b"abcd"
+    transfer_id, offset, total_size, chunk = decode_chunk(memoryview(frame))
+
+    assert (transfer_id, offset, total_size) == (3, 8, 12)
+    assert chunk == b"abcd" and chunk.obj is frame
+
+    with pytest.raises(ChunkingError):
+        decode_chunk(memoryview(frame[:10]))
@@ -0,0 +1,180 @@
+import asyncio
+
+from synapse.adapters.dispatcher import Dispatcher
+
+
+async def test_given_callback_when_dispatching_then_it_runs_in_its_own_task():
+    """Test that callbacks never run in the task of the reader."""
+
+    dispatcher = Dispatcher()
+    reader = asyncio.current_task()
+    received = []
+
+    async def callback(msg):
+        received.append((msg, asyncio.current_task()))
+        # A timeout of the callback only cancels the callback
+        try:
+            await asyncio.wait_for(asyncio.sleep(1), 0.01)
+        except asyncio.TimeoutError:
+            received.append("timeout")
+
+    dispatcher.dispatch("topic", callback, "message")
+    await asyncio.sleep(0.05)
+
+    assert received[0][0] == "message" and received[0][1] is not reader
+    assert received[1] == "timeout"
+    assert dispatcher.pending() == 0
+
+
+async def test_given_suspending_callbacks_when_dispatching_then_topic_order_is_kept():
+    """Test that messages of one topic are handled in arrival order."""
+
+    dispatcher = Dispatcher()
+    received = []
+
+    async def callback(msg):
+        await asyncio.sleep(0.01 if msg == 0 else 0)
+        received.append(msg)
+
+    for i in range(5):
+        dispatcher.dispatch("topic", callback, i)
+
+    await asyncio.sleep(0.05)
+
+    assert received == [0, 1, 2, 3, 4]
+
+
+async def test_given_concurrency_limit_when_dispatching_then_topics_wait_for_a_worker():
+    """Test that no more topics than allowed are handled at the same time."""
+
+    dispatcher = Dispatcher(max_concurrency=1)
+    release = asyncio.Event()
+    received = []
+
+    async def blocking(msg):
+        await release.wait()
+        received.append(msg)
+
+    async def callback(msg):
+        received.append(msg)
+
+    dispatcher.dispatch("a", blocking, "a")
+    dispatcher.dispatch("b", callback, "b")
+    await asyncio.sleep(0)
+
+    assert received == []
+
+    release.set()
+    await asyncio.sleep(0.01)
+
+    assert received == ["a", "b"]
+
+
+async def test_given_full_topic_queue_when_waiting_for_capacity_then_reader_waits():
+    """Test that a full topic queue applies backpressure until it drains."""
+
+    dispatcher = Dispatcher(max_queue_size=2)
+    release = asyncio.Event()
+
+    async def callback(msg):
+        await release.wait()
+
+    for i in range(3):
+        dispatcher.dispatch("topic", callback, i)
+
+    waiter = asyncio.create_task(dispatcher.wait_for_capacity())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    release.set()
+    await asyncio.wait_for(waiter, 1)
+
+
+async def test_given_failing_callback_when_dispatching_then_next_messages_still_run():
+    """Test that an exception in a callback does not stop its topic."""
+
+    dispatcher = Dispatcher()
+    received = []
+
+    async def callback(msg):
+        await asyncio.sleep(0)
+        if msg == 0:
+            raise ValueError("failure")
+        received.append(msg)
+
+    dispatcher.dispatch("topic", callback, 0)
+    dispatcher.dispatch("topic", callback, 1)
+    await asyncio.sleep(0.01)
+
+    assert received == [1]
+
+
+def test_given_dispatcher_created_before_loop_when_waiting_then_reader_waits():
+    """Test that the dispatcher may be created before the event loop runs."""
+
+    dispatcher = Dispatcher(max_queue_size=1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def callback(msg):
+            await release.wait()
+
+        for i in range(2):
+            dispatcher.dispatch("topic", callback, i)
+
+        waiter = asyncio.ensure_future(dispatcher.wait_for_capacity())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        release.set()
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(main())
+
+
+async def test_given_many_topics_when_waiting_for_capacity_then_total_is_bounded():
+    """Test that messages queued over all topics apply backpressure."""
+
+    dispatcher = Dispatcher(max_concurrency=1, max_pending=10)
+    release = asyncio.Event()
+
+    async def callback(msg):
+        await release.wait()
+
+    for i in range(11):
+        dispatcher.dispatch("topic/%d" % i, callback, i)
+    await asyncio.sleep(0)
+
+    # All but the running one
+    assert dispatcher.pending() == 10
+    waiter = asyncio.ensure_future(dispatcher.wait_for_capacity())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    release.set()
+    await asyncio.wait_for(waiter, 1)
+    await asyncio.sleep(0.01)
+    assert dispatcher.pending() == 0
+
+
+async def test_given_full_topic_when_waiting_for_other_topics_then_reader_goes_on():
+    """Test that a full topic only stalls the readers that dispatched to it."""
+
+    dispatcher = Dispatcher(max_queue_size=2)
+    release = asyncio.Event()
+
+    async def callback(msg):
+        await release.wait()
+
+    dispatcher.dispatch("a", callback, 0)
+    await asyncio.sleep(0)
+    assert [dispatcher.dispatch("a", callback, i) for i in range(2)] == [False, True]
+
+    await asyncio.wait_for(dispatcher.wait_for_capacity(["b"]), 1)
+    waiter = asyncio.ensure_future(dispatcher.wait_for_capacity(["a"]))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    release.set()
+    await asyncio.wait_for(waiter, 1)
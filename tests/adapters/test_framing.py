@@ -0,0 +1,64 @@
+import pytest
+
+from synapse.adapters.errors import FramingError
+from synapse.adapters.framing import FrameDecoder, Framing, encode_frame
+
+
+@pytest.mark.parametrize(
+    "framing", [Framing.LENGTH_PREFIXED, Framing.NEWLINE_DELIMITED]
+)
+def test_given_merged_frames_when_feeding_then_all_frames_are_returned(framing):
+    """Test that several frames received in a single read are all extracted."""
+
+    decoder = FrameDecoder(framing)
+    data = b"".join(encode_frame(body, framing) for body in [b"a", b"bb", b"ccc"])
+
+    assert decoder.feed(data) == [b"a", b"bb", b"ccc"]
+    assert decoder.pending() == 0
+
+
+@pytest.mark.parametrize(
+    "framing", [Framing.LENGTH_PREFIXED, Framing.NEWLINE_DELIMITED]
+)
+def test_given_split_frame_when_feeding_byte_by_byte_then_frame_is_reassembled(
+    framing,
+):
+    """Test that a frame split across many reads is returned once complete."""
+
+    decoder = FrameDecoder(framing)
+    body = b"x" * 4096
+    data = encode_frame(body, framing)
+
+    frames = []
+    for i in range(len(data)):
+        frames.extend(decoder.feed(data[i : i + 1]))
+
+    assert frames == [body]
+    assert decoder.pending() == 0
+
+
+def test_given_partial_trailing_frame_when_feeding_then_it_is_kept_pending():
+    """Test that the incomplete tail of a read is kept for the next read."""
+
+    decoder = FrameDecoder()
+    data = encode_frame(b"first") + encode_frame(b"second")
+
+    assert decoder.feed(data[:-3]) == [b"first"]
+    assert decoder.pending() > 0
+    assert decoder.feed(data[-3:]) == [b"second"]
+
+
+def test_given_oversized_frame_when_feeding_then_framing_error_is_raised():
+    """Test that frames above the configured limit are rejected."""
+
+    decoder = FrameDecoder(max_frame_size=8)
+
+    with pytest.raises(FramingError):
+        decoder.feed(encode_frame(b"x" * 9))
+
+
+def test_given_body_with_newline_when_encoding_newline_frame_then_error_is_raised():
+    """Test that newline framing refuses bodies it cannot delimit."""
+
+    with pytest.raises(FramingError):
+        encode_frame(b"a\nb", Framing.NEWLINE_DELIMITED)
@@ -0,0 +1,299 @@
+import asyncio
+from typing import List
+
+from synapse.adapters.peer import OverflowPolicy, Peer
+
+
+class FakePeer(Peer):
+    def __init__(self, **kwargs) -> None:
+        super().__init__("fake", **kwargs)
+
+        self.written: list[bytes] = []
+        self.is_aborted = False
+        self.is_writable = asyncio.Event()
+        self.is_writable.set()
+
+    async def _write(self, frames: List[bytes]) -> None:
+        await self.is_writable.wait()
+        self.written.extend(frames)
+
+    def _abort(self) -> None:
+        self.is_aborted = True
+
+
+async def test_given_started_peer_when_putting_frames_then_they_are_written_in_order():
+    """Test that queued frames are written by the writer task in order."""
+
+    peer = FakePeer()
+    peer.start()
+
+    for frame in [b"1", b"2", b"3"]:
+        assert peer.put_nowait(frame)
+
+    await asyncio.sleep(0)
+
+    assert peer.written == [b"1", b"2", b"3"]
+    peer.close()
+
+
+async def test_given_full_queue_when_dropping_oldest_then_newest_frames_are_kept():
+    """Test the drop oldest overflow policy."""
+
+    peer = FakePeer(max_queue_size=2, overflow_policy=OverflowPolicy.DROP_OLDEST)
+
+    for frame in [b"1", b"2", b"3"]:
+        assert peer.put_nowait(frame)
+
+    peer.start()
+    await asyncio.sleep(0)
+
+    assert peer.written == [b"2", b"3"]
+    assert peer.dropped_frames() == 1
+    peer.close()
+
+
+async def test_given_full_queue_when_dropping_newest_then_oldest_frames_are_kept():
+    """Test the drop newest overflow policy."""
+
+    peer = FakePeer(max_queue_size=2, overflow_policy=OverflowPolicy.DROP_NEWEST)
+
+    for frame in [b"1", b"2", b"3"]:
+        assert peer.put_nowait(frame)
+
+    peer.start()
+    await asyncio.sleep(0)
+
+    assert peer.written == [b"1", b"2"]
+    assert peer.dropped_frames() == 1
+    peer.close()
+
+
+async def test_given_full_queue_when_disconnecting_then_connection_is_aborted():
+    """Test the disconnect overflow policy."""
+
+    peer = FakePeer(max_queue_size=1, overflow_policy=OverflowPolicy.DISCONNECT)
+
+    peer.put_nowait(b"1")
+    peer.put_nowait(b"2")
+
+    assert peer.is_aborted
+    assert peer.is_closed()
+
+
+async def test_given_full_queue_when_blocking_then_put_waits_for_room():
+    """Test that the block overflow policy waits until the writer makes room."""
+
+    peer = FakePeer(
+        max_queue_size=1, overflow_policy=OverflowPolicy.BLOCK, block_timeout=1
+    )
+
+    assert peer.put_nowait(b"1")
+    assert not peer.put_nowait(b"2")
+
+    put = asyncio.create_task(peer.put(b"2"))
+    await asyncio.sleep(0)
+    assert not put.done()
+
+    peer.start()
+
+    assert await put
+    await asyncio.sleep(0)
+    assert peer.written == [b"1", b"2"]
+    peer.close()
+
+
+async def test_given_full_queue_when_blocking_times_out_then_frame_is_dropped():
+    """Test that a blocked publisher gives up after the timeout."""
+
+    peer = FakePeer(
+        max_queue_size=1, overflow_policy=OverflowPolicy.BLOCK, block_timeout=0.01
+    )
+
+    peer.put_nowait(b"1")
+
+    assert not await peer.put(b"2")
+    assert peer.dropped_frames() == 1
+
+
+async def test_given_queued_frame_when_conflating_then_it_is_replaced_in_place():
+    """Test that a conflated frame replaces the queued frame with the same key."""
+
+    peer = FakePeer()
+
+    peer.put_nowait(b"a1", key="a")
+    peer.put_nowait(b"event")
+    peer.put_nowait(b"a2", key="a")
+    peer.put_nowait(b"b1", key="b")
+
+    assert peer.queue_size() == 3
+    assert peer.conflated_frames() == 1
+
+    peer.start()
+    await asyncio.sleep(0)
+    peer.put_nowait(b"a3", key="a")
+    await asyncio.sleep(0)
+
+    assert peer.written == [b"a2", b"event", b"b1", b"a3"]
+    peer.close()
+
+
+async def test_given_conflated_frame_dropped_when_conflating_then_frame_is_queued():
+    """Test that a frame dropped by the overflow policy is not conflated into."""
+
+    peer = FakePeer(max_queue_size=1, overflow_policy=OverflowPolicy.DROP_OLDEST)
+
+    peer.put_nowait(b"a1", key="a")
+    peer.put_nowait(b"b1", key="b")
+    peer.put_nowait(b"a2", key="a")
+
+    peer.start()
+    await asyncio.sleep(0)
+
+    assert peer.written == [b"a2"]
+    assert peer.conflated_frames() == 0
+    peer.close()
+
+
+async def test_given_transfer_when_writing_then_chunks_are_interleaved_with_frames():
+    """Test that queued frames do not wait for a transfer to be written."""
+
+    peer = FakePeer()
+    peer.is_writable.clear()
+    peer.start()
+
+    peer.put_chunks_nowait(iter([b"c1", b"c2", b"c3"]))
+    await asyncio.sleep(0)
+    peer.put_nowait(b"1")
+    peer.is_writable.set()
+
+    for _ in range(4):
+        await asyncio.sleep(0)
+
+    assert peer.written == [b"c1", b"1", b"c2", b"c3"]
+    assert peer.transfers() == 0
+    peer.close()
+
+
+async def test_given_transfer_when_putting_frames_of_its_topic_then_they_follow_it():
+    """Test that frames of a topic being transferred are held back behind it."""
+
+    peer = FakePeer()
+    peer.is_writable.clear()
+    peer.start()
+
+    peer.put_chunks_nowait(iter([b"a1", b"a2", b"a3"]), topics=["a"])
+    peer.put_chunks_nowait(iter([b"a4", b"a5"]), topics=["a"])
+    peer.put_nowait(b"a6", key="a", topics=["a"])
+    peer.put_nowait(b"a7", key="a", topics=["a"])
+    peer.put_nowait(b"ab", topics=["a", "b"])
+    peer.put_nowait(b"c1", topics=["c"])
+    # Queued after ab, it must not replace a7
+    peer.put_nowait(b"a8", key="a", topics=["a"])
+    peer.is_writable.set()
+
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    assert peer.written == [
+        b"c1",
+        b"a1",
+        b"a2",
+        b"a3",
+        b"a4",
+        b"a5",
+        b"a7",
+        b"ab",
+        b"a8",
+    ]
+    assert peer.conflated_frames() == 1
+    assert peer.transfers() == 0
+    peer.close()
+
+
+async def test_given_stalled_peer_when_putting_transfers_then_queue_stays_bounded():
+    """Test that transfers count against the queue and are conflated."""
+
+    peer = FakePeer(max_queue_size=4)
+    peer.is_writable.clear()
+    peer.start()
+
+    for i in range(200):
+        peer.put_chunks_nowait(iter([b"s%d" % i] * 3), key="s", topics=["s"])
+        await asyncio.sleep(0)
+
+    # The started transfer and the latest state
+    assert peer.queue_size() == 2
+    assert peer.conflated_frames() == 198
+
+    for i in range(10):
+        peer.put_chunks_nowait(iter([b"e%d" % i] * 3), topics=["e%d" % i])
+
+    assert peer.queue_size() == 4
+    assert peer.dropped_frames() == 8
+
+    peer.is_writable.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    # The events pushed out the latest state, the oldest frame not started
+    assert sorted(peer.written) == sorted([b"s0"] * 3 + [b"e7", b"e8", b"e9"] * 3)
+    assert peer.queue_size() == 0
+    peer.close()
+
+
+async def test_given_conflated_frames_behind_transfer_when_writing_then_keys_are_kept():
+    """Test that writing other frames does not end conflation of held frames."""
+
+    for weights in [(1,), (1, 1)]:
+        peer = FakePeer(priority_weights=weights)
+        peer.is_writable.clear()
+        peer.start()
+
+        peer.put_chunks_nowait(iter([b"t1", b"t2"]), topics=["a"])
+        peer.put_nowait(b"A", key="a", topics=["a"])
+        peer.put_nowait(b"other")
+        # The writer waits with the first chunk and the other frame
+        await asyncio.sleep(0)
+        peer.put_nowait(b"B", key="a", topics=["a"])
+
+        peer.is_writable.set()
+        for _ in range(4):
+            await asyncio.sleep(0)
+
+        assert peer.written == [b"other", b"t1", b"t2", b"B"]
+        peer.close()
+
+
+async def test_given_priority_classes_when_writing_then_batches_follow_weights():
+    """Test that high priority frames are written first, by weight."""
+
+    peer = FakePeer(priority_weights=(2, 1))
+    peer.start()
+
+    for frame in [b"l1", b"l2", b"l3", b"l4", b"l5"]:
+        peer.put_nowait(frame, priority=1)
+    for frame in [b"h1", b"h2", b"h3"]:
+        peer.put_nowait(frame, priority=0)
+
+    for _ in range(4):
+        await asyncio.sleep(0)
+
+    assert peer.written == [b"h1", b"h2", b"l1", b"h3", b"l2", b"l3", b"l4", b"l5"]
+    peer.close()
+
+
+async def test_given_priority_classes_when_queue_is_full_then_low_priority_is_dropped():
+    """Test that the drop oldest policy drops low priority frames first."""
+
+    peer = FakePeer(max_queue_size=2, priority_weights=(1, 1))
+
+    peer.put_nowait(b"h1", priority=0)
+    peer.put_nowait(b"l1", priority=1)
+    peer.put_nowait(b"h2", priority=0)
+
+    peer.start()
+    await asyncio.sleep(0)
+
+    assert peer.written == [b"h1", b"h2"]
+    assert peer.dropped_frames() == 1
+    peer.close()
@@ -0,0 +1,40 @@
+import pytest
+
+from synapse.adapters.priority import (
+    DEFAULT_PRIORITY_CLASSES,
+    PriorityClass,
+    TopicPriorities,
+)
+
+
+def test_given_default_classes_when_classifying_then_commands_come_first():
+    """Test the classes of the topics used by the connectors."""
+
+    priorities = TopicPriorities(DEFAULT_PRIORITY_CLASSES)
+
+    assert priorities.classify("command/response/abc") == 0
+    assert priorities.classify("event/alarm") == 1
+    assert priorities.classify("state/telemetry") == 2
+    assert priorities.weights() == (8, 4, 1)
+
+
+def test_given_nested_prefixes_when_classifying_then_longest_prefix_wins():
+    """Test that the most specific prefix decides the class of a topic."""
+
+    priorities = TopicPriorities(
+        [
+            PriorityClass("urgent", 4, ["state/alarm/"]),
+            PriorityClass("bulk", 1, ["state/"]),
+        ]
+    )
+
+    assert priorities.classify("state/alarm/fire") == 0
+    assert priorities.classify("state/alarms") == 1
+    assert priorities.classify("other") == 1
+
+
+def test_given_invalid_weight_when_creating_then_error_is_raised():
+    """Test that every class must get a share of the batches."""
+
+    with pytest.raises(ValueError):
+        TopicPriorities([PriorityClass("none", 0)])
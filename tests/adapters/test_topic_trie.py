@@ -0,0 +1,83 @@
+import pytest
+
+from synapse.adapters.errors import InvalidTopicPatternError
+from synapse.adapters.topic_trie import TopicTrie, matches
+
+
+@pytest.mark.parametrize(
+    "pattern, topic, expected",
+    [
+        ("state/a", "state/a", True),
+        ("state/a", "state/b", False),
+        ("state/+", "state/a", True),
+        ("state/+", "state/a/b", False),
+        ("state/+/temperature", "state/kitchen/temperature", True),
+        ("state/#", "state", True),
+        ("state/#", "state/a/b/c", True),
+        ("state/#", "event/a", False),
+        ("#", "event/a", True),
+    ],
+)
+def test_given_pattern_when_matching_topic_then_wildcards_are_applied(
+    pattern, topic, expected
+):
+    """Test the single and multi level wildcards."""
+
+    trie = TopicTrie()
+    trie.add(pattern, "value")
+
+    assert (trie.match(topic) == ["value"]) is expected
+
+
+def test_given_overlapping_patterns_when_matching_then_values_are_returned_once():
+    """Test that a value matched by several patterns is returned only once."""
+
+    trie = TopicTrie()
+    trie.add("state/#", "a")
+    trie.add("state/+", "a")
+    trie.add("state/x", "b")
+
+    assert sorted(trie.match("state/x")) == ["a", "b"]
+
+
+def test_given_several_values_when_removing_one_then_others_are_kept():
+    """Test that values of a pattern can be removed one by one."""
+
+    trie = TopicTrie()
+    trie.add("state/x", "a")
+    trie.add("state/x", "b")
+
+    assert not trie.add("state/x", "a")
+    assert trie.remove("state/x", "a")
+    assert trie.match("state/x") == ["b"]
+    assert trie.remove("state/x")
+    assert trie.match("state/x") == []
+    assert "state/x" not in trie
+    assert len(trie) == 0
+
+
+@pytest.mark.parametrize("pattern", ["state/#/a", "state/a+", "state/#a"])
+def test_given_invalid_pattern_when_adding_then_error_is_raised(pattern):
+    """Test that misplaced wildcards are rejected."""
+
+    with pytest.raises(InvalidTopicPatternError):
+        TopicTrie().add(pattern, "value")
+
+
+def test_given_patterns_when_matching_single_topic_then_trie_semantics_apply():
+    """Test that matching one pattern agrees with the trie."""
+
+    for pattern, topic, expected in [
+        ("state/a", "state/a", True),
+        ("state/+", "state/a", True),
+        ("state/+", "state/a/b", False),
+        ("state/#", "state", True),
+        ("state/#", "state/a/b", True),
+        ("+/a", "state/b", False),
+        ("state/a/+", "state/a", False),
+    ]:
+        trie = TopicTrie()
+        trie.add(pattern, 1)
+
+        assert matches(pattern, topic) is expected
+        assert bool(trie.match(topic)) is expected
@@ -0,0 +1,205 @@
+from dataclasses import dataclass
+
+import pytest
+
+from synapse.serializers.adapter_message_serializer import (
+    decode,
+    decode_frame,
+    encode,
+    encode_parts,
+    serialize,
+)
+from synapse.serializers.codecs import (
+    BINARY_CODEC,
+    JSON_CODEC,
+    MAX_DEPTH,
+    available_codecs,
+    get_codec,
+)
+from synapse.serializers.errors import (
+    DeserializationError,
+    SerializationError,
+    UnknownCodecError,
+)
+
+VALUE = {
+    "none": None,
+    "bool": [True, False],
+    "int": [0, 127, 128, -1, 2**40, -(2**63)],
+    "float": 2.5,
+    "str": "héllo",
+    "nested": {"list": [1, "two", {"three": 3.0}]},
+}
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_given_value_when_encoding_and_decoding_then_value_is_unchanged(name):
+    codec = get_codec(name)
+
+    assert codec.decode(codec.encode(VALUE)) == VALUE
+
+
+def test_given_small_integer_when_encoding_binary_then_it_takes_one_byte():
+    assert get_codec(BINARY_CODEC).encode(7) == b"\x07"
+
+
+def test_given_big_integer_when_encoding_binary_then_it_is_preserved():
+    codec = get_codec(BINARY_CODEC)
+
+    assert codec.decode(codec.encode(-(10**30))) == -(10**30)
+
+
+def test_given_unsupported_value_when_encoding_binary_then_error_is_raised():
+    with pytest.raises(SerializationError):
+        get_codec(BINARY_CODEC).encode(object())
+
+
+def test_given_truncated_data_when_decoding_binary_then_error_is_raised():
+    codec = get_codec(BINARY_CODEC)
+
+    with pytest.raises(DeserializationError):
+        codec.decode(codec.encode("truncated")[:-1])
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        # A dictionary with a list as key
+        b"\xde\x01\xdc\x00\x01",
+        # Lists nested far beyond the recursion limit
+        b"\xdc\x01" * 100_000 + b"\x01",
+    ],
+)
+def test_given_hostile_data_when_decoding_binary_then_error_is_raised(data):
+    with pytest.raises(DeserializationError):
+        get_codec(BINARY_CODEC).decode(data)
+
+
+def test_given_nesting_up_to_max_depth_when_decoding_binary_then_it_is_accepted():
+    codec = get_codec(BINARY_CODEC)
+    value = 1
+    for _ in range(MAX_DEPTH):
+        value = [value]
+
+    assert codec.decode(codec.encode(value)) == value
+    with pytest.raises(DeserializationError):
+        codec.decode(codec.encode([value]))
+
+
+def test_given_unknown_name_when_getting_codec_then_error_is_raised():
+    with pytest.raises(UnknownCodecError):
+        get_codec("unknown")
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_given_frame_when_decoding_then_codec_is_detected(name):
+    frame = encode("topic", "message", get_codec(name))
+
+    assert decode(frame) == {"topic": "topic", "message": "message"}
+
+
+def test_given_json_frame_when_encoding_then_it_has_no_codec_prefix():
+    assert encode("topic", "message", get_codec(JSON_CODEC)).startswith(b"{")
+
+
+def test_given_legacy_json_message_when_decoding_then_it_is_accepted():
+    assert decode(serialize("topic", "message")) == {
+        "topic": "topic",
+        "message": "message",
+    }
+
+
+def test_given_unknown_codec_id_when_decoding_then_error_is_raised():
+    with pytest.raises(DeserializationError):
+        decode(b"\xff")
+
+
+def test_given_structured_message_when_encoding_then_it_is_not_escaped():
+    frame = encode("state/a", {"key": "value"}, get_codec(JSON_CODEC))
+
+    assert b"\\" not in frame
+    assert decode(frame)["message"] == {"key": "value"}
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_given_frame_when_decoding_header_then_message_is_not_decoded(name):
+    codec = get_codec(name)
+    frame = encode("state/a", [1, 2, 3], codec)
+    # Corrupt the message, the topic can still be read
+    frame = frame[:-2] + b"\xff" + frame[-1:]
+
+    topic, payload = decode_frame(frame)
+
+    assert topic == "state/a"
+    with pytest.raises(DeserializationError):
+        payload.value()
+
+
+def test_given_escaped_json_topic_when_decoding_header_then_topic_is_unescaped():
+    topic, payload = decode_frame(encode('state/"quoted"', "message"))
+
+    assert topic == 'state/"quoted"'
+    assert payload.value() == "message"
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_given_bytes_message_when_decoding_then_it_is_a_view_of_the_frame(name):
+    data = bytearray(b'\x00\n{"raw"}')
+    frame = encode("blob", data, get_codec(name))
+
+    topic, payload = decode_frame(frame)
+    value = payload.value()
+
+    assert topic == "blob"
+    assert isinstance(value, memoryview) and value.obj is frame
+    assert value == data
+
+
+def test_given_parts_when_encoding_then_frame_holds_their_concatenation():
+    assert encode_parts("blob", (b"ab", memoryview(b"cd"))) == encode("blob", b"abcd")
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_given_array_when_decoding_then_it_shares_the_memory_of_the_frame(name):
+    numpy = pytest.importorskip("numpy")
+    arrays = [
+        numpy.arange(12, dtype="<f8").reshape(3, 4),
+        numpy.arange(6, dtype=">i4").reshape(2, 3).T,
+        numpy.zeros((0, 5), dtype="u1"),
+        numpy.array(["a", "bé"]),
+    ]
+
+    for array in arrays:
+        frame = encode("matrix", array, get_codec(name))
+        value = decode_frame(frame)[1].value()
+
+        assert value.dtype == array.dtype and value.shape == array.shape
+        assert numpy.array_equal(value, array)
+        assert not value.flags.writeable and not value.flags.owndata
+
+
+def test_given_invalid_array_when_encoding_or_decoding_then_error_is_raised():
+    numpy = pytest.importorskip("numpy")
+
+    with pytest.raises(SerializationError):
+        encode("matrix", numpy.array([object()]))
+
+    frame = encode("matrix", numpy.arange(4))
+    with pytest.raises(DeserializationError):
+        decode_frame(frame[:-1])[1].value()
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_given_dataclass_when_encoding_then_binary_codecs_leave_out_names(name):
+    @dataclass
+    class Reading:
+        sensor: str
+        value: float
+
+    codec = get_codec(name)
+    decoded = codec.decode(codec.encode({"reading": Reading("a", 1.5)}))
+
+    if codec.is_positional:
+        assert decoded == {"reading": ["a", 1.5]}
+    else:
+        assert decoded == {"reading": {"sensor": "a", "value": 1.5}}
@@ -3,7 +3,9 @@ from synapse.serializers.connector_messsage_serializer import (
     deserialize_payload,
     serialize_payload,
     deserialize_command,
+    deserialize_command_request,
     serialize_command,
+    make_command,
 )
 from synapse.connector import PAYLOAD
 from synapse.serializers.errors import DeserializationError, SerializationError
@@ -64,6 +66,28 @@ class TestConnectorMessageSerializer(unittest.TestCase):
         expected_message = '{"payload": {"key": "value"}, "correlation_id": 1}'
         self.assertEqual(serialize_command(payload, correlation_id), expected_message)
 
+    def test_serialize_command_with_reply_to(self):
+        payload = {"key": "value"}
+        correlation_id = 1
+        expected_message = (
+            '{"payload": {"key": "value"}, "correlation_id": 1, "reply_to": "topic"}'
+        )
+        self.assertEqual(
+            serialize_command(payload, correlation_id, "topic"), expected_message
+        )
+
+    def test_deserialize_command_request_with_reply_to(self):
+        message = '{"payload": {"key": "value"}, "correlation_id": 1, "reply_to": "topic"}'
+        self.assertEqual(
+            deserialize_command_request(message), ({"key": "value"}, 1, "topic")
+        )
+
+    def test_deserialize_command_request_without_reply_to(self):
+        message = '{"payload": {"key": "value"}, "correlation_id": 1}'
+        self.assertEqual(
+            deserialize_command_request(message), ({"key": "value"}, 1, None)
+        )
+
     def test_serialize_command_invalid_command(self):
         class InvalidPayload:
             pass
@@ -72,6 +96,22 @@ class TestConnectorMessageSerializer(unittest.TestCase):
         with self.assertRaises(SerializationError):
             serialize_command(payload, correlation_id) # type: ignore
 
+    def test_make_command_with_reply_to(self):
+        self.assertEqual(
+            make_command({"key": "value"}, 1, "topic"),
+            {"payload": {"key": "value"}, "correlation_id": 1, "reply_to": "topic"},
+        )
+
+    def test_deserialize_command_request_from_dict(self):
+        message = make_command({"key": "value"}, 1, "topic")
+        self.assertEqual(
+            deserialize_command_request(message), ({"key": "value"}, 1, "topic")
+        )
+
+    def test_deserialize_command_from_non_dict(self):
+        with self.assertRaises(DeserializationError):
+            deserialize_command(["payload", 1])  # type: ignore
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,57 @@
+import pytest
+
+from synapse.serializers.connector_messsage_serializer import (
+    make_state_delta,
+    make_state_keyframe,
+    read_state_update,
+)
+from synapse.serializers.delta import apply, diff, snapshot
+from synapse.serializers.errors import DeserializationError
+
+
+def test_given_changed_dict_when_diffing_then_applying_rebuilds_it():
+    old = {"a": 1, "b": {"c": 2, "d": [1]}, "e": None}
+    new = {"a": 1, "b": {"c": 3, "d": [1]}, "f": "new"}
+
+    patch = diff(old, new)
+
+    assert patch == {"s": {"f": "new"}, "d": ["e"], "p": {"b": {"s": {"c": 3}}}}
+    assert apply(old, patch) == new
+
+
+def test_given_diff_when_applying_then_original_is_not_modified():
+    old = {"a": {"b": 1}}
+
+    apply(old, diff(old, {"a": {"b": 2}}))
+
+    assert old == {"a": {"b": 1}}
+
+
+def test_given_non_dict_values_when_diffing_then_no_diff_is_returned():
+    assert diff({"a": 1}, [1]) is None
+    assert diff(None, {"a": 1}) is None
+
+
+def test_given_patch_of_missing_key_when_applying_then_error_is_raised():
+    with pytest.raises(ValueError):
+        apply({}, {"p": {"a": {"s": {"b": 1}}}})
+
+
+def test_given_snapshot_when_modifying_value_then_snapshot_is_unchanged():
+    value = {"a": {"b": [1]}}
+    copy = snapshot(value)
+
+    value["a"]["b"].append(2)
+
+    assert copy == {"a": {"b": [1]}}
+
+
+def test_given_state_updates_when_reading_then_they_are_recognized():
+    assert read_state_update(make_state_keyframe(1, {"a": 1})) == (1, True, {"a": 1})
+    assert read_state_update(make_state_delta(2, {"s": {}})) == (2, False, {"s": {}})
+    assert read_state_update({"a": 1}) is None
+
+
+def test_given_invalid_state_update_when_reading_then_error_is_raised():
+    with pytest.raises(DeserializationError):
+        read_state_update({"$seq": 1})
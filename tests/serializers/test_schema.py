@@ -0,0 +1,70 @@
+import sys
+from dataclasses import dataclass, field, make_dataclass
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+
+from synapse.serializers.errors import DeserializationError
+from synapse.serializers.schema import get_schema
+
+
+@dataclass
+class Point:
+    x: float
+    y: float
+
+
+@dataclass
+class Shape:
+    name: str
+    points: List[Point]
+    origin: Optional[Point] = None
+    tags: Tuple[str, ...] = ()
+    layers: Dict[str, Point] = field(default_factory=dict)
+
+
+SHAPE = Shape(
+    "square", [Point(0, 0), Point(1, 1)], Point(2, 2), ("a",), {"top": Point(3, 3)}
+)
+
+
+def test_given_dataclass_when_encoding_then_both_forms_decode_to_it():
+    schema = get_schema(Shape)
+
+    positional = schema.to_list(SHAPE)
+    named = schema.to_dict(SHAPE)
+
+    assert positional == ["square", [[0, 0], [1, 1]], [2, 2], ("a",), {"top": [3, 3]}]
+    assert named["points"] == [{"x": 0, "y": 0}, {"x": 1, "y": 1}]
+    assert schema.decode(positional) == SHAPE
+    assert schema.decode(named) == SHAPE
+    assert get_schema(Shape) is schema
+
+
+def test_given_missing_trailing_defaults_when_decoding_then_defaults_are_used():
+    schema = get_schema(Shape)
+
+    assert schema.decode(["line", [[0, 1]]]) == Shape("line", [Point(0, 1)])
+    assert schema.decode({"name": "line", "points": []}).layers == {}
+
+
+def test_given_invalid_value_when_decoding_then_error_is_raised():
+    schema = get_schema(Shape)
+
+    for value in (["line"], {"points": []}, ["a", [], None, (), {}, 1], "line"):
+        with pytest.raises(DeserializationError):
+            schema.decode(value)
+
+    with pytest.raises(TypeError):
+        get_schema(dict)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="X | None needs Python 3.10")
+def test_given_pep_604_optional_field_when_decoding_then_it_is_converted():
+    # Built at run time, as the annotation cannot be evaluated before 3.10
+    Segment = make_dataclass("Segment", [("start", Point), ("end", Point | None)])
+    schema = get_schema(Segment)
+
+    assert schema.decode([[0, 1], [2, 3]]) == Segment(Point(0, 1), Point(2, 3))
+    assert schema.decode({"start": {"x": 0, "y": 1}, "end": None}).end is None
+    assert schema.to_list(Segment(Point(0, 1), Point(2, 3))) == [[0, 1], [2, 3]]
@@ -0,0 +1,54 @@
+import time
+
+from synapse.cache import CachePolicy, ResponseCache, canonical_key
+
+
+def test_given_reordered_dict_when_getting_key_then_keys_are_equal():
+    """Test that the key does not depend on the order of dictionary items."""
+
+    assert canonical_key({"a": 1, "b": [1, 2]}) == canonical_key({"b": [1, 2], "a": 1})
+    assert canonical_key({"a": 1}) != canonical_key({"a": 2})
+    assert canonical_key({"a": object()}) is None
+
+
+def test_given_full_cache_when_putting_then_least_recently_used_is_evicted():
+    """Test the size bound of the cache."""
+
+    cache = ResponseCache(CachePolicy(60, max_entries=2))
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("a") == (True, 1)
+    assert cache.get("b") == (False, None)
+    assert cache.get("c") == (True, 3)
+
+
+def test_given_expired_entry_when_getting_then_entry_is_removed(monkeypatch):
+    """Test the time to live of cached results."""
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+
+    cache = ResponseCache(CachePolicy(10))
+    cache.put("a", 1)
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 10)
+
+    assert cache.get("a") == (False, None)
+    assert len(cache) == 0
+
+
+def test_given_invalidation_when_putting_older_result_then_it_is_not_cached():
+    """Test that results computed before an invalidation are discarded."""
+
+    cache = ResponseCache(CachePolicy(60))
+    generation = cache.generation()
+    cache.invalidate("a")
+    cache.put("a", 1, generation)
+
+    assert cache.get("a") == (False, None)
+
+    cache.put("a", 2, cache.generation())
+    assert cache.get("a") == (True, 2)
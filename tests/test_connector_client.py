@@ -0,0 +1,195 @@
+import asyncio
+from dataclasses import dataclass
+
+import pytest
+
+from synapse.adapters import Adapter
+from synapse.connector import COMMAND_CANCEL_TOPIC, STATE_RESYNC_TOPIC
+from synapse.connector_client import ConnectorClient
+from synapse.serializers.connector_messsage_serializer import (
+    deserialize_command_request,
+    make_command,
+    make_state_delta,
+    make_state_keyframe,
+    make_stream_chunk,
+)
+
+
+async def test_given_subscribed_state_when_updated_then_it_is_cached():
+    """Test that received states can be read locally with their version."""
+
+    adapter = Adapter()
+    client = ConnectorClient(adapter)
+    observed = []
+
+    async def callback(payload):
+        pass
+
+    client.subscribe_to_state("a", callback)
+    client.local_state("a").subscribe(observed.append)
+
+    assert client.get_state("a") == (None, 0)
+
+    adapter._notify_subscriber("state/a", {"v": 1})
+    adapter._notify_subscriber("state/a", {"v": 1})
+    adapter._notify_subscriber("state/a", {"v": 2})
+    await asyncio.sleep(0)
+
+    assert client.get_state("a") == ({"v": 2}, 2)
+    assert observed == [{"v": 1}, {"v": 2}]
+
+
+async def test_given_delta_updates_when_received_then_full_value_is_rebuilt():
+    """Test that states sent in delta mode are rebuilt before the callback."""
+
+    adapter = Adapter()
+    client = ConnectorClient(adapter)
+    received = []
+
+    async def callback(payload, name):
+        received.append((name, payload))
+
+    client.subscribe_to_state("+", callback)
+
+    adapter._notify_subscriber("state/a", make_state_keyframe(1, {"x": 1, "y": 1}))
+    adapter._notify_subscriber("state/a", make_state_delta(2, {"s": {"y": 2}}))
+    await asyncio.sleep(0)
+
+    assert received == [("a", {"x": 1, "y": 1}), ("a", {"x": 1, "y": 2})]
+    assert client.get_state("a") == ({"x": 1, "y": 2}, 2)
+
+
+async def test_given_missed_delta_when_received_then_keyframe_is_requested_once():
+    """Test that a gap in the sequence asks the server for the full value."""
+
+    adapter = Adapter()
+    client = ConnectorClient(adapter)
+    requests = []
+    received = []
+
+    async def publish(topic, message, conflate=False, retain=False):
+        requests.append((topic, message))
+        return True
+
+    async def callback(payload):
+        received.append(payload)
+
+    adapter.publish = publish
+    client.subscribe_to_state("a", callback)
+
+    adapter._notify_subscriber("state/a", make_state_keyframe(1, {"x": 1}))
+    adapter._notify_subscriber("state/a", make_state_delta(3, {"s": {"x": 3}}))
+    adapter._notify_subscriber("state/a", make_state_delta(4, {"s": {"x": 4}}))
+    await asyncio.sleep(0)
+
+    assert requests == [(STATE_RESYNC_TOPIC, "a")]
+    assert received == [{"x": 1}]
+
+    adapter._notify_subscriber("state/a", make_state_keyframe(4, {"x": 4}))
+    adapter._notify_subscriber("state/a", make_state_delta(5, {"s": {"x": 5}}))
+    await asyncio.sleep(0)
+
+    assert received == [{"x": 1}, {"x": 4}, {"x": 5}]
+    assert client.get_state("a")[0] == {"x": 5}
+
+
+async def test_given_array_states_when_received_then_each_one_is_an_update():
+    """Test that states without a single truth value when compared are cached."""
+
+    numpy = pytest.importorskip("numpy")
+    adapter = Adapter()
+    client = ConnectorClient(adapter)
+    received = []
+
+    async def callback(payload):
+        received.append(payload)
+
+    client.subscribe_to_state("matrix", callback)
+
+    adapter._notify_subscriber("state/matrix", numpy.zeros((2, 2)))
+    adapter._notify_subscriber("state/matrix", numpy.ones((2, 2)))
+    await asyncio.sleep(0)
+
+    value, version = client.get_state("matrix")
+    assert len(received) == 2 and version == 2
+    assert numpy.array_equal(value, numpy.ones((2, 2)))
+
+
+async def test_given_schema_when_state_is_received_then_callback_gets_instance():
+    """Test that states are delivered and cached as instances of their schema."""
+
+    @dataclass
+    class Reading:
+        sensor: str
+        value: float
+
+    adapter = Adapter()
+    client = ConnectorClient(adapter)
+    received = []
+
+    async def callback(payload):
+        received.append(payload)
+
+    client.subscribe_to_state("reading", callback, schema=Reading)
+
+    adapter._notify_subscriber("state/reading", ["a", 1.5])
+    adapter._notify_subscriber("state/reading", {"sensor": "b", "value": 2.5})
+    adapter._notify_subscriber("state/reading", "invalid")
+    await asyncio.sleep(0)
+
+    assert received == [Reading("a", 1.5), Reading("b", 2.5)]
+    assert client.get_state("reading") == (Reading("b", 2.5), 2)
+
+
+async def test_given_single_flight_when_sending_identical_commands_then_one_is_sent():
+    """Test that concurrent identical commands share one request."""
+
+    adapter = Adapter()
+    client = ConnectorClient(adapter)
+    requests = []
+
+    async def publish(topic, message, conflate=False, retain=False):
+        requests.append(message)
+        return True
+
+    adapter.publish = publish
+
+    calls = asyncio.gather(
+        client.send_command("a", {"x": 1}, single_flight=True),
+        client.send_command("a", {"x": 1}, single_flight=True),
+    )
+    await asyncio.sleep(0.01)
+
+    assert len(requests) == 1
+    _, correlation_id, reply_to = deserialize_command_request(requests[0])
+    adapter._notify_subscriber(reply_to, make_command(2, correlation_id))
+
+    assert await calls == [(2, True), (2, True)]
+
+
+async def test_given_stream_when_consumer_stops_early_then_command_is_cancelled():
+    """Test that streamed chunks are yielded and early stops cancel the command."""
+
+    adapter = Adapter()
+    client = ConnectorClient(adapter)
+    requests = []
+
+    async def publish(topic, message, conflate=False, retain=False):
+        requests.append((topic, message))
+        return True
+
+    adapter.publish = publish
+
+    stream = client.stream_command("a", None, window=2)
+    first = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0)
+
+    _, correlation_id, reply_to = deserialize_command_request(requests[0][1])
+    adapter._notify_subscriber(reply_to, make_stream_chunk(correlation_id, 1))
+
+    assert await first == 1
+
+    await stream.aclose()
+    await asyncio.sleep(0)
+
+    assert [topic for topic, _ in requests] == ["command/a", COMMAND_CANCEL_TOPIC]
@@ -0,0 +1,406 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+from synapse.adapters import Adapter
+from synapse.adapters.adapter import SUBSCRIBE_TOPIC
+from synapse.adapters.peer import Peer
+from synapse.connector import (
+    COMMAND_BATCH_TOPIC,
+    COMMAND_CANCEL_TOPIC,
+    COMMAND_CREDIT_TOPIC,
+    STATE_RESYNC_TOPIC,
+)
+from synapse.connector_server import ConnectorServer
+from synapse.serializers.adapter_message_serializer import decode
+from synapse.serializers.connector_messsage_serializer import (
+    make_command,
+    make_command_error,
+    make_state_delta,
+    make_state_keyframe,
+    make_stream_chunk,
+)
+
+REPLY_TOPIC = "command/response/client"
+
+
+@dataclass
+class Target:
+    x: int
+    y: int
+
+
+class RecordingPeer(Peer):
+    def __init__(self) -> None:
+        super().__init__("client")
+
+        self.written: list = []
+
+    async def _write(self, frames: list) -> None:
+        self.written.extend(frames)
+
+    def _abort(self) -> None:
+        pass
+
+
+async def test_given_command_batch_when_processing_then_one_response_is_sent():
+    """Test that batched commands are answered in order in a single frame."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter)
+
+    async def echo(payload):
+        await asyncio.sleep(0.01 * (3 - payload))
+        return payload
+
+    async def fail(payload):
+        raise RuntimeError("failed")
+
+    server.register_command("echo", echo)
+    server.register_command("fail", fail)
+
+    peer = RecordingPeer()
+    adapter._add_peer(peer)
+
+    batch = [["echo", 1], ["echo", 2], ["fail", 3], ["unknown", 4]]
+    adapter._handle_message(
+        peer, COMMAND_BATCH_TOPIC, make_command(batch, 7, REPLY_TOPIC)
+    )
+    await asyncio.sleep(0.1)
+
+    assert len(peer.written) == 1
+    assert decode(peer.written[0]) == {
+        "topic": REPLY_TOPIC,
+        "message": make_command(
+            [[1, True], [2, True], [None, False], [None, False]], 7
+        ),
+    }
+
+
+async def test_given_other_clients_when_answering_then_only_requester_gets_response():
+    """Test that responses are written to the requester only, on its topic."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter)
+
+    async def echo(payload):
+        return payload
+
+    server.register_command("echo", echo)
+
+    requester, other = RecordingPeer(), RecordingPeer()
+    for peer in (requester, other):
+        adapter._add_peer(peer)
+    adapter._handle_message(other, SUBSCRIBE_TOPIC, "#")
+
+    adapter._handle_message(requester, "command/echo", make_command(1, 1, REPLY_TOPIC))
+    adapter._handle_message(
+        requester, "command/echo", make_command(2, 2, "state/temperature")
+    )
+    await asyncio.sleep(0.01)
+
+    assert [decode(frame) for frame in requester.written] == [
+        {"topic": REPLY_TOPIC, "message": make_command(1, 1)}
+    ]
+    assert other.written == []
+
+
+async def test_given_too_many_requests_when_processing_then_commands_wait():
+    """Test that requests beyond the limit wait for a running one to finish."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter, max_requests=1)
+    release = asyncio.Event()
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+        await release.wait()
+        return payload
+
+    server.register_command("a", handler)
+
+    for i in range(2):
+        adapter._notify_subscriber("command/a", make_command(i, i, REPLY_TOPIC))
+    await asyncio.sleep(0.01)
+
+    assert calls == [0]
+
+    release.set()
+    await asyncio.sleep(0.01)
+
+    assert calls == [0, 1]
+
+
+async def test_given_expired_command_when_processing_then_handler_is_skipped():
+    """Test that commands past their deadline are not processed."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter)
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+        return payload
+
+    server.register_command("a", handler)
+
+    adapter._notify_subscriber(
+        "command/a", make_command(1, 1, REPLY_TOPIC, deadline=time.time() - 1)
+    )
+    await asyncio.sleep(0)
+
+    assert calls == []
+
+
+async def test_given_running_command_when_cancelled_then_handler_is_cancelled():
+    """Test that clients can cancel commands still being processed."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter)
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def handler(payload):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    server.register_command("a", handler)
+
+    adapter._notify_subscriber("command/a", make_command(1, 1, REPLY_TOPIC))
+    await asyncio.wait_for(started.wait(), 1)
+    adapter._notify_subscriber(COMMAND_CANCEL_TOPIC, make_command(None, 1, REPLY_TOPIC))
+
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+async def test_given_failing_handler_when_processing_then_error_is_sent():
+    """Test that handler errors are answered with an error response."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter)
+
+    def handler(payload):
+        raise ValueError("invalid")
+
+    server.register_command("a", handler)
+
+    peer = RecordingPeer()
+    adapter._add_peer(peer)
+
+    adapter._handle_message(peer, "command/a", make_command(1, 7, REPLY_TOPIC))
+    await asyncio.sleep(0.01)
+
+    assert decode(peer.written[0])["message"] == make_command_error(7, "invalid")
+
+
+async def test_given_single_flight_when_identical_commands_arrive_then_handler_runs_once():
+    """Test that concurrent identical commands share one execution."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter)
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    server.register_command("a", handler, single_flight=True)
+
+    peer = RecordingPeer()
+    adapter._add_peer(peer)
+
+    for correlation_id in range(3):
+        adapter._handle_message(
+            peer, "command/a", make_command({"x": 1}, correlation_id, REPLY_TOPIC)
+        )
+    await asyncio.sleep(0.05)
+
+    assert calls == [{"x": 1}]
+    assert sorted(
+        decode(frame)["message"]["correlation_id"] for frame in peer.written
+    ) == [0, 1, 2]
+    assert all(decode(frame)["message"]["payload"] == 1 for frame in peer.written)
+
+
+async def test_given_streaming_handler_when_processing_then_chunks_follow_credit():
+    """Test that streamed chunks are only sent while the client has credit."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter)
+
+    async def handler(payload):
+        for i in range(payload):
+            yield i
+
+    server.register_command("a", handler)
+
+    peer = RecordingPeer()
+    adapter._add_peer(peer)
+
+    adapter._handle_message(
+        peer, "command/a", make_command(3, 7, REPLY_TOPIC, credit=2)
+    )
+    await asyncio.sleep(0.01)
+
+    assert [decode(frame)["message"] for frame in peer.written] == [
+        make_stream_chunk(7, 0),
+        make_stream_chunk(7, 1),
+    ]
+
+    adapter._handle_message(peer, COMMAND_CREDIT_TOPIC, make_command(2, 7, REPLY_TOPIC))
+    await asyncio.sleep(0.01)
+
+    assert [decode(frame)["message"] for frame in peer.written[2:]] == [
+        make_stream_chunk(7, 2),
+        make_command(None, 7),
+    ]
+
+
+async def test_given_keyframe_interval_when_publishing_states_then_keyframes_recur():
+    """Test that the full value is sent again after every keyframe interval."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter, state_delta=True, keyframe_interval=2)
+
+    peer = RecordingPeer()
+    adapter._add_peer(peer)
+    adapter._handle_message(peer, SUBSCRIBE_TOPIC, "state/#")
+
+    for x in range(5):
+        await server.publish_state("a", {"x": x})
+    await asyncio.sleep(0)
+
+    assert [decode(frame)["message"] for frame in peer.written] == [
+        make_state_keyframe(1, {"x": 0}),
+        make_state_delta(2, {"s": {"x": 1}}),
+        make_state_delta(3, {"s": {"x": 2}}),
+        make_state_keyframe(4, {"x": 3}),
+        make_state_delta(5, {"s": {"x": 4}}),
+    ]
+
+
+async def test_given_resync_request_when_processing_then_only_requester_gets_keyframe():
+    """Test that a client missing an update gets the current value on its own."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter, state_delta=True)
+
+    requester, other = RecordingPeer(), RecordingPeer()
+    for peer in (requester, other):
+        adapter._add_peer(peer)
+        adapter._handle_message(peer, SUBSCRIBE_TOPIC, "state/#")
+
+    await server.publish_state("a", {"x": 1})
+    await server.publish_state("a", {"x": 2})
+    await asyncio.sleep(0)
+    requester.written.clear()
+    other.written.clear()
+
+    adapter._handle_message(requester, STATE_RESYNC_TOPIC, "a")
+    await asyncio.sleep(0.01)
+
+    assert [decode(frame) for frame in requester.written] == [
+        {"topic": "state/a", "message": make_state_keyframe(2, {"x": 2})}
+    ]
+    assert other.written == []
+
+    await server.publish_state("a", {"x": 3})
+    await asyncio.sleep(0)
+
+    assert decode(requester.written[-1])["message"] == make_state_delta(
+        3, {"s": {"x": 3}}
+    )
+
+
+async def test_given_bytes_state_in_delta_mode_when_publishing_then_it_is_sent_as_is():
+    """Test that bytes states are never diffed and are followed by a keyframe."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter, state_delta=True)
+
+    peer = RecordingPeer()
+    adapter._add_peer(peer)
+    adapter._handle_message(peer, SUBSCRIBE_TOPIC, "state/#")
+
+    await server.publish_state("a", {"x": 1})
+    await server.publish_state("a", b"\x00blob")
+    await server.publish_state("a", {"x": 2})
+    await asyncio.sleep(0)
+
+    messages = [decode(frame)["message"] for frame in peer.written]
+    assert messages == [
+        make_state_keyframe(1, {"x": 1}),
+        b"\x00blob",
+        make_state_keyframe(2, {"x": 2}),
+    ]
+    assert isinstance(messages[1], memoryview)
+
+
+async def test_given_bytes_and_json_states_when_publishing_then_all_are_sent():
+    """Test that bytes states are sent on their own, next to the batched states."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter)
+
+    peer = RecordingPeer()
+    adapter._add_peer(peer)
+    adapter._handle_message(peer, SUBSCRIBE_TOPIC, "state/#")
+
+    await server.publish_states({"temp": 22, "cam": b"\x02", "humidity": 40})
+    await asyncio.sleep(0)
+
+    assert [decode(frame) for frame in peer.written] == [
+        {"topic": "state/temp", "message": 22},
+        {"topic": "state/cam", "message": b"\x02"},
+        {"topic": "state/humidity", "message": 40},
+    ]
+
+
+async def test_given_schema_when_processing_command_then_payload_is_typed():
+    """Test that payloads encoded by position or name reach the handler typed."""
+
+    adapter = Adapter()
+    adapter._update_connection_status(True, True)
+    server = ConnectorServer(adapter)
+    received = []
+
+    async def move(target: Target):
+        received.append(target)
+        return target
+
+    server.register_command("move", move, schema=Target)
+
+    peer = RecordingPeer()
+    adapter._add_peer(peer)
+
+    adapter._handle_message(peer, "command/move", make_command([1, 2], 1, REPLY_TOPIC))
+    adapter._handle_message(
+        peer, "command/move", make_command({"x": 3, "y": 4}, 2, REPLY_TOPIC)
+    )
+    adapter._handle_message(peer, "command/move", make_command("up", 3, REPLY_TOPIC))
+    await asyncio.sleep(0.05)
+
+    assert received == [Target(1, 2), Target(3, 4)]
+    responses = [decode(frame)["message"] for frame in peer.written]
+    assert responses[:2] == [
+        make_command({"x": 1, "y": 2}, 1),
+        make_command({"x": 3, "y": 4}, 2),
+    ]
+    assert responses[2]["correlation_id"] == 3 and "error" in responses[2]
@@ -0,0 +1,199 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from synapse.cache import CachePolicy
+from synapse.errors import CommandRejectedError
+from synapse.execution import CommandExecutor
+
+
+async def test_given_thread_pool_when_running_then_handler_runs_off_the_loop():
+    """Test that plain callables run in the given pool."""
+
+    with ThreadPoolExecutor(1) as pool:
+        executor = CommandExecutor("a", lambda _: threading.get_ident(), pool)
+
+        assert await executor.run(None) != threading.get_ident()
+
+
+async def test_given_inline_policy_when_running_then_sync_and_async_handlers_work():
+    """Test that inline executors accept plain callables and coroutines."""
+
+    async def handler(payload):
+        return payload + 1
+
+    assert await CommandExecutor("a", lambda payload: payload + 1).run(1) == 2
+    assert await CommandExecutor("a", handler).run(1) == 2
+
+
+async def test_given_full_queue_when_running_then_call_is_rejected():
+    """Test the concurrency limit and queue depth of a command."""
+
+    release = asyncio.Event()
+
+    async def handler(payload):
+        await release.wait()
+        return payload
+
+    executor = CommandExecutor("a", handler, max_concurrency=1, max_queue_size=1)
+
+    running = asyncio.ensure_future(executor.run(1))
+    waiting = asyncio.ensure_future(executor.run(2))
+    await asyncio.sleep(0)
+
+    assert executor.waiting() == 1
+    with pytest.raises(CommandRejectedError):
+        await executor.run(3)
+
+    release.set()
+    assert await asyncio.gather(running, waiting) == [1, 2]
+
+
+async def test_given_cancelled_pool_call_when_running_then_slot_is_held_until_it_returns():
+    """Test that a pool call frees its slot only once its handler returned."""
+
+    started, release = threading.Event(), threading.Event()
+
+    def handler(payload):
+        started.set()
+        release.wait()
+        return payload
+
+    with ThreadPoolExecutor(2) as pool:
+        executor = CommandExecutor("a", handler, pool, max_concurrency=1)
+
+        cancelled = asyncio.ensure_future(executor.run(1))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        waiting = asyncio.ensure_future(executor.run(2))
+        await asyncio.sleep(0.01)
+        try:
+            assert executor.waiting() == 1
+        finally:
+            release.set()
+        assert await asyncio.wait_for(waiting, 1) == 2
+
+
+def test_given_executor_created_before_loop_when_running_then_calls_wait():
+    """Test that an executor may be created before the event loop runs."""
+
+    async def handler(payload):
+        await asyncio.sleep(0)
+        return payload
+
+    executor = CommandExecutor("a", handler, max_concurrency=1)
+
+    async def main():
+        return await asyncio.gather(executor.run(1), executor.run(2))
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_given_coroutine_handler_when_using_pool_then_error_is_raised():
+    """Test that coroutine handlers cannot be sent to a pool."""
+
+    async def handler(payload):
+        return payload
+
+    with ThreadPoolExecutor(1) as pool:
+        with pytest.raises(ValueError):
+            CommandExecutor("a", handler, pool)
+
+
+async def test_given_cache_when_running_then_handler_runs_once_per_payload():
+    """Test that cached results are reused until invalidated."""
+
+    calls = []
+
+    def handler(payload):
+        calls.append(payload)
+        return len(calls)
+
+    executor = CommandExecutor("a", handler, cache=CachePolicy(60))
+
+    assert await executor.run({"x": 1, "y": 2}) == 1
+    assert await executor.run({"y": 2, "x": 1}) == 1
+    assert await executor.run({"x": 2}) == 2
+
+    executor.invalidate({"x": 1, "y": 2})
+    assert await executor.run({"x": 1, "y": 2}) == 3
+    assert await executor.run({"x": 2}) == 2
+
+    executor.invalidate()
+    assert await executor.run({"x": 2}) == 4
+
+
+async def test_given_invalidation_while_running_when_finishing_then_result_is_not_cached():
+    """Test that a result computed before an invalidation is not cached."""
+
+    version = [1]
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def handler(payload):
+        result = version[0]
+        started.set()
+        await release.wait()
+        return result
+
+    executor = CommandExecutor("a", handler, cache=CachePolicy(60), single_flight=True)
+
+    stale = asyncio.ensure_future(executor.run(1))
+    await started.wait()
+    version[0] = 2
+    executor.invalidate(1)
+    fresh = asyncio.ensure_future(executor.run(1))
+
+    release.set()
+    assert await asyncio.gather(stale, fresh) == [1, 2]
+    assert await executor.run(1) == 2
+
+
+async def test_given_single_flight_when_all_callers_cancel_then_call_is_cancelled():
+    """Test that shared calls only run while someone waits for them."""
+
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def handler(payload):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    executor = CommandExecutor("a", handler, single_flight=True)
+
+    first = asyncio.ensure_future(executor.run(1))
+    second = asyncio.ensure_future(executor.run(1))
+    await started.wait()
+
+    first.cancel()
+    await asyncio.sleep(0)
+    assert not cancelled.is_set()
+
+    second.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+async def test_given_streaming_handler_when_streaming_then_slot_is_held_until_closed():
+    """Test that streaming handlers count against the concurrency limit."""
+
+    async def handler(payload):
+        for i in range(payload):
+            yield i
+
+    executor = CommandExecutor("a", handler, max_concurrency=1, max_queue_size=0)
+
+    stream = executor.stream(3)
+    assert await stream.__anext__() == 0
+    with pytest.raises(CommandRejectedError):
+        await executor.stream(1).__anext__()
+
+    await stream.aclose()
+    assert [chunk async for chunk in executor.stream(2)] == [0, 1]
+    with pytest.raises(CommandRejectedError):
+        await executor.run(1)